@@ -1,4 +1,6 @@
 from .core.entry import MemoBaseClient, User, ChatBlob
+from .core.async_entry import AsyncMemoBaseClient, AsyncUser
+from .core.buffer import BufferedWriter
 
 __author__ = "memobase.io"
 __version__ = "0.0.11"
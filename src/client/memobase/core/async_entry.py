@@ -0,0 +1,368 @@
+import os
+import json
+import httpx
+import asyncio
+from typing import Optional, AsyncIterator, Awaitable, Iterable, TypeVar
+from pydantic import HttpUrl
+from dataclasses import dataclass
+from .blob import BlobData, Blob, BlobType
+from .user import UserProfile, UserProfileData, UserEventData, FlushJobData
+from .entry import profiles_to_json, context_batch_requests
+from ..network import unpack_response, unpack_sse_line
+from ..error import ServerError
+from ..utils import LOG
+
+T = TypeVar("T")
+
+
+async def bounded_gather(aws: Iterable[Awaitable[T]], limit: int) -> list[T]:
+    """asyncio.gather with at most `limit` awaitables running at once"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run(aw) for aw in aws])
+
+
+def profile_params(
+    max_token_size: int = 1000,
+    prefer_topics: list[str] = None,
+    only_topics: list[str] = None,
+    max_subtopic_size: int = None,
+    topic_limits: dict[str, int] = None,
+) -> dict:
+    params = {"max_token_size": max_token_size}
+    if prefer_topics:
+        params["prefer_topics"] = prefer_topics
+    if only_topics:
+        params["only_topics"] = only_topics
+    if max_subtopic_size:
+        params["max_subtopic_size"] = max_subtopic_size
+    if topic_limits:
+        params["topic_limits_json"] = json.dumps(topic_limits)
+    return params
+
+
+@dataclass
+class AsyncMemoBaseClient:
+    api_key: Optional[str] = None
+    api_version: str = "api/v1"
+    project_url: str = "https://api.memobase.dev"
+    http2: bool = True
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30
+    max_concurrency: int = 16  # of the fan-out helpers
+
+    def __post_init__(self):
+        self.api_key = self.api_key or os.getenv("MEMOBASE_API_KEY")
+        assert (
+            self.api_key is not None
+        ), "api_key of memobase client is required, pass it as argument or set it as environment variable(MEMOBASE_API_KEY)"
+        self.base_url = str(HttpUrl(self.project_url)) + self.api_version.strip("/")
+
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+            },
+            timeout=60,
+            # HTTP/2 is negotiated over TLS only, plain http stays on HTTP/1.1
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "AsyncMemoBaseClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def ping(self) -> bool:
+        try:
+            unpack_response(await self._client.get("/healthcheck"))
+        except httpx.HTTPStatusError as e:
+            LOG.error(f"Healthcheck failed: {e}")
+            return False
+        except ServerError as e:
+            LOG.error(f"Healthcheck failed: {e}")
+            return False
+        return True
+
+    async def get_config(self) -> str:
+        r = unpack_response(await self._client.get("/project/profile_config"))
+        return r.data["profile_config"]
+
+    async def update_config(self, config: str) -> bool:
+        r = unpack_response(
+            await self._client.post(
+                "/project/profile_config", json={"profile_config": config}
+            )
+        )
+        return True
+
+    async def add_user(self, data: dict = None, id=None) -> str:
+        r = unpack_response(
+            await self._client.post("/users", json={"data": data, "id": id})
+        )
+        return r.data["id"]
+
+    async def update_user(self, user_id: str, data: dict = None) -> str:
+        r = unpack_response(
+            await self._client.put(f"/users/{user_id}", json={"data": data})
+        )
+        return r.data["id"]
+
+    async def get_user(self, user_id: str, no_get=False) -> "AsyncUser":
+        if not no_get:
+            r = unpack_response(await self._client.get(f"/users/{user_id}"))
+            return AsyncUser(
+                user_id=user_id,
+                project_client=self,
+                fields=r.data,
+            )
+        return AsyncUser(user_id=user_id, project_client=self)
+
+    async def get_or_create_user(self, user_id: str) -> "AsyncUser":
+        try:
+            return await self.get_user(user_id)
+        except ServerError:
+            await self.add_user(id=user_id)
+        return AsyncUser(user_id=user_id, project_client=self)
+
+    async def delete_user(self, user_id: str) -> bool:
+        r = unpack_response(await self._client.delete(f"/users/{user_id}"))
+        return True
+
+    async def get_profiles(
+        self, user_ids: list[str], **profile_kwargs
+    ) -> dict[str, list[UserProfile]]:
+        """Fetch the profiles of many users, at most `max_concurrency` requests at once"""
+        results = await bounded_gather(
+            [
+                AsyncUser(user_id=u, project_client=self).profile(**profile_kwargs)
+                for u in user_ids
+            ],
+            self.max_concurrency,
+        )
+        return dict(zip(user_ids, results))
+
+    async def get_contexts(
+        self, user_ids: list[str], **context_kwargs
+    ) -> dict[str, str]:
+        """Fetch the contexts of many users, up to 100 users per request"""
+        results = await bounded_gather(
+            [
+                self._client.post("/users/context/batch", json=body)
+                for body in context_batch_requests(user_ids, **context_kwargs)
+            ],
+            self.max_concurrency,
+        )
+        contexts = {}
+        for r in results:
+            contexts.update(unpack_response(r).data["contexts"])
+        return contexts
+
+
+@dataclass
+class AsyncUser:
+    user_id: str
+    project_client: AsyncMemoBaseClient
+    fields: Optional[dict] = None
+
+    async def insert(self, blob_data: Blob) -> str:
+        r = unpack_response(
+            await self.project_client.client.post(
+                f"/blobs/insert/{self.user_id}",
+                json=blob_data.to_request(),
+            )
+        )
+        return r.data["id"]
+
+    async def insert_many(self, blobs: list[Blob]) -> list[str]:
+        """Insert blobs concurrently, the returned ids keep the order of `blobs`"""
+        return await bounded_gather(
+            [self.insert(b) for b in blobs], self.project_client.max_concurrency
+        )
+
+    async def get(self, blob_id: str) -> Blob:
+        r = unpack_response(
+            await self.project_client.client.get(f"/blobs/{self.user_id}/{blob_id}")
+        )
+        return BlobData.model_validate(r.data).to_blob()
+
+    async def get_all(
+        self, blob_type: BlobType, page: int = 0, page_size: int = 10
+    ) -> list[str]:
+        r = unpack_response(
+            await self.project_client.client.get(
+                f"/users/blobs/{self.user_id}/{blob_type}",
+                params={"page": page, "page_size": page_size},
+            )
+        )
+        return r.data["ids"]
+
+    async def iter_blobs(
+        self, blob_type: BlobType, page_size: int = 100
+    ) -> AsyncIterator[str]:
+        params = {"page_size": page_size}
+        while True:
+            r = unpack_response(
+                await self.project_client.client.get(
+                    f"/users/blobs/{self.user_id}/{blob_type}", params=params
+                )
+            )
+            for i in r.data["ids"]:
+                yield i
+            params["cursor"] = r.data.get("next_cursor")
+            if not params["cursor"]:
+                return
+
+    async def delete(self, blob_id: str) -> bool:
+        r = unpack_response(
+            await self.project_client.client.delete(f"/blobs/{self.user_id}/{blob_id}")
+        )
+        return True
+
+    async def flush(self, blob_type: BlobType = BlobType.chat) -> bool:
+        r = unpack_response(
+            await self.project_client.client.post(
+                f"/users/buffer/{self.user_id}/{blob_type}"
+            )
+        )
+        return True
+
+    async def start_flush(self, blob_type: BlobType = BlobType.chat) -> str:
+        """Flush in the background, return the job id to follow its progress"""
+        r = unpack_response(
+            await self.project_client.client.post(
+                f"/users/buffer/{self.user_id}/{blob_type}", params={"wait": False}
+            )
+        )
+        return r.data["id"]
+
+    async def flush_job(self, job_id: str) -> FlushJobData:
+        r = unpack_response(
+            await self.project_client.client.get(
+                f"/users/buffer/{self.user_id}/jobs/{job_id}"
+            )
+        )
+        return FlushJobData.model_validate(r.data)
+
+    async def watch_flush_job(self, job_id: str) -> AsyncIterator[FlushJobData]:
+        """Yield the job on every progress update until it's done or failed"""
+        async with self.project_client.client.stream(
+            "GET",
+            f"/users/buffer/{self.user_id}/jobs/{job_id}/stream",
+            timeout=httpx.Timeout(60, read=None),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                r = unpack_sse_line(line)
+                if r is not None:
+                    yield FlushJobData.model_validate(r.data)
+
+    async def profile(
+        self,
+        max_token_size: int = 1000,
+        prefer_topics: list[str] = None,
+        only_topics: list[str] = None,
+        max_subtopic_size: int = None,
+        topic_limits: dict[str, int] = None,
+        need_json: bool = False,
+    ) -> list[UserProfile]:
+        r = unpack_response(
+            await self.project_client.client.get(
+                f"/users/profile/{self.user_id}",
+                params=profile_params(
+                    max_token_size,
+                    prefer_topics,
+                    only_topics,
+                    max_subtopic_size,
+                    topic_limits,
+                ),
+            )
+        )
+        data = r.data["profiles"]
+        ds_profiles = [UserProfileData.model_validate(p).to_ds() for p in data]
+        if need_json:
+            return profiles_to_json(ds_profiles)
+        return ds_profiles
+
+    async def delete_profile(self, profile_id: str) -> bool:
+        r = unpack_response(
+            await self.project_client.client.delete(
+                f"/users/profile/{self.user_id}/{profile_id}"
+            )
+        )
+        return True
+
+    async def event(self, topk=10) -> list[UserEventData]:
+        r = unpack_response(
+            await self.project_client.client.get(
+                f"/users/event/{self.user_id}", params={"topk": topk}
+            )
+        )
+        return [UserEventData.model_validate(e) for e in r.data["events"]]
+
+    async def iter_events(self, page_size: int = 100) -> AsyncIterator[UserEventData]:
+        params = {"topk": page_size}
+        while True:
+            r = unpack_response(
+                await self.project_client.client.get(
+                    f"/users/event/{self.user_id}", params=params
+                )
+            )
+            for e in r.data["events"]:
+                yield UserEventData.model_validate(e)
+            params["cursor"] = r.data.get("next_cursor")
+            if not params["cursor"]:
+                return
+
+    async def iter_profiles(self, page_size: int = 100) -> AsyncIterator[UserProfile]:
+        params = {"page_size": page_size}
+        while True:
+            r = unpack_response(
+                await self.project_client.client.get(
+                    f"/users/profile/{self.user_id}", params=params
+                )
+            )
+            for p in r.data["profiles"]:
+                yield UserProfileData.model_validate(p).to_ds()
+            params["cursor"] = r.data.get("next_cursor")
+            if not params["cursor"]:
+                return
+
+    async def context(
+        self,
+        max_token_size: int = 1000,
+        prefer_topics: list[str] = None,
+        only_topics: list[str] = None,
+        max_subtopic_size: int = None,
+        topic_limits: dict[str, int] = None,
+        profile_event_ratio: float = None,
+    ) -> str:
+        params = profile_params(
+            max_token_size, prefer_topics, only_topics, max_subtopic_size, topic_limits
+        )
+        if profile_event_ratio:
+            params["profile_event_ratio"] = profile_event_ratio
+        r = unpack_response(
+            await self.project_client.client.get(
+                f"/users/context/{self.user_id}", params=params
+            )
+        )
+        return r.data["context"]
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import atexit
+import random
+import httpx
+import threading
+from typing import Optional
+from pydantic import TypeAdapter
+from .blob import Blob, BlobType, ChatBlob, DocBlob, CodeBlob, ImageBlob, TranscriptBlob
+from .entry import MemoBaseClient
+from ..error import ServerError
+from ..utils import LOG
+
+AnyBlob = TypeAdapter(ChatBlob | DocBlob | CodeBlob | ImageBlob | TranscriptBlob)
+
+
+def coalesce_blobs(blobs: list[Blob], max_messages: int) -> list[Blob]:
+    """Merge consecutive ChatBlobs with the same fields into one blob"""
+    results = []
+    for b in blobs:
+        if b.type != BlobType.chat:
+            results.append(b)
+            continue
+        messages = [
+            (
+                m.model_copy(update={"created_at": b.created_at.isoformat()})
+                if m.created_at is None and b.created_at is not None
+                else m
+            )
+            for m in b.messages
+        ]
+        last = results[-1] if len(results) else None
+        if (
+            last is not None
+            and last.type == BlobType.chat
+            and last.fields == b.fields
+            and len(last.messages) + len(messages) <= max_messages
+        ):
+            last.messages.extend(messages)
+            continue
+        results.append(
+            ChatBlob(messages=messages, fields=b.fields, created_at=b.created_at)
+        )
+    return results
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """Seconds the server asked to wait in its Retry-After header, if any"""
+    if not isinstance(e, httpx.HTTPStatusError):
+        return None
+    try:
+        return float(e.response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class BufferedWriter:
+    """Write-behind inserts: blobs are queued per user and sent from a background thread
+
+    A user's queue is sent once it holds `batch_size` blobs or its oldest blob
+    waited `flush_interval` seconds; consecutive chat blobs are merged into one
+    insert. Failed sends are retried with exponential backoff, or after the
+    server's Retry-After when it sheds load.
+    With `spill_path`, queued blobs are journaled to disk and re-queued by the
+    next writer on the same path, so a crash doesn't lose them.
+    """
+
+    def __init__(
+        self,
+        client: MemoBaseClient,
+        batch_size: int = 8,
+        flush_interval: float = 5,
+        max_batch_messages: int = 64,
+        max_pending: int = 10000,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        spill_path: Optional[str] = None,
+        max_spill_bytes: int = 16 * 1024 * 1024,
+    ):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_batch_messages = max_batch_messages
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spill_path = spill_path
+        self.max_spill_bytes = max_spill_bytes
+
+        self._pending: dict[str, list[tuple[float, Blob]]] = {}
+        self._pending_count = 0
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        if self.spill_path is not None:
+            self._replay_spill()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def insert(self, user_id: str, blob: Blob) -> bool:
+        """Queue the blob, return False if the writer is full
+
+        Raises RuntimeError once the writer is closed.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BufferedWriter is closed")
+            if self._pending_count >= self.max_pending:
+                LOG.warning(f"BufferedWriter is full, drop blob of user {user_id}")
+                return False
+            self._pending.setdefault(user_id, []).append((time.monotonic(), blob))
+            self._pending_count += 1
+            self._journal(user_id, blob)
+            if len(self._pending[user_id]) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything queued now, return False if `timeout` is reached first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending_count or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        if self._closed:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def _due_users(self, force: bool) -> list[str]:
+        now = time.monotonic()
+        return [
+            user_id
+            for user_id, blobs in self._pending.items()
+            if force
+            or len(blobs) >= self.batch_size
+            or now - blobs[0][0] >= self.flush_interval
+        ]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._flush_requested and not self._pending_count:
+                        self._flush_requested = False
+                    force = self._flush_requested or self._closed
+                    due = self._due_users(force)
+                    if due or (self._closed and not self._pending_count):
+                        break
+                    self._cond.wait(self.flush_interval)
+                if not due:
+                    return
+                batches = {user_id: self._pending.pop(user_id) for user_id in due}
+                sent = sum(len(blobs) for blobs in batches.values())
+                self._pending_count -= sent
+                self._in_flight += sent
+
+            try:
+                for user_id, blobs in batches.items():
+                    self._send(user_id, [b for _, b in blobs])
+            finally:
+                # Whatever happens to the batch, flush() and close() must not hang
+                with self._cond:
+                    self._in_flight -= sent
+                    if not self._pending_count and not self._in_flight:
+                        self._flush_requested = False
+                        self._truncate_spill()
+                    self._cond.notify_all()
+
+    def _send(self, user_id: str, blobs: list[Blob]):
+        user = self.client.get_user(user_id, no_get=True)
+        for blob in coalesce_blobs(blobs, self.max_batch_messages):
+            for attempt in range(self.max_retries + 1):
+                try:
+                    user.insert(blob)
+                    break
+                except (httpx.HTTPError, ServerError) as e:
+                    if not is_retryable(e) or attempt == self.max_retries:
+                        LOG.error(f"Failed to insert blob of user {user_id}: {e}")
+                        break
+                    delay = min(self.max_backoff, self.backoff * 2**attempt)
+                    delay *= random.uniform(0.5, 1)
+                    # An overloaded server sheds inserts with a Retry-After
+                    time.sleep(max(delay, retry_after(e) or 0))
+                except Exception as e:
+                    # e.g. a response that doesn't parse, retrying won't help
+                    LOG.error(f"Drop blob of user {user_id}, failed to insert: {e}")
+                    break
+
+    def _journal(self, user_id: str, blob: Blob):
+        if self.spill_path is None:
+            return
+        if os.path.exists(self.spill_path):
+            if os.path.getsize(self.spill_path) >= self.max_spill_bytes:
+                LOG.warning(
+                    f"Spill file {self.spill_path} is full, blob kept in memory only"
+                )
+                return
+        with open(self.spill_path, "a") as f:
+            f.write(
+                json.dumps({"user_id": user_id, "blob": blob.model_dump(mode="json")})
+                + "\n"
+            )
+
+    def _truncate_spill(self):
+        if self.spill_path is not None and os.path.exists(self.spill_path):
+            os.truncate(self.spill_path, 0)
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        replayed = 0
+        with open(self.spill_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    blob = AnyBlob.validate_python(record["blob"])
+                except Exception as e:
+                    LOG.error(f"Skip broken line in spill file {self.spill_path}: {e}")
+                    continue
+                self._pending.setdefault(record["user_id"], []).append(
+                    (time.monotonic(), blob)
+                )
+                replayed += 1
+        self._pending_count += replayed
+        if replayed:
+            LOG.info(f"Re-queued {replayed} blobs from {self.spill_path}")
@@ -2,12 +2,12 @@ import os
 import json
 import httpx
 from collections import defaultdict
-from typing import Optional
+from typing import Optional, Iterator
 from pydantic import HttpUrl
 from dataclasses import dataclass
 from .blob import BlobData, Blob, BlobType, ChatBlob
-from .user import UserProfile, UserProfileData, UserEventData
-from ..network import unpack_response
+from .user import UserProfile, UserProfileData, UserEventData, FlushJobData
+from ..network import unpack_response, unpack_sse_line
 from ..error import ServerError
 from ..utils import LOG
 
@@ -24,6 +24,37 @@ def profiles_to_json(profiles: list[UserProfile]) -> dict:
     return dict(results)
 
 
+MAX_CONTEXT_BATCH_USERS = 100
+
+
+def context_batch_requests(
+    user_ids: list[str],
+    max_token_size: int = 1000,
+    prefer_topics: list[str] = None,
+    only_topics: list[str] = None,
+    max_subtopic_size: int = None,
+    topic_limits: dict[str, int] = None,
+    profile_event_ratio: float = None,
+) -> list[dict]:
+    """Bodies of `/users/context/batch`, one per `MAX_CONTEXT_BATCH_USERS` users"""
+    params = {"max_token_size": max_token_size}
+    if prefer_topics:
+        params["prefer_topics"] = prefer_topics
+    if only_topics:
+        params["only_topics"] = only_topics
+    if max_subtopic_size:
+        params["max_subtopic_size"] = max_subtopic_size
+    if topic_limits:
+        params["topic_limits"] = topic_limits
+    if profile_event_ratio:
+        params["profile_event_ratio"] = profile_event_ratio
+    user_ids = list(dict.fromkeys(user_ids))
+    return [
+        {"user_ids": user_ids[i : i + MAX_CONTEXT_BATCH_USERS], **params}
+        for i in range(0, len(user_ids), MAX_CONTEXT_BATCH_USERS)
+    ]
+
+
 @dataclass
 class MemoBaseClient:
     api_key: Optional[str] = None
@@ -101,6 +132,14 @@ class MemoBaseClient:
         r = unpack_response(self._client.delete(f"/users/{user_id}"))
         return True
 
+    def get_contexts(self, user_ids: list[str], **context_kwargs) -> dict[str, str]:
+        """Fetch the contexts of many users, up to 100 users per request"""
+        contexts = {}
+        for body in context_batch_requests(user_ids, **context_kwargs):
+            r = unpack_response(self._client.post("/users/context/batch", json=body))
+            contexts.update(r.data["contexts"])
+        return contexts
+
 
 @dataclass
 class User:
@@ -131,6 +170,22 @@ class User:
         )
         return r.data["ids"]
 
+    def iter_blobs(self, blob_type: BlobType, page_size: int = 100) -> Iterator[str]:
+        cursor = None
+        while True:
+            params = f"?page_size={page_size}"
+            if cursor:
+                params += f"&cursor={cursor}"
+            r = unpack_response(
+                self.project_client.client.get(
+                    f"/users/blobs/{self.user_id}/{blob_type}{params}"
+                )
+            )
+            yield from r.data["ids"]
+            cursor = r.data.get("next_cursor")
+            if not cursor:
+                return
+
     def delete(self, blob_id: str) -> bool:
         r = unpack_response(
             self.project_client.client.delete(f"/blobs/{self.user_id}/{blob_id}")
@@ -143,6 +198,36 @@ class User:
         )
         return True
 
+    def start_flush(self, blob_type: BlobType = BlobType.chat) -> str:
+        """Flush in the background, return the job id to follow its progress"""
+        r = unpack_response(
+            self.project_client.client.post(
+                f"/users/buffer/{self.user_id}/{blob_type}", params={"wait": False}
+            )
+        )
+        return r.data["id"]
+
+    def flush_job(self, job_id: str) -> FlushJobData:
+        r = unpack_response(
+            self.project_client.client.get(
+                f"/users/buffer/{self.user_id}/jobs/{job_id}"
+            )
+        )
+        return FlushJobData.model_validate(r.data)
+
+    def watch_flush_job(self, job_id: str) -> Iterator[FlushJobData]:
+        """Yield the job on every progress update until it's done or failed"""
+        with self.project_client.client.stream(
+            "GET",
+            f"/users/buffer/{self.user_id}/jobs/{job_id}/stream",
+            timeout=httpx.Timeout(60, read=None),
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                r = unpack_sse_line(line)
+                if r is not None:
+                    yield FlushJobData.model_validate(r.data)
+
     def profile(
         self,
         max_token_size: int = 1000,
@@ -186,6 +271,36 @@ class User:
         )
         return [UserEventData.model_validate(e) for e in r.data["events"]]
 
+    def iter_events(self, page_size: int = 100) -> Iterator[UserEventData]:
+        cursor = None
+        while True:
+            params = f"?topk={page_size}"
+            if cursor:
+                params += f"&cursor={cursor}"
+            r = unpack_response(
+                self.project_client.client.get(f"/users/event/{self.user_id}{params}")
+            )
+            for e in r.data["events"]:
+                yield UserEventData.model_validate(e)
+            cursor = r.data.get("next_cursor")
+            if not cursor:
+                return
+
+    def iter_profiles(self, page_size: int = 100) -> Iterator[UserProfile]:
+        cursor = None
+        while True:
+            params = f"?page_size={page_size}"
+            if cursor:
+                params += f"&cursor={cursor}"
+            r = unpack_response(
+                self.project_client.client.get(f"/users/profile/{self.user_id}{params}")
+            )
+            for p in r.data["profiles"]:
+                yield UserProfileData.model_validate(p).to_ds()
+            cursor = r.data.get("next_cursor")
+            if not cursor:
+                return
+
     def context(
         self,
         max_token_size: int = 1000,
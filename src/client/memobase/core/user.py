@@ -57,3 +57,28 @@ class UserEventData(BaseModel):
     updated_at: datetime = Field(
         None, description="Timestamp when the event was last updated"
     )
+
+
+class FlushJobData(BaseModel):
+    id: str = Field(..., description="The flush job's unique identifier")
+    user_id: str = Field(..., description="The ID of the user")
+    blob_type: str = Field(..., description="The type of the flushed buffer")
+    status: str = Field(..., description="pending, running, done or failed")
+    stage: Optional[str] = Field(None, description="The stage running right now")
+    stage_seconds: dict[str, float] = Field(
+        default_factory=dict, description="Seconds spent in each finished stage"
+    )
+    blobs: int = Field(0, description="Number of flushed blobs")
+    facts_extracted: int = Field(0, description="Number of facts extracted")
+    profiles_added: int = Field(0, description="Number of profiles added")
+    profiles_updated: int = Field(0, description="Number of profiles updated")
+    profiles_deleted: int = Field(0, description="Number of profiles deleted")
+    errmsg: Optional[str] = Field(None, description="Error message of a failed job")
+    created_at: datetime = Field(..., description="Timestamp when the job was created")
+    finished_at: Optional[datetime] = Field(
+        None, description="Timestamp when the job finished"
+    )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
@@ -1,3 +1,4 @@
+from typing import Optional
 from httpx import Response
 from .core.type import BaseResponse
 
@@ -9,3 +10,12 @@ def unpack_response(response: Response) -> BaseResponse:
     r = BaseResponse.model_validate(response.json())
     r.raise_for_status()
     return r
+
+
+def unpack_sse_line(line: str) -> Optional[BaseResponse]:
+    """Unpack the `data:` line of a Server-Sent Event, other lines return None"""
+    if not line.startswith("data:"):
+        return None
+    r = BaseResponse.model_validate_json(line[len("data:") :])
+    r.raise_for_status()
+    return r
@@ -1,10 +1,18 @@
+import time
+import queue
+import httpx
+import asyncio
 import threading
+from typing import Optional
+from collections import OrderedDict
 from openai import OpenAI, AsyncOpenAI
 from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
-from openai._streaming import Stream
+from openai._streaming import Stream, AsyncStream
 from ..core.entry import MemoBaseClient, User, ChatBlob
-from ..core.user import UserProfile
+from ..core.async_entry import AsyncMemoBaseClient, AsyncUser
+from ..core.user import UserProfile, UserProfileData
+from ..network import unpack_response
 from ..utils import string_to_uuid, LOG
 from ..error import ServerError
 
@@ -18,18 +26,39 @@ Use the information to generate a more personalized response for me.
 
 
 def openai_memory(
-    openai_client: OpenAI | AsyncOpenAI, mb_client: MemoBaseClient
+    openai_client: OpenAI | AsyncOpenAI,
+    mb_client: MemoBaseClient | AsyncMemoBaseClient,
+    max_pending_inserts: int = 1024,
+    profile_cache_size: int = 1024,
+    profile_cache_ttl: float = 60,
 ) -> OpenAI | AsyncOpenAI:
     if hasattr(openai_client, "_memobase_patched"):
         return openai_client
 
     openai_client._memobase_patched = True
-    openai_client.get_profile = _get_profile(mb_client)
-    openai_client.flush = _flush(mb_client)
+    profile_cache = ProfilePromptCache(profile_cache_size, profile_cache_ttl)
     if isinstance(openai_client, OpenAI):
-        openai_client.chat.completions.create = _sync_chat(openai_client, mb_client)
+        insert_worker = InsertWorker(max_pending_inserts)
+        openai_client.get_profile = _get_profile(mb_client)
+        openai_client.flush = _flush(mb_client, profile_cache)
+        openai_client.wait_memory_inserts = insert_worker.join
+        openai_client.chat.completions.create = _sync_chat(
+            openai_client, mb_client, insert_worker, profile_cache
+        )
     elif isinstance(openai_client, AsyncOpenAI):
-        raise ValueError(f"AsyncOpenAI is not supported yet")
+        if isinstance(mb_client, MemoBaseClient):
+            mb_client = AsyncMemoBaseClient(
+                api_key=mb_client.api_key,
+                api_version=mb_client.api_version,
+                project_url=mb_client.project_url,
+            )
+        insert_worker = AsyncInsertWorker(max_pending_inserts)
+        openai_client.get_profile = _async_get_profile(mb_client)
+        openai_client.flush = _async_flush(mb_client, profile_cache)
+        openai_client.wait_memory_inserts = insert_worker.join
+        openai_client.chat.completions.create = _async_chat(
+            openai_client, mb_client, insert_worker, profile_cache
+        )
     else:
         raise ValueError(f"Invalid openai_client type: {type(openai_client)}")
     return openai_client
@@ -43,30 +72,137 @@ def _get_profile(mb_client: MemoBaseClient):
     return get_profile
 
 
-def _flush(mb_client: MemoBaseClient):
+def _flush(mb_client: MemoBaseClient, profile_cache: "ProfilePromptCache"):
     def flush(u_string) -> list[UserProfile]:
         uid = string_to_uuid(u_string)
+        profile_cache.invalidate(uid)
         return mb_client.get_user(uid, no_get=True).flush()
 
     return flush
 
 
+def _async_get_profile(mb_client: AsyncMemoBaseClient):
+    async def get_profile(u_string) -> list[UserProfile]:
+        uid = string_to_uuid(u_string)
+        u = await mb_client.get_user(uid, no_get=True)
+        return await u.profile()
+
+    return get_profile
+
+
+def _async_flush(mb_client: AsyncMemoBaseClient, profile_cache: "ProfilePromptCache"):
+    async def flush(u_string) -> bool:
+        uid = string_to_uuid(u_string)
+        profile_cache.invalidate(uid)
+        u = await mb_client.get_user(uid, no_get=True)
+        return await u.flush()
+
+    return flush
+
+
+class InsertWorker:
+    """One daemon thread draining a bounded queue of chat inserts"""
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, messages: ChatBlob, user: User):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((messages, user))
+        except queue.Full:
+            LOG.warning("Memobase insert queue is full, drop the message")
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            messages, user = self._queue.get()
+            try:
+                add_message_to_user(messages, user)
+            except Exception as e:
+                # The thread is never restarted, one bad insert must not kill it
+                LOG.error(f"Failed to insert message: {e}")
+            finally:
+                self._queue.task_done()
+
+
+class AsyncInsertWorker:
+    """One task on the running loop draining a bounded queue of chat inserts"""
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    def submit(self, messages: ChatBlob, user: AsyncUser):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            # asyncio.Queue is bound to the loop that first uses it
+            if self._loop is not loop:
+                self._queue = asyncio.Queue(maxsize=self._maxsize)
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+        try:
+            self._queue.put_nowait((messages, user))
+        except asyncio.QueueFull:
+            LOG.warning("Memobase insert queue is full, drop the message")
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _run(self):
+        while True:
+            messages, user = await self._queue.get()
+            try:
+                await async_add_message_to_user(messages, user)
+            except Exception as e:
+                LOG.error(f"Failed to insert message: {e}")
+            finally:
+                self._queue.task_done()
+
+
 def add_message_to_user(messages: ChatBlob, user: User):
     try:
         r = user.insert(messages)
         LOG.debug(f"Insert {messages}")
-    except ServerError as e:
+    except (ServerError, httpx.HTTPError) as e:
         LOG.error(f"Failed to insert message: {e}")
 
 
-def user_profile_insert(messages, u: User):
-    profiles = u.profile()
+async def async_add_message_to_user(messages: ChatBlob, user: AsyncUser):
+    # The user is only created when the first insert finds it missing
+    try:
+        try:
+            await user.insert(messages)
+        except ServerError:
+            await user.project_client.get_or_create_user(user.user_id)
+            await user.insert(messages)
+        LOG.debug(f"Insert {messages}")
+    except (ServerError, httpx.HTTPError) as e:
+        LOG.error(f"Failed to insert message: {e}")
+
+
+def render_profile_prompt(profiles: list[UserProfile]) -> str:
     if not len(profiles):
-        return messages
+        return ""
     user_profile_string = "\n".join(
         [f"- {p.topic}/{p.sub_topic}: {p.content}" for p in profiles]
     )
-    sys_prompt = PROMPT.format(user_profile=user_profile_string)
+    return PROMPT.format(user_profile=user_profile_string)
+
+
+def insert_profile_prompt(messages, sys_prompt: str):
+    if not sys_prompt:
+        return messages
     if messages[0]["role"] == "system":
         messages[0]["content"] += sys_prompt
     else:
@@ -74,7 +210,102 @@ def user_profile_insert(messages, u: User):
     return messages
 
 
-def _sync_chat(client: OpenAI, mb_client: MemoBaseClient):
+def user_profile_insert(messages, u: User):
+    return insert_profile_prompt(messages, render_profile_prompt(u.profile()))
+
+
+class ProfilePromptCache:
+    """Per-user LRU of rendered profile prompts
+
+    Within `ttl` seconds a cached prompt is used without asking the server,
+    after that it is revalidated with If-None-Match and kept on 304.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries: OrderedDict[str, tuple[Optional[str], str, float]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[tuple[Optional[str], str, bool]]:
+        """Return (etag, prompt, is_fresh) of the user"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(user_id)
+        etag, prompt, expires_at = entry
+        return etag, prompt, time.monotonic() < expires_at
+
+    def put(self, user_id: str, etag: Optional[str], prompt: str):
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (etag, prompt, time.monotonic() + self._ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def request_headers(self, cached) -> dict:
+        if cached is None or cached[0] is None:
+            return {}
+        return {"If-None-Match": cached[0]}
+
+    def update(self, user_id: str, cached, response: httpx.Response) -> str:
+        if response.status_code == 304 and cached is not None:
+            self.put(user_id, cached[0], cached[1])
+            return cached[1]
+        r = unpack_response(response)
+        profiles = [
+            UserProfileData.model_validate(p).to_ds() for p in r.data["profiles"]
+        ]
+        prompt = render_profile_prompt(profiles)
+        self.put(user_id, response.headers.get("ETag"), prompt)
+        return prompt
+
+
+# Same query as User.profile() with the default arguments
+PROFILE_PARAMS = {"max_token_size": 1000}
+
+
+def cached_profile_prompt(u: User, profile_cache: ProfilePromptCache) -> str:
+    cached = profile_cache.get(u.user_id)
+    if cached is not None and cached[2]:
+        return cached[1]
+    response = u.project_client.client.get(
+        f"/users/profile/{u.user_id}",
+        params=PROFILE_PARAMS,
+        headers=profile_cache.request_headers(cached),
+    )
+    return profile_cache.update(u.user_id, cached, response)
+
+
+async def async_cached_profile_prompt(
+    u: AsyncUser, profile_cache: ProfilePromptCache
+) -> str:
+    cached = profile_cache.get(u.user_id)
+    if cached is not None and cached[2]:
+        return cached[1]
+    response = await u.project_client.client.get(
+        f"/users/profile/{u.user_id}",
+        params=PROFILE_PARAMS,
+        headers=profile_cache.request_headers(cached),
+    )
+    return profile_cache.update(u.user_id, cached, response)
+
+
+def _sync_chat(
+    client: OpenAI,
+    mb_client: MemoBaseClient,
+    insert_worker: InsertWorker,
+    profile_cache: ProfilePromptCache,
+):
     _create_chat = client.chat.completions.create
 
     def sync_chat(*args, **kwargs) -> ChatCompletion | Stream[ChatCompletionChunk]:
@@ -96,8 +327,14 @@ def _sync_chat(client: OpenAI, mb_client: MemoBaseClient):
             else:
                 return (r for r in _create_chat(*args, **kwargs))
 
-        u = mb_client.get_or_create_user(user_id)
-        kwargs["messages"] = user_profile_insert(kwargs["messages"], u)
+        if profile_cache.get(user_id) is None:
+            u = mb_client.get_or_create_user(user_id)
+        else:
+            # Seen before, the user exists
+            u = mb_client.get_user(user_id, no_get=True)
+        kwargs["messages"] = insert_profile_prompt(
+            kwargs["messages"], cached_profile_prompt(u, profile_cache)
+        )
         response = _create_chat(*args, **kwargs)
 
         if is_streaming:
@@ -126,7 +363,7 @@ def _sync_chat(client: OpenAI, mb_client: MemoBaseClient):
                         {"role": "assistant", "content": total_response},
                     ]
                 )
-                threading.Thread(target=add_message_to_user, args=(messages, u)).start()
+                insert_worker.submit(messages, u)
 
             return yield_response_and_log()
 
@@ -142,10 +379,90 @@ def _sync_chat(client: OpenAI, mb_client: MemoBaseClient):
                     {"role": "assistant", "content": r_string},
                 ]
             )
-            threading.Thread(target=add_message_to_user, args=(messages, u)).start()
+            insert_worker.submit(messages, u)
             return response
 
     return sync_chat
 
 
-# TODO support async openai
+def _async_chat(
+    client: AsyncOpenAI,
+    mb_client: AsyncMemoBaseClient,
+    insert_worker: AsyncInsertWorker,
+    profile_cache: ProfilePromptCache,
+):
+    _create_chat = client.chat.completions.create
+
+    async def async_chat(
+        *args, **kwargs
+    ) -> ChatCompletion | AsyncStream[ChatCompletionChunk]:
+        is_streaming = kwargs.get("stream", False)
+        user_id = kwargs.pop("user_id", None)
+        if user_id is None:
+            return await _create_chat(*args, **kwargs)
+
+        user_id = string_to_uuid(user_id)
+        user_query = kwargs["messages"][-1]
+        if user_query["role"] != "user":
+            LOG.warning(f"Last query is not user query: {user_query}")
+            return await _create_chat(*args, **kwargs)
+
+        u = await mb_client.get_user(user_id, no_get=True)
+        try:
+            sys_prompt = await async_cached_profile_prompt(u, profile_cache)
+        except (ServerError, httpx.HTTPError) as e:
+            LOG.error(f"Failed to get user profile: {e}")
+            sys_prompt = ""
+        kwargs["messages"] = insert_profile_prompt(list(kwargs["messages"]), sys_prompt)
+        response = await _create_chat(*args, **kwargs)
+
+        if is_streaming:
+
+            async def yield_response_and_log():
+                total_response = ""
+                r_role = None
+
+                async for r in response:
+                    yield r
+                    try:
+                        r_string = r.choices[0].delta.content
+                        r_role = r_role or r.choices[0].delta.role
+                        total_response += r_string or ""
+                    except Exception:
+                        continue
+                if not len(total_response):
+                    return
+                if r_role != "assistant":
+                    LOG.warning(f"Last response is not assistant response: {r_role}")
+                    return
+
+                insert_worker.submit(
+                    ChatBlob(
+                        messages=[
+                            {"role": "user", "content": user_query["content"]},
+                            {"role": "assistant", "content": total_response},
+                        ]
+                    ),
+                    u,
+                )
+
+            return yield_response_and_log()
+
+        else:
+            r_role = response.choices[0].message.role
+            if r_role != "assistant":
+                LOG.warning(f"Last response is not assistant response: {r_role}")
+                return response
+            r_string = response.choices[0].message.content
+            insert_worker.submit(
+                ChatBlob(
+                    messages=[
+                        {"role": "user", "content": user_query["content"]},
+                        {"role": "assistant", "content": r_string},
+                    ]
+                ),
+                u,
+            )
+            return response
+
+    return async_chat
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from memobase import AsyncMemoBaseClient
+from memobase.core.blob import DocBlob
+from memobase.core.blob import BlobType
+from memobase.error import ServerError
+
+
+@pytest.fixture
+def async_client(api_client):
+    return AsyncMemoBaseClient(
+        project_url=api_client.project_url,
+        api_key=api_client.api_key,
+    )
+
+
+def test_async_blob_curd_client(async_client):
+    async def run():
+        async with async_client as a:
+            u = await a.add_user()
+            ud = await a.get_user(u)
+            bs = await ud.insert_many(
+                [DocBlob(content=f"test {i}", fields={"1": "fool"}) for i in range(5)]
+            )
+            assert {b async for b in ud.iter_blobs(BlobType.doc, page_size=2)} == set(
+                bs
+            )
+            assert (await ud.get(bs[0])).content == "test 0"
+            assert await ud.delete(bs[0])
+            with pytest.raises(ServerError):
+                await ud.get(bs[0])
+            await a.delete_user(u)
+
+    asyncio.run(run())
+
+
+def test_async_fan_out(async_client):
+    async def run():
+        async with async_client as a:
+            us = [await a.add_user() for _ in range(3)]
+            contexts = await a.get_contexts(us, max_token_size=500)
+            assert list(contexts) == us
+            profiles = await a.get_profiles(us)
+            assert all(p == [] for p in profiles.values())
+            for u in us:
+                await a.delete_user(u)
+
+    asyncio.run(run())
@@ -1,7 +1,11 @@
+import httpx
 import pytest
+from unittest.mock import Mock
 from memobase.core.blob import DocBlob, ChatBlob
 from memobase.error import ServerError
 from memobase.core.blob import BlobType
+from memobase import BufferedWriter
+from memobase.patch.openai import InsertWorker
 
 
 def test_blob_curd_client(api_client):
@@ -37,6 +41,17 @@ def test_blob_get_all(api_client):
     a.delete_user(u)
 
 
+def test_blob_iter(api_client):
+    a = api_client
+    blob = DocBlob(content="test", fields={"1": "fool"})
+    u = a.add_user()
+    ud = a.get_user(u)
+
+    bs = [ud.insert(blob) for _ in range(5)]
+    assert list(ud.iter_blobs(BlobType.doc, page_size=2)) == bs
+    a.delete_user(u)
+
+
 def test_flush_curd_client(api_client):
     mb = api_client
     uid = mb.add_user({"me": "test"})
@@ -63,3 +78,100 @@ def test_flush_curd_client(api_client):
     print(u.event())
     mb.delete_user(uid)
     print("Deleted user")
+
+
+def test_flush_job_client(api_client):
+    mb = api_client
+    uid = mb.add_user({"me": "test"})
+    u = mb.get_user(uid)
+    u.insert(
+        ChatBlob(
+            messages=[
+                {
+                    "role": "user",
+                    "content": "Hello, I'm Gus",
+                },
+                {
+                    "role": "assistant",
+                    "content": "Hi, nice to meet you, Gus!",
+                },
+            ]
+        )
+    )
+    job_id = u.start_flush()
+    jobs = list(u.watch_flush_job(job_id))
+    print([(j.status, j.stage) for j in jobs])
+    assert jobs[-1].status == "done"
+    job = u.flush_job(job_id)
+    assert job.finished and job.blobs == 1
+    print(job.stage_seconds)
+    mb.delete_user(uid)
+
+
+def test_buffered_writer_survives_unexpected_errors():
+    inserted = []
+
+    def insert(blob):
+        inserted.append(blob)
+        if len(inserted) == 1:
+            raise ValueError("not a JSON body")
+
+    client = Mock()
+    client.get_user.return_value = Mock(insert=insert)
+    writer = BufferedWriter(client, batch_size=1)
+    blob = ChatBlob(messages=[{"role": "user", "content": "hello"}])
+    writer.insert("u1", blob)
+    assert writer.flush(timeout=5)
+    # The writer thread is still alive and sends the next blobs
+    writer.insert("u2", blob)
+    assert writer.flush(timeout=5)
+    assert len(inserted) == 2
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.insert("u3", blob)
+
+
+def test_insert_worker_survives_failed_inserts():
+    response = httpx.Response(503, request=httpx.Request("POST", "http://test"))
+    errors = [
+        httpx.HTTPStatusError("busy", request=response.request, response=response),
+        httpx.ConnectError("refused"),
+        ValueError("not a JSON body"),
+    ]
+    inserted = []
+
+    def insert(blob):
+        inserted.append(blob)
+        if errors:
+            raise errors.pop(0)
+
+    worker = InsertWorker(maxsize=8)
+    blob = ChatBlob(messages=[{"role": "user", "content": "hello"}])
+    for _ in range(4):
+        worker.submit(blob, Mock(insert=insert))
+    # join() would hang if a failed insert killed the thread
+    worker.join()
+    assert len(inserted) == 4
+
+
+def test_blob_buffered_writer(api_client, tmp_path):
+    a = api_client
+    u = a.add_user()
+    ud = a.get_user(u)
+
+    writer = BufferedWriter(a, batch_size=2, spill_path=str(tmp_path / "spill.jsonl"))
+    for i in range(3):
+        writer.insert(
+            u,
+            ChatBlob(
+                messages=[
+                    {"role": "user", "content": f"hello {i}"},
+                    {"role": "assistant", "content": "hi"},
+                ]
+            ),
+        )
+    assert writer.flush(timeout=30)
+    writer.close()
+    # Chat blobs of one batch are merged into one insert
+    assert 1 <= len(ud.get_all(BlobType.chat)) <= 2
+    a.delete_user(u)
@@ -28,3 +28,14 @@ def test_user_curd_client(api_client):
     new_uid = string_to_uuid(f"test{time()}")
     ud = a.get_or_create_user(new_uid)
     assert ud.user_id == new_uid
+
+
+def test_user_contexts_client(api_client):
+    a = api_client
+
+    us = [a.add_user() for _ in range(3)]
+    contexts = a.get_contexts(us, max_token_size=500)
+    assert list(contexts) == us
+    assert contexts[us[0]] == a.get_user(us[0], no_get=True).context(max_token_size=500)
+    for u in us:
+        a.delete_user(u)
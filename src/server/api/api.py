@@ -5,20 +5,31 @@ import memobase_server.env
 # Done setting up env
 
 import os
+import hmac
 import asyncio
-from typing import Optional
+from typing import Callable, Optional
+from functools import wraps
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, Request
 from fastapi import Path, Query, Body
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from memobase_server.connectors import (
     db_health_check,
     redis_health_check,
     close_connection,
     init_redis_pool,
+    partition_maintenance_loop,
 )
 from memobase_server import utils
+from memobase_server.admission import (
+    ConcurrencyPool,
+    project_weight,
+    READ_POOL,
+    INSERT_POOL,
+    FLUSH_POOL,
+)
 from memobase_server.models.database import DEFAULT_PROJECT_ID
 from memobase_server.models.response import BaseResponse, CODE
 from memobase_server.models.blob import BlobType
@@ -32,9 +43,11 @@ from memobase_server.telemetry import (
 )
 from memobase_server.env import (
     LOG,
+    CONFIG,
     TelemetryKeyName,
     ProjectStatus,
     USAGE_TOKEN_LIMIT_MAP,
+    WORKER_ID,
 )
 from memobase_server.telemetry.capture_key import capture_int_key, get_int_key
 from uvicorn.config import LOGGING_CONFIG
@@ -48,9 +61,19 @@ from memobase_server import utils
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    telemetry_manager.start()
     init_redis_pool()
+    # One worker is enough to maintain the shared database
+    maintenance_tasks = []
+    if WORKER_ID == 0:
+        maintenance_tasks = [
+            asyncio.create_task(partition_maintenance_loop()),
+            asyncio.create_task(controllers.event.event_compaction_loop()),
+        ]
     LOG.info(f"Start Memobase Server {memobase_server.__version__} 🖼️")
     yield
+    for task in maintenance_tasks:
+        task.cancel()
     await close_connection()
 
 
@@ -59,6 +82,7 @@ app = FastAPI(
     version=memobase_server.__version__,
     title="Memobase API",
     lifespan=lifespan,
+    default_response_class=res.ORJSONResponse,
 )
 router = APIRouter(prefix="/api/v1")
 LOGGING_CONFIG["formatters"]["default"][
@@ -76,6 +100,39 @@ LOGGING_CONFIG["formatters"]["default"]["datefmt"] = "%Y-%m-%d %H:%M:%S"
 LOGGING_CONFIG["formatters"]["access"]["datefmt"] = "%Y-%m-%d %H:%M:%S"
 
 
+def admit(pool: ConcurrencyPool, only_if: Callable[[dict], bool] = None):
+    """Run the route in a slot of `pool`, answer 503 with Retry-After if none frees up in time
+
+    `only_if` picks the calls that need a slot from the route's arguments, by default all.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if only_if is not None and not only_if(kwargs):
+                return await func(*args, **kwargs)
+            state = kwargs["request"].state
+            async with pool.slot(
+                CONFIG.admission_queue_timeout,
+                project_id=state.memobase_project_id,
+                weight=project_weight(state.memobase_project_status),
+            ) as admitted:
+                if not admitted:
+                    return JSONResponse(
+                        status_code=CODE.SERVICE_UNAVAILABLE.value,
+                        headers={"Retry-After": str(CONFIG.admission_retry_after)},
+                        content=BaseResponse(
+                            errno=CODE.SERVICE_UNAVAILABLE.value,
+                            errmsg=f"Too many concurrent {pool.name} requests, retry in {CONFIG.admission_retry_after}s",
+                        ).model_dump(),
+                    )
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 @router.get("/healthcheck", tags=["chore"])
 async def healthcheck() -> BaseResponse:
     """Check if your memobase is set up correctly"""
@@ -102,22 +159,23 @@ async def update_project_profile_config(
 ) -> res.BaseResponse:
     project_id = request.state.memobase_project_id
     if not utils.is_valid_profile_config(profile_config.profile_config):
-        return Promise.reject(CODE.BAD_REQUEST, "Invalid profile config").to_response(
-            BaseResponse
-        )
+        return Promise.reject(
+            CODE.BAD_REQUEST, "Invalid profile config"
+        ).to_json_response(BaseResponse)
     p = await controllers.project.update_project_profile_config(
         project_id, profile_config.profile_config
     )
-    return p.to_response(res.BaseResponse)
+    return p.to_json_response(res.BaseResponse)
 
 
 @router.get("/project/profile_config", tags=["project"])
+@admit(READ_POOL)
 async def get_project_profile_config_string(
     request: Request,
 ) -> res.ProfileConfigDataResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.project.get_project_profile_config_string(project_id)
-    return p.to_response(res.ProfileConfigDataResponse)
+    return p.to_json_response(res.ProfileConfigDataResponse)
 
 
 @router.post("/users", tags=["user"])
@@ -130,17 +188,18 @@ async def create_user(
     """Create a new user with additional data"""
     project_id = request.state.memobase_project_id
     p = await controllers.user.create_user(user_data, project_id)
-    return p.to_response(res.IdResponse)
+    return p.to_json_response(res.IdResponse)
 
 
 @router.get("/users/{user_id}", tags=["user"])
+@admit(READ_POOL)
 async def get_user(
     request: Request,
     user_id: str = Path(..., description="The ID of the user to retrieve"),
 ) -> res.UserDataResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.user.get_user(user_id, project_id)
-    return p.to_response(res.UserDataResponse)
+    return p.to_json_response(res.UserDataResponse)
 
 
 @router.put("/users/{user_id}", tags=["user"])
@@ -151,7 +210,7 @@ async def update_user(
 ) -> res.IdResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.user.update_user(user_id, project_id, user_data)
-    return p.to_response(res.IdResponse)
+    return p.to_json_response(res.IdResponse)
 
 
 @router.delete("/users/{user_id}", tags=["user"])
@@ -161,25 +220,31 @@ async def delete_user(
 ) -> BaseResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.user.delete_user(user_id, project_id)
-    return p.to_response(BaseResponse)
+    return p.to_json_response(BaseResponse)
 
 
 @router.get("/users/blobs/{user_id}/{blob_type}", tags=["user"])
+@admit(READ_POOL)
 async def get_user_all_blobs(
     request: Request,
     user_id: str = Path(..., description="The ID of the user to fetch blobs for"),
     blob_type: BlobType = Path(..., description="The type of blobs to retrieve"),
     page: int = Query(0, description="Page number for pagination, starting from 0"),
     page_size: int = Query(10, description="Number of items per page, default is 10"),
+    cursor: str = Query(
+        None,
+        description="Cursor returned as `next_cursor` by the previous page. When set, `page` is ignored",
+    ),
 ) -> res.IdsResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.user.get_user_all_blobs(
-        user_id, project_id, blob_type, page, page_size
+        user_id, project_id, blob_type, page, page_size, cursor
     )
-    return p.to_response(res.IdsResponse)
+    return p.to_json_response(res.IdsResponse)
 
 
 @router.post("/blobs/insert/{user_id}", tags=["blob"])
+@admit(INSERT_POOL)
 async def insert_blob(
     request: Request,
     user_id: str = Path(..., description="The ID of the user to insert the blob for"),
@@ -196,12 +261,12 @@ async def insert_blob(
     )
     p = await get_project_status(project_id)
     if not p.ok():
-        return p.to_response(res.IdResponse)
+        return p.to_json_response(res.IdResponse)
     status = p.data()
     if status not in USAGE_TOKEN_LIMIT_MAP:
         return Promise.reject(
             CODE.INTERNAL_SERVER_ERROR, f"Invalid project status: {status}"
-        ).to_response(res.IdResponse)
+        ).to_json_response(res.IdResponse)
     usage_token_limit = USAGE_TOKEN_LIMIT_MAP[status]
     if usage_token_limit >= 0 and (usage_token_limit < sum(this_month_token_costs)):
         return Promise.reject(
@@ -209,12 +274,12 @@ async def insert_blob(
             f"Your project reaches Memobase token limit this month. "
             f"quota: {usage_token_limit}, used: {sum(this_month_token_costs)}. "
             "\nhttps://www.memobase.io/pricing for more information.",
-        ).to_response(res.IdResponse)
+        ).to_json_response(res.IdResponse)
 
     try:
         p = await controllers.blob.insert_blob(user_id, project_id, blob_data)
         if not p.ok():
-            return p.to_response(res.IdResponse)
+            return p.to_json_response(res.IdResponse)
 
         # TODO if single user insert too fast will cause random order insert to buffer
         # So no background task for insert buffer yet
@@ -222,22 +287,23 @@ async def insert_blob(
             user_id, project_id, p.data().id, blob_data.to_blob()
         )
         if not pb.ok():
-            return pb.to_response(res.IdResponse)
+            return pb.to_json_response(res.IdResponse)
     except Exception as e:
         LOG.error(f"Error inserting blob: {e}")
         return Promise.reject(
             CODE.INTERNAL_SERVER_ERROR, f"Error inserting blob: {e}"
-        ).to_response(res.IdResponse)
+        ).to_json_response(res.IdResponse)
 
     background_tasks.add_task(
         capture_int_key,
         TelemetryKeyName.insert_blob_success_request,
         project_id=project_id,
     )
-    return p.to_response(res.IdResponse)
+    return p.to_json_response(res.IdResponse)
 
 
 @router.get("/blobs/{user_id}/{blob_id}", tags=["blob"])
+@admit(READ_POOL)
 async def get_blob(
     request: Request,
     user_id: str = Path(..., description="The ID of the user"),
@@ -245,7 +311,7 @@ async def get_blob(
 ) -> res.BlobDataResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.blob.get_blob(user_id, project_id, blob_id)
-    return p.to_response(res.BlobDataResponse)
+    return p.to_json_response(res.BlobDataResponse)
 
 
 @router.delete("/blobs/{user_id}/{blob_id}", tags=["blob"])
@@ -256,10 +322,11 @@ async def delete_blob(
 ) -> res.BaseResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.blob.remove_blob(user_id, project_id, blob_id)
-    return p.to_response(res.BaseResponse)
+    return p.to_json_response(res.BaseResponse)
 
 
 @router.get("/users/profile/{user_id}", tags=["profile"])
+@admit(READ_POOL)
 async def get_user_profile(
     request: Request,
     user_id: str = Path(..., description="The ID of the user to get profiles for"),
@@ -286,6 +353,14 @@ async def get_user_profile(
         None,
         description='Set specific subtopic limits for topics in JSON, for example {"topic1": 3, "topic2": 5}. The limits in this param will override `max_subtopic_size`.',
     ),
+    page_size: int = Query(
+        None,
+        description="Return profiles page by page in creation order, default is all. Other filters are applied within the page",
+    ),
+    cursor: str = Query(
+        None,
+        description="Cursor returned as `next_cursor` by the previous page",
+    ),
 ) -> res.UserProfileResponse:
     """Get the real-time user profiles for long term memory"""
     project_id = request.state.memobase_project_id
@@ -295,8 +370,23 @@ async def get_user_profile(
     except Exception as e:
         return Promise.reject(
             CODE.BAD_REQUEST, f"Invalid topic_limits JSON: {e}"
-        ).to_response(res.UserProfileResponse)
-    p = await controllers.profile.get_user_profiles(user_id, project_id)
+        ).to_json_response(res.UserProfileResponse)
+    # Answer a conditional request from the profile version, before loading them
+    if_none_match = request.headers.get("If-None-Match")
+    etag = None
+    p = await controllers.profile.get_user_profiles_version(user_id, project_id)
+    if p.ok() and p.data() is not None:
+        etag = res.make_etag(f"{p.data()}::{request.url.query}".encode())
+        if res.etag_matches(etag, if_none_match):
+            return res.not_modified(etag)
+    if page_size is not None or cursor is not None:
+        p = await controllers.profile.get_user_profiles_page(
+            user_id, project_id, page_size or 10, cursor
+        )
+    else:
+        p = await controllers.profile.get_user_profiles(user_id, project_id)
+    if not p.ok():
+        return p.to_json_response(res.UserProfileResponse)
     p = await controllers.profile.truncate_profiles(
         p.data(),
         prefer_topics=prefer_topics,
@@ -306,21 +396,77 @@ async def get_user_profile(
         max_subtopic_size=max_subtopic_size,
         topic_limits=topic_limits,
     )
-    return p.to_response(res.UserProfileResponse)
+    if not p.ok():
+        return p.to_json_response(res.UserProfileResponse)
+    return p.to_json_response(res.UserProfileResponse).with_etag(if_none_match, etag)
 
 
 @router.post("/users/buffer/{user_id}/{buffer_type}", tags=["buffer"])
+# Flush jobs only take a flush slot when they run, and queue for it fairly
+@admit(FLUSH_POOL, only_if=lambda kwargs: kwargs["wait"])
+@admit(INSERT_POOL, only_if=lambda kwargs: not kwargs["wait"])
 async def flush_buffer(
     request: Request,
+    background_tasks: BackgroundTasks,
     user_id: str = Path(..., description="The ID of the user"),
     buffer_type: BlobType = Path(..., description="The type of buffer to flush"),
-) -> res.BaseResponse:
+    wait: bool = Query(
+        True,
+        description="Wait for the flush to finish. If false, return a flush job at once and flush in the background",
+    ),
+) -> res.FlushJobDataResponse:
     """Get the real-time user profiles for long term memory"""
     project_id = request.state.memobase_project_id
+    if not wait:
+        p = await controllers.buffer.start_flush_job(user_id, project_id, buffer_type)
+        if not p.ok():
+            return p.to_json_response(res.FlushJobDataResponse)
+        job = p.data()
+        background_tasks.add_task(
+            controllers.buffer.run_flush_job,
+            job,
+            buffer_type,
+            project_weight(request.state.memobase_project_status),
+        )
+        return Promise.resolve(job.data).to_json_response(res.FlushJobDataResponse)
     p = await controllers.buffer.wait_insert_done_then_flush(
         user_id, project_id, buffer_type
     )
-    return p.to_response(res.BaseResponse)
+    return p.to_json_response(res.FlushJobDataResponse)
+
+
+@router.get("/users/buffer/{user_id}/jobs/{job_id}", tags=["buffer"])
+@admit(READ_POOL)
+async def get_flush_job(
+    request: Request,
+    user_id: str = Path(..., description="The ID of the user"),
+    job_id: str = Path(..., description="The ID of the flush job"),
+) -> res.FlushJobDataResponse:
+    """Get the progress of a flush job started with `wait=false`"""
+    project_id = request.state.memobase_project_id
+    p = await controllers.job.get_flush_job(user_id, project_id, job_id)
+    return p.to_json_response(res.FlushJobDataResponse)
+
+
+@router.get("/users/buffer/{user_id}/jobs/{job_id}/stream", tags=["buffer"])
+async def stream_flush_job(
+    request: Request,
+    user_id: str = Path(..., description="The ID of the user"),
+    job_id: str = Path(..., description="The ID of the flush job"),
+) -> StreamingResponse:
+    """Stream the progress of a flush job as Server-Sent Events, until it's done or failed"""
+    project_id = request.state.memobase_project_id
+
+    async def events():
+        async for p in controllers.job.watch_flush_job(user_id, project_id, job_id):
+            if await request.is_disconnected():
+                return
+            data = p.to_response(res.FlushJobDataResponse).model_dump_json()
+            yield f"event: progress\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
 
 
 @router.delete("/users/profile/{user_id}/{profile_id}", tags=["profile"])
@@ -332,10 +478,11 @@ async def delete_user_profile(
     """Get the real-time user profiles for long term memory"""
     project_id = request.state.memobase_project_id
     p = await controllers.profile.delete_user_profile(user_id, project_id, profile_id)
-    return p.to_response(res.IdResponse)
+    return p.to_json_response(res.IdResponse)
 
 
 @router.get("/users/event/{user_id}", tags=["event"])
+@admit(READ_POOL)
 async def get_user_events(
     request: Request,
     user_id: str = Path(..., description="The ID of the user"),
@@ -344,15 +491,20 @@ async def get_user_events(
         None,
         description="Max token size of returned events",
     ),
+    cursor: str = Query(
+        None,
+        description="Cursor returned as `next_cursor` by the previous page, events are ordered from newest to oldest",
+    ),
 ) -> res.UserEventsDataResponse:
     project_id = request.state.memobase_project_id
     p = await controllers.event.get_user_events(
-        user_id, project_id, topk=topk, max_token_size=max_token_size
+        user_id, project_id, topk=topk, max_token_size=max_token_size, cursor=cursor
     )
-    return p.to_response(res.UserEventsDataResponse)
+    return p.to_json_response(res.UserEventsDataResponse)
 
 
 @router.get("/users/context/{user_id}", tags=["context"])
+@admit(READ_POOL)
 async def get_user_context(
     request: Request,
     user_id: str = Path(..., description="The ID of the user"),
@@ -388,7 +540,7 @@ async def get_user_context(
     except Exception as e:
         return Promise.reject(
             CODE.BAD_REQUEST, f"Invalid topic_limits JSON: {e}"
-        ).to_response(res.UserProfileResponse)
+        ).to_json_response(res.UserProfileResponse)
     p = await controllers.context.get_user_context(
         user_id,
         project_id,
@@ -399,102 +551,147 @@ async def get_user_context(
         topic_limits,
         profile_event_ratio,
     )
-    return p.to_response(res.UserContextDataResponse)
+    if not p.ok():
+        return p.to_json_response(res.UserContextDataResponse)
+    return p.to_json_response(res.UserContextDataResponse).with_etag(
+        request.headers.get("If-None-Match")
+    )
 
 
-PATH_MAPPINGS = [
-    "/api/v1/users/blobs",
-    "/api/v1/users/profile",
-    "/api/v1/users/buffer",
-    "/api/v1/users/event",
-    "/api/v1/users/context",
-    "/api/v1/users",
-    "/api/v1/blobs/insert",
-    "/api/v1/blobs",
-]
+@router.post("/users/context/batch", tags=["context"])
+@admit(READ_POOL)
+async def get_users_context(
+    request: Request,
+    context_request: res.UsersContextRequest = Body(
+        ..., description="The user IDs and the shared Context parameters"
+    ),
+) -> res.UsersContextDataResponse:
+    project_id = request.state.memobase_project_id
+    p = await controllers.context.get_users_context(
+        [str(u) for u in context_request.user_ids],
+        project_id,
+        context_request.max_token_size,
+        context_request.prefer_topics,
+        context_request.only_topics,
+        context_request.max_subtopic_size,
+        context_request.topic_limits or {},
+        context_request.profile_event_ratio,
+    )
+    return p.to_json_response(res.UsersContextDataResponse)
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    def normalize_path(self, path: str) -> str:
-        """Remove dynamic path parameters to get normalized path for metrics"""
-        if not path.startswith("/api"):
-            return path
+def route_template(scope: Scope) -> str:
+    """The path template of the matched route, e.g. /api/v1/users/profile/{user_id}"""
+    route = scope.get("route")
+    return getattr(route, "path", "<unmatched>")
 
-        for prefix in PATH_MAPPINGS:
-            if path.startswith(prefix):
-                return prefix
 
-        return path
+class AuthMiddleware:
+    def __init__(self, app: ASGIApp, access_token: Optional[str] = None):
+        self.app = app
+        self.access_token = (
+            access_token.strip().encode() if access_token is not None else None
+        )
 
-    async def dispatch(self, request, call_next):
-        if not request.url.path.startswith("/api"):
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            return await self.app(scope, receive, send)
 
-        if request.url.path.startswith("/api/v1/healthcheck"):
-            telemetry_manager.increment_counter_metric(
-                CounterMetricName.HEALTHCHECK, 1, 
-            )
-            return await call_next(request)
+        if scope["path"].startswith("/api/v1/healthcheck"):
+            telemetry_manager.increment_counter_metric(CounterMetricName.HEALTHCHECK, 1)
+            return await self.app(scope, receive, send)
 
-        auth_token = request.headers.get("Authorization")
+        headers = Headers(scope=scope)
+        auth_token = headers.get("Authorization")
         if not auth_token or not auth_token.startswith("Bearer "):
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=CODE.UNAUTHORIZED.value,
                 content=BaseResponse(
                     errno=CODE.UNAUTHORIZED.value,
-                    errmsg=f"Unauthorized access to {request.url.path}. You have to provide a valid Bearer token.",
+                    errmsg=f"Unauthorized access to {scope['path']}. You have to provide a valid Bearer token.",
                 ).model_dump(),
             )
+            return await response(scope, receive, send)
         auth_token = (auth_token.split(" ")[1]).strip()
         is_root = self.is_valid_root(auth_token)
-        request.state.is_memobase_root = is_root
-        request.state.memobase_project_id = DEFAULT_PROJECT_ID
+        project_id, project_status = DEFAULT_PROJECT_ID, None
         if not is_root:
             p = await self.parse_project_token(auth_token)
             if not p.ok():
-                return JSONResponse(
+                response = JSONResponse(
                     status_code=CODE.UNAUTHORIZED.value,
                     content=BaseResponse(
                         errno=CODE.UNAUTHORIZED.value,
-                        errmsg=f"Unauthorized access to {request.url.path}. {p.msg()}",
+                        errmsg=f"Unauthorized access to {scope['path']}. {p.msg()}",
                     ).model_dump(),
                 )
-            request.state.memobase_project_id = p.data()
+                return await response(scope, receive, send)
+            project_id, project_status = p.data()
+        state = scope.setdefault("state", {})
+        state["is_memobase_root"] = is_root
+        state["memobase_project_id"] = project_id
+        state["memobase_project_status"] = project_status
         # await capture_int_key(TelemetryKeyName.has_request)
 
-        normalized_path = self.normalize_path(request.url.path)
-
-        telemetry_manager.increment_counter_metric(
-            CounterMetricName.REQUEST,
-            1,
-            {
-                "project_id": request.state.memobase_project_id,
-                "path": normalized_path,
-                "method": request.method,
-            },
-        )
-
+        method = scope["method"]
+        status_code = 500
         start_time = time.time()
-        response = await call_next(request)
-
-        telemetry_manager.record_histogram_metric(
-            HistogramMetricName.REQUEST_LATENCY_MS,
-            (time.time() - start_time) * 1000,
-            {
-                "project_id": request.state.memobase_project_id,
-                "path": normalized_path,
-                "method": request.method,
-            },
-        )
-        return response
+        finished = False
+
+        def finish(span):
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            # The router sets the matched route on the scope
+            route = route_template(scope)
+            span.update_name(f"{method} {route}")
+            span.set_attributes({"http.route": route, "http.status_code": status_code})
+            span.end()
+            attributes = {
+                "project_id": project_id,
+                "path": route,
+                "method": method,
+            }
+            telemetry_manager.increment_counter_metric(
+                CounterMetricName.REQUEST, 1, attributes
+            )
+            telemetry_manager.record_histogram_metric(
+                HistogramMetricName.REQUEST_LATENCY_MS,
+                (time.time() - start_time) * 1000,
+                attributes,
+            )
+
+        # self.app only returns after the background tasks, so the request ends
+        # with the last body message of its response
+        with telemetry_manager.start_span(
+            f"{method} {scope['path']}",
+            {"http.method": method, "memobase.project_id": project_id},
+            end_on_exit=False,
+        ) as span:
+
+            async def send_wrapper(message: Message):
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                await send(message)
+                if message["type"] == "http.response.body" and not message.get(
+                    "more_body", False
+                ):
+                    finish(span)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                finish(span)
 
     def is_valid_root(self, token: str) -> bool:
-        access_token = os.getenv("ACCESS_TOKEN")
-        if access_token is None:
+        if self.access_token is None:
             return True
-        return token == access_token.strip()
+        return hmac.compare_digest(token.encode(), self.access_token)
 
-    async def parse_project_token(self, token: str) -> Promise[str]:
+    async def parse_project_token(self, token: str) -> Promise[tuple[str, str]]:
+        """Check the project secret, resolve the project id and status"""
         p = parse_project_id(token)
         if not p.ok():
             return Promise.reject(CODE.UNAUTHORIZED, "Invalid project id format")
@@ -509,8 +706,8 @@ class AuthMiddleware(BaseHTTPMiddleware):
             return p
         if p.data() == ProjectStatus.suspended:
             return Promise.reject(CODE.FORBIDDEN, "Your project is suspended!")
-        return Promise.resolve(project_id)
+        return Promise.resolve((project_id, p.data()))
 
 
 app.include_router(router)
-app.add_middleware(AuthMiddleware)
+app.add_middleware(AuthMiddleware, access_token=os.getenv("ACCESS_TOKEN"))
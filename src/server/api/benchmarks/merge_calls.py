@@ -0,0 +1,106 @@
+"""LLM calls and tokens of the merge stage of one flush, by max_merge_batch_size
+
+The LLM is replaced by a stub that answers in the expected format, so it only
+counts what would be sent. Run it from src/server/api with the server env
+(DATABASE_URL is read on import, the database is never touched):
+
+    python benchmarks/merge_calls.py --sub-topics 15
+"""
+
+import sys
+import uuid
+import asyncio
+import argparse
+from datetime import datetime
+from unittest.mock import patch
+
+sys.path.insert(0, ".")
+
+from memobase_server.env import CONFIG, ProfileConfig
+from memobase_server.utils import get_encoded_tokens
+from memobase_server.models.utils import Promise
+from memobase_server.models.response import ProfileData
+from memobase_server.controllers.modal.chat import merge
+
+SUB_TOPICS = [
+    ("basic_info", "name", "User is called Gus", "User is Gus Lee"),
+    ("basic_info", "age", "User is 39 years old", "User is 40 years old"),
+    ("basic_info", "city", "User lives in Boston", "User moved to Seattle"),
+    ("education", "school", "User went to MIT", "User did a PhD at MIT"),
+    ("work", "company", "User works at a startup", "User joined Microsoft"),
+    ("work", "title", "Software engineer", "Senior software engineer"),
+    ("interest", "foods", "Love cheese pizza", "Love chicken pizza"),
+    ("interest", "sports", "Plays basketball", "Plays tennis on weekends"),
+    ("interest", "music", "Listens to jazz", "Started learning the piano"),
+    ("interest", "movies", "Likes sci-fi movies", "Loved Dune part two"),
+    ("interest", "books", "Reads fantasy novels", "Reading Project Hail Mary"),
+    ("psychological", "personality", "Introverted", "Enjoys small gatherings"),
+    ("psychological", "goals", "Wants to run a marathon", "Signed up for Boston"),
+    ("life_event", "relocation", "Moved to Boston in 2019", "Moved to Seattle"),
+    ("demographics", "marital_status", "Single", "Engaged to Anna"),
+]
+
+
+def stub_llm(counter: dict):
+    async def llm_complete(project_id, prompt, system_prompt=None, **kwargs):
+        pairs = prompt.count("## Old Memo")
+        if kwargs["prompt_id"].endswith("_batch"):
+            answer = "\n".join(
+                f"- {i}{CONFIG.llm_tab_separator}UPDATE{CONFIG.llm_tab_separator}merged memo {i}"
+                for i in range(1, pairs + 1)
+            )
+        else:
+            answer = f"- UPDATE{CONFIG.llm_tab_separator}merged memo"
+        counter["calls"] += 1
+        counter["input_tokens"] += len(get_encoded_tokens(system_prompt + prompt))
+        counter["output_tokens"] += len(get_encoded_tokens(answer))
+        return Promise.resolve(answer)
+
+    return llm_complete
+
+
+async def run(sub_topics: int, batch_size: int) -> dict:
+    items = SUB_TOPICS[:sub_topics]
+    now = datetime.now()
+    profiles = [
+        ProfileData(
+            id=uuid.uuid4(),
+            content=old,
+            attributes={"topic": topic, "sub_topic": sub_topic},
+            created_at=now,
+            updated_at=now,
+        )
+        for topic, sub_topic, old, _ in items
+    ]
+    counter = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+    CONFIG.max_merge_batch_size = batch_size
+    with patch.object(merge, "llm_complete", stub_llm(counter)):
+        p = await merge.merge_or_add_new_memos(
+            "benchmark",
+            [new for *_, new in items],
+            [
+                {"topic": topic, "sub_topic": sub_topic}
+                for topic, sub_topic, *_ in items
+            ],
+            profiles,
+            ProfileConfig(),
+        )
+    assert len(p.data()["update"]) == len(items)
+    return counter
+
+
+async def main(args):
+    print(f"{args.sub_topics} colliding sub_topics per flush")
+    print(f"{'batch size':>10} {'calls':>6} {'input tokens':>13} {'output tokens':>14}")
+    for batch_size in args.batch_sizes:
+        r = await run(args.sub_topics, batch_size)
+        print(
+            f"{batch_size:>10} {r['calls']:>6} {r['input_tokens']:>13} {r['output_tokens']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sub-topics", type=int, default=15)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 5, 10, 15])
+    asyncio.run(main(parser.parse_args()))
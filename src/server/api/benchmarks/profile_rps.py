@@ -0,0 +1,79 @@
+"""Closed-loop load test of GET /api/v1/users/profile/{user_id}
+
+Run it against a server built from two commits to compare requests/sec:
+
+    python benchmarks/profile_rps.py --url http://localhost:8019 --token $ACCESS_TOKEN
+"""
+
+import time
+import asyncio
+import argparse
+import httpx
+
+
+async def worker(
+    client: httpx.AsyncClient, path: str, deadline: float, latencies: list, errors: list
+):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            r = await client.get(path)
+            r.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(e)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def main(args):
+    async with httpx.AsyncClient(
+        base_url=args.url.rstrip("/") + "/api/v1",
+        headers={"Authorization": f"Bearer {args.token}"},
+        limits=httpx.Limits(
+            max_connections=args.concurrency,
+            max_keepalive_connections=args.concurrency,
+        ),
+        timeout=30,
+    ) as client:
+        user_id = args.user_id
+        if user_id is None:
+            r = await client.post("/users", json={})
+            r.raise_for_status()
+            user_id = r.json()["data"]["id"]
+        path = f"/users/profile/{user_id}"
+
+        # Warm up connections and the profile cache
+        await client.get(path)
+
+        latencies, errors = [], []
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *[
+                worker(client, path, deadline, latencies, errors)
+                for _ in range(args.concurrency)
+            ]
+        )
+        elapsed = time.perf_counter() - start
+
+        if args.user_id is None:
+            await client.delete(f"/users/{user_id}")
+
+    latencies.sort()
+    print(f"concurrency: {args.concurrency}, duration: {elapsed:.1f}s")
+    print(f"requests: {len(latencies)}, errors: {len(errors)}")
+    print(f"requests/sec: {len(latencies) / elapsed:.1f}")
+    if latencies:
+        for q in (0.5, 0.9, 0.99):
+            ms = latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+            print(f"p{int(q * 100)}: {ms:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://localhost:8019")
+    parser.add_argument("--token", default="secret")
+    parser.add_argument("--user-id", default=None, help="Create a user if not set")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
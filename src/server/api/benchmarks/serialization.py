@@ -0,0 +1,80 @@
+"""Render time of a profile response, and load time of the cached profiles
+
+Compares the default FastAPI encoder with the orjson response, and validating
+the cached profiles with constructing them. Run it from src/server/api with the
+server env (DATABASE_URL is read on import, the database is never touched):
+
+    python benchmarks/serialization.py --profiles 2000
+"""
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import orjson
+from datetime import datetime, timezone
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, ".")
+
+from memobase_server.models import response as res
+from memobase_server.models.utils import Promise
+
+
+def build_profiles(size: int) -> res.UserProfilesData:
+    now = datetime.now(timezone.utc)
+    return res.UserProfilesData(
+        profiles=[
+            {
+                "id": uuid.uuid4(),
+                "content": f"user likes to play basketball with friends {i}" * 4,
+                "attributes": {"topic": "interest", "sub_topic": f"sports_{i}"},
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(size)
+        ]
+    )
+
+
+def construct_from_cache(raw: str) -> res.UserProfilesData:
+    return res.UserProfilesData.model_construct(
+        profiles=[
+            res.ProfileData.model_construct(**p) for p in orjson.loads(raw)["profiles"]
+        ]
+    )
+
+
+def bench(func, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args):
+    profiles = build_profiles(args.profiles)
+    raw = profiles.model_dump_json()
+    p = Promise.resolve(profiles)
+
+    results = {
+        "render: default": lambda: json.dumps(
+            jsonable_encoder(p.to_response(res.UserProfileResponse))
+        ),
+        "render: orjson": lambda: p.to_json_response(res.UserProfileResponse),
+        "cache load: validate": lambda: res.UserProfilesData.model_validate_json(raw),
+        "cache load: construct": lambda: construct_from_cache(raw),
+    }
+    print(f"{args.profiles} profiles, best of {args.rounds} rounds")
+    for name, func in results.items():
+        print(f"{name:>22} {bench(func, args.rounds) * 1000:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--profiles", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    main(parser.parse_args())
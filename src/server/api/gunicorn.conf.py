@@ -0,0 +1,31 @@
+"""
+Run Memobase with multiple worker processes: `gunicorn -c gunicorn.conf.py api:app`
+
+`WEB_CONCURRENCY` sets the number of workers, all cores by default. Each worker
+gets `MEMOBASE_WORKER_ID` in [0, workers), which offsets its Prometheus port,
+and sizes its Postgres pool to its share of `database_max_connections`.
+"""
+
+import os
+import itertools
+import multiprocessing
+
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Inherited by the workers, see memobase_server.env.WORKERS
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+timeout = 120
+graceful_timeout = 30
+
+
+def pre_fork(server, worker):
+    # Take the lowest free id, so a restarted worker reuses the id of the one it replaces
+    used = {w.memobase_worker_id for w in server.WORKERS.values()}
+    worker.memobase_worker_id = next(i for i in itertools.count() if i not in used)
+
+
+def post_fork(server, worker):
+    # Runs before the app is imported in the worker
+    os.environ["MEMOBASE_WORKER_ID"] = str(worker.memobase_worker_id)
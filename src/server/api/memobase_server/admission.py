@@ -0,0 +1,167 @@
+"""
+Admission control: reads, inserts and flushes get separate concurrency pools in
+each worker, so slow LLM flushes can't take the event loop and DB connections
+from the read endpoints.
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from .env import CONFIG
+from .telemetry import (
+    telemetry_manager,
+    CounterMetricName,
+    HistogramMetricName,
+    GaugeMetricName,
+)
+
+
+def project_weight(status: Optional[str]) -> float:
+    return CONFIG.flush_project_weights.get(status, 1)
+
+
+class ConcurrencyPool:
+    """At most `limit` slots in use, waiters get a free slot first come first served"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @asynccontextmanager
+    async def slot(
+        self, timeout: Optional[float], project_id: str = None, weight: float = 1
+    ):
+        """Hold a slot in the block, yield False without one if none frees up in `timeout` seconds
+
+        `timeout=None` waits as long as it takes.
+        """
+        if not await self._acquire(timeout, project_id, weight):
+            telemetry_manager.increment_counter_metric(
+                CounterMetricName.ADMISSION_REJECTED, 1, {"pool": self.name}
+            )
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._release()
+
+    def _push(self, waiter: asyncio.Future, project_id: str, weight: float):
+        self._waiters.append(waiter)
+
+    def _pop(self) -> Optional[asyncio.Future]:
+        return self._waiters.popleft() if self._waiters else None
+
+    def _report_wait(self, project_id: str, queued: int, waited: float = None):
+        pass
+
+    async def _acquire(
+        self, timeout: Optional[float], project_id: str, weight: float
+    ) -> bool:
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            self._report()
+            return True
+        if timeout is not None and timeout <= 0:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._push(waiter, project_id, weight)
+        self.waiting += 1
+        self._report()
+        self._report_wait(project_id, 1)
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over as we gave up, pass it on
+                self._release()
+            if isinstance(e, TimeoutError):
+                return False
+            raise
+        finally:
+            self.waiting -= 1
+            self._report()
+            self._report_wait(project_id, -1, time.perf_counter() - queued_at)
+        return True
+
+    def _release(self):
+        while (waiter := self._pop()) is not None:
+            if not waiter.done():
+                # Hand the slot over, it stays active
+                waiter.set_result(True)
+                return
+        self.active -= 1
+        self._report()
+
+    def _report(self):
+        attributes = {"pool": self.name}
+        telemetry_manager.set_gauge_metric(
+            GaugeMetricName.ADMISSION_ACTIVE, self.active, attributes
+        )
+        telemetry_manager.set_gauge_metric(
+            GaugeMetricName.ADMISSION_WAITING, self.waiting, attributes
+        )
+        telemetry_manager.set_gauge_metric(
+            GaugeMetricName.ADMISSION_SATURATION, self.active / self.limit, attributes
+        )
+
+
+class FairConcurrencyPool(ConcurrencyPool):
+    """Waiters get a free slot by start-time fair queuing over their projects
+
+    A project of weight w is served w times as often as a project of weight 1
+    while both are waiting, however many waiters each of them queued. So a
+    project flooding the pool only delays its own waiters.
+    """
+
+    def __init__(self, name: str, limit: int):
+        super().__init__(name, limit)
+        self._queue: list[tuple[float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._project_finish: dict[str, float] = {}
+        self._project_queued: dict[str, int] = {}
+
+    def _push(self, waiter: asyncio.Future, project_id: str, weight: float):
+        start = max(
+            self._virtual_time, self._project_finish.get(project_id, self._virtual_time)
+        )
+        self._project_finish[project_id] = start + 1 / weight
+        heapq.heappush(self._queue, (start, next(self._sequence), waiter))
+
+    def _pop(self) -> Optional[asyncio.Future]:
+        if not self._queue:
+            return None
+        self._virtual_time, _, waiter = heapq.heappop(self._queue)
+        if not self._queue:
+            # Nobody waits, every project starts even again
+            self._project_finish.clear()
+        return waiter
+
+    def _report_wait(self, project_id: str, queued: int, waited: float = None):
+        depth = self._project_queued.get(project_id, 0) + queued
+        if depth:
+            self._project_queued[project_id] = depth
+        else:
+            self._project_queued.pop(project_id, None)
+        attributes = {"pool": self.name, "project_id": project_id}
+        telemetry_manager.set_gauge_metric(
+            GaugeMetricName.ADMISSION_PROJECT_QUEUED, depth, attributes
+        )
+        if waited is not None:
+            telemetry_manager.record_histogram_metric(
+                HistogramMetricName.ADMISSION_WAIT_MS, waited * 1000, attributes
+            )
+
+
+READ_POOL = ConcurrencyPool("read", CONFIG.admission_read_concurrency)
+INSERT_POOL = ConcurrencyPool("insert", CONFIG.admission_insert_concurrency)
+FLUSH_POOL = FairConcurrencyPool("flush", CONFIG.admission_flush_concurrency)
@@ -0,0 +1,44 @@
+"""
+Setup commands that run before the server starts, e.g. `python -m memobase_server.cli init-db`
+"""
+
+import argparse
+from pathlib import Path
+from .connectors import DB_ENGINE, create_tables
+from .models.database import REG
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+
+
+def migrate_tables():
+    """Run the alembic migrations up to head, they skip what is already done"""
+    from alembic import command
+    from alembic.config import Config
+
+    # No ini file, so alembic keeps the logging of the server
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    command.upgrade(config, "head")
+
+
+def init_db():
+    # New databases get the current schema, the migrations bring older ones to it
+    REG.metadata.create_all(DB_ENGINE)
+    migrate_tables()
+    create_tables()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="memobase_server.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "init-db",
+        help="Create or migrate the tables, create partitions and the root project",
+    )
+    args = parser.parse_args()
+    if args.command == "init-db":
+        init_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import os
+import re
+import time
 import asyncio
 import redis.exceptions
 import redis.asyncio as redis
-from sqlalchemy import create_engine, text
+from functools import lru_cache
+from sqlalchemy import create_engine, text, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
 from uuid import uuid4
-from .env import LOG
+from .env import LOG, CONFIG, WORKERS
 from .models.database import REG, Project
+from .models.partition import maintain_partitions
+from opentelemetry.trace import Status, StatusCode
+from .telemetry import telemetry_manager, HistogramMetricName
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_URL = os.getenv("REDIS_URL")
@@ -20,11 +26,24 @@ LOG.info(f"Project ID: {PROJECT_ID}")
 LOG.info(f"Database URL: {DATABASE_URL}")
 LOG.info(f"Redis URL: {REDIS_URL}")
 
+
+def pool_sizes(max_connections: int, workers: int) -> tuple[int, int]:
+    """Split the connections over the workers, 5/8 of each share stays open in the pool"""
+    share = max(2, max_connections // max(1, workers))
+    pool_size = share * 5 // 8
+    return pool_size, share - pool_size
+
+
+DB_POOL_SIZE, DB_MAX_OVERFLOW = pool_sizes(CONFIG.database_max_connections, WORKERS)
+LOG.info(
+    f"Database pool: {DB_POOL_SIZE}+{DB_MAX_OVERFLOW} connections in each of {WORKERS} workers"
+)
+
 # Create an engine
 DB_ENGINE = create_engine(
     DATABASE_URL,
-    pool_size=50,  # Reasonable default, adjust based on your needs
-    max_overflow=30,  # Allow 10 connections beyond pool_size
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     pool_recycle=600,  # Recycle connections after 10 minutes
     pool_pre_ping=True,  # Verify connections before using
     pool_timeout=30,  # Wait up to 30 seconds for available connection
@@ -33,15 +52,67 @@ REDIS_POOL = None
 
 Session = sessionmaker(bind=DB_ENGINE)
 
+STATEMENT_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+STATEMENT_TABLES = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+\"?(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def statement_name(statement: str) -> str:
+    """Normalize a statement to its verb and first known table, to bound the metric labels"""
+    words = statement.split(None, 1)
+    verb = words[0].upper() if words else ""
+    if verb not in STATEMENT_VERBS:
+        verb = "OTHER"
+    for table in STATEMENT_TABLES.findall(statement):
+        if table in REG.metadata.tables:
+            return f"{verb} {table}"
+    return f"{verb} other"
+
+
+@event.listens_for(DB_ENGINE, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = telemetry_manager.start_db_span(statement_name(statement))
+    conn.info.setdefault("query_start_time", []).append((time.perf_counter(), span))
+
+
+@event.listens_for(DB_ENGINE, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start, span = conn.info["query_start_time"].pop()
+    span.end()
+    telemetry_manager.record_histogram_metric(
+        HistogramMetricName.DB_QUERY_LATENCY_MS,
+        (time.perf_counter() - start) * 1000,
+        {"statement": statement_name(statement)},
+    )
+
+
+@event.listens_for(DB_ENGINE, "handle_error")
+def handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        _, span = conn.info["query_start_time"].pop()
+        span.record_exception(exception_context.original_exception)
+        span.set_status(Status(StatusCode.ERROR))
+        span.end()
+
 
 def create_tables():
+    """Create tables, partitions and the root project, run by `python -m memobase_server.cli init-db`"""
     REG.metadata.create_all(DB_ENGINE)
+    maintain_partitions(DB_ENGINE)
     with Session() as session:
         Project.initialize_root_project(session)
     LOG.info("Database tables created successfully")
 
 
-create_tables()
+async def partition_maintenance_loop(interval: int = 60 * 60 * 24):
+    """Create upcoming partitions and apply the retention policy once a day"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(maintain_partitions, DB_ENGINE)
+        except Exception as e:
+            LOG.error(f"Partition maintenance failed: {e}")
 
 
 def db_health_check() -> bool:
@@ -73,6 +144,32 @@ async def close_connection():
     LOG.info("Connections closed")
 
 
+class TimedPipeline(redis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with telemetry_manager.record_latency(
+            HistogramMetricName.REDIS_COMMAND_LATENCY_MS, {"command": "PIPELINE"}
+        ):
+            return await super().execute(raise_on_error)
+
+
+class TimedRedis(redis.Redis):
+    """Redis client recording the latency of each command, labelled by its name"""
+
+    async def execute_command(self, *args, **options):
+        with telemetry_manager.record_latency(
+            HistogramMetricName.REDIS_COMMAND_LATENCY_MS,
+            {"command": str(args[0]).upper()},
+        ):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(
+        self, transaction: bool = True, shard_hint: str = None
+    ) -> TimedPipeline:
+        return TimedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
 def init_redis_pool():
     global REDIS_POOL
     REDIS_POOL = redis.ConnectionPool.from_url(REDIS_URL, decode_responses=True)
@@ -80,9 +177,9 @@ def init_redis_pool():
 
 def get_redis_client() -> redis.Redis:
     if REDIS_POOL is not None:
-        return redis.Redis(connection_pool=REDIS_POOL, decode_responses=True)
+        return TimedRedis(connection_pool=REDIS_POOL, decode_responses=True)
     else:
-        return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        return TimedRedis.from_url(REDIS_URL, decode_responses=True)
 
 
 if __name__ == "__main__":
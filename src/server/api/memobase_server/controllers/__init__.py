@@ -5,3 +5,4 @@ from . import profile
 from . import project
 from . import event
 from . import context
+from . import job
@@ -4,8 +4,10 @@ from ..models.database import GeneralBlob, DEFAULT_PROJECT_ID
 from ..models.response import CODE, BlobData, IdData
 from ..models.blob import ChatBlob, DocBlob, BlobType
 from ..connectors import Session
+from ..telemetry import traced
 
 
+@traced()
 async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[IdData]:
     try:
         blob_parsed = blob.to_blob()
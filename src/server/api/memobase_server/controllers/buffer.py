@@ -1,3 +1,4 @@
+import time
 from sqlalchemy import func
 from datetime import datetime
 from ..env import CONFIG, LOG
@@ -12,10 +13,14 @@ from ..models.response import CODE
 from ..models.database import BufferZone, GeneralBlob
 from ..models.blob import BlobType, Blob
 from ..connectors import Session
+from ..admission import FLUSH_POOL
+from ..telemetry import telemetry_manager, HistogramMetricName, traced
 from .modal import BLOBS_PROCESS
+from .job import FlushJob
 
 
 @user_id_lock("insert_blob_to_buffer")
+@traced()
 async def insert_blob_to_buffer(
     user_id: str, project_id: str, blob_id: str, blob_data: Blob
 ) -> Promise[None]:
@@ -42,15 +47,41 @@ async def insert_blob_to_buffer(
 
 # If there're ongoing insert, wait for them to finish then flush
 @user_id_lock("insert_blob_to_buffer")
+@traced()
 async def wait_insert_done_then_flush(
-    user_id: str, project_id: str, blob_type: BlobType
+    user_id: str, project_id: str, blob_type: BlobType, job: FlushJob = None
 ) -> Promise[None]:
-    p = await flush_buffer(user_id, project_id, blob_type)
+    p = await flush_buffer(user_id, project_id, blob_type, job=job)
     if not p.ok():
         return p
     return Promise.resolve(None)
 
 
+async def start_flush_job(
+    user_id: str, project_id: str, blob_type: BlobType
+) -> Promise[FlushJob]:
+    if blob_type not in BLOBS_PROCESS:
+        return Promise.reject(CODE.BAD_REQUEST, f"Blob type {blob_type} not supported")
+    job = await FlushJob.create(user_id, project_id, blob_type)
+    return Promise.resolve(job)
+
+
+async def run_flush_job(job: FlushJob, blob_type: BlobType, weight: float = 1):
+    try:
+        # Accepted jobs queue for a flush slot instead of being turned away
+        async with (
+            job.heartbeat(),
+            FLUSH_POOL.slot(timeout=None, project_id=job.project_id, weight=weight),
+        ):
+            p = await wait_insert_done_then_flush(
+                job.data.user_id, job.project_id, blob_type, job=job
+            )
+    except Exception as e:
+        LOG.error(f"Flush job {job.data.id} failed: {e}")
+        p = Promise.reject(CODE.INTERNAL_SERVER_ERROR, f"Flush job failed: {e}")
+    await job.finish(p)
+
+
 async def get_buffer_capacity(
     user_id: str, project_id: str, blob_type: BlobType
 ) -> Promise[int]:
@@ -68,19 +99,22 @@ async def detect_buffer_full_or_not(
 ) -> Promise[bool]:
     with Session() as session:
         # 1. if buffer size reach maximum, flush it
-        buffer_size = (
-            session.query(func.sum(BufferZone.token_size))
-            .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .scalar()
-        )
+        with telemetry_manager.record_latency(
+            HistogramMetricName.BUFFER_STAGE_LATENCY_MS,
+            {"stage": "full_check", "blob_type": str(blob_type)},
+        ):
+            buffer_size = (
+                session.query(func.sum(BufferZone.token_size))
+                .filter_by(
+                    user_id=user_id, blob_type=str(blob_type), project_id=project_id
+                )
+                .scalar()
+            )
         if buffer_size and buffer_size > CONFIG.max_chat_blob_buffer_token_size:
             LOG.info(
                 f"Flush {blob_type} buffer for user {user_id} due to reach maximum token size({buffer_size} > {CONFIG.max_chat_blob_buffer_token_size})"
             )
-            p = await flush_buffer(user_id, project_id, blob_type)
-            if not p.ok():
-                return p
-            return Promise.resolve(True)
+            return await flush_buffer_or_defer(user_id, project_id, blob_type)
     return Promise.resolve(False)
 
 
@@ -89,11 +123,17 @@ async def detect_buffer_idle_or_not(
 ) -> Promise[bool]:
     with Session() as session:
         # if buffer is idle for a long time, flush it
-        last_buffer_update = (
-            session.query(func.max(BufferZone.created_at))
-            .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .scalar()
-        )
+        with telemetry_manager.record_latency(
+            HistogramMetricName.BUFFER_STAGE_LATENCY_MS,
+            {"stage": "idle_check", "blob_type": str(blob_type)},
+        ):
+            last_buffer_update = (
+                session.query(func.max(BufferZone.created_at))
+                .filter_by(
+                    user_id=user_id, blob_type=str(blob_type), project_id=project_id
+                )
+                .scalar()
+            )
         if (
             last_buffer_update
             and seconds_from_now(last_buffer_update) > CONFIG.buffer_flush_interval
@@ -101,19 +141,34 @@ async def detect_buffer_idle_or_not(
             LOG.info(
                 f"Flush {blob_type} buffer for user {user_id} due to idle for a long time"
             )
-            p = await flush_buffer(user_id, project_id, blob_type)
-            if not p.ok():
-                return p
-            return Promise.resolve(True)
+            return await flush_buffer_or_defer(user_id, project_id, blob_type)
     return Promise.resolve(False)
 
 
-async def flush_buffer(
+async def flush_buffer_or_defer(
     user_id: str, project_id: str, blob_type: BlobType
+) -> Promise[bool]:
+    """Flush for an insert, or keep the buffer for a later insert if all flush slots are busy"""
+    async with FLUSH_POOL.slot(timeout=0) as admitted:
+        if not admitted:
+            LOG.warning(
+                f"Defer flush of {blob_type} buffer for user {user_id}, too many flushes running"
+            )
+            return Promise.resolve(False)
+        p = await flush_buffer(user_id, project_id, blob_type)
+        if not p.ok():
+            return p
+        return Promise.resolve(True)
+
+
+@traced()
+async def flush_buffer(
+    user_id: str, project_id: str, blob_type: BlobType, job: FlushJob = None
 ) -> Promise[None]:
     # FIXME: parallel calling will cause duplicated flush
     if blob_type not in BLOBS_PROCESS:
         return Promise.reject(CODE.BAD_REQUEST, f"Blob type {blob_type} not supported")
+    start = time.perf_counter()
     with Session() as session:
         blob_buffers_trans = session.query(BufferZone).filter_by(
             user_id=user_id, blob_type=str(blob_type), project_id=project_id
@@ -144,7 +199,11 @@ async def flush_buffer(
             blobs = [pack_blob_from_db(bd, blob_type) for bd in blob_data]
 
         # Process blobs first (moved outside the session)
-        p = await BLOBS_PROCESS[blob_type](user_id, project_id, blob_ids, blobs)
+        if job is not None:
+            await job.update(blobs=len(blobs))
+        p = await BLOBS_PROCESS[blob_type](
+            user_id, project_id, blob_ids, blobs, job=job
+        )
         if not p.ok():
             return p
         return Promise.resolve(None)
@@ -170,6 +229,11 @@ async def flush_buffer(
                 LOG.info(
                     f"Flushed {blob_type} buffer(size: {len(blob_buffers)}) for user {user_id}"
                 )
+                telemetry_manager.record_histogram_metric(
+                    HistogramMetricName.BUFFER_STAGE_LATENCY_MS,
+                    (time.perf_counter() - start) * 1000,
+                    {"stage": "flush", "blob_type": str(blob_type)},
+                )
             except Exception as e:
                 session.rollback()
                 LOG.error(f"Error while deleting buffers/blobs: {e}")
@@ -1,13 +1,54 @@
 from ..models.utils import Promise
-from ..models.response import ContextData
+from ..models.response import CODE, ContextData, UsersContextData, UserProfilesData
 from ..prompts.chat_context_pack import CONTEXT_PROMPT_PACK
 from ..utils import get_encoded_tokens, event_str_repr
 from ..env import CONFIG
+from ..telemetry import traced
 from .project import get_project_profile_config
-from .profile import get_user_profiles, truncate_profiles
-from .event import get_user_events
+from .profile import get_user_profiles, get_users_profiles, truncate_profiles
+from .event import get_user_events, get_users_events, truncate_events
 
 
+async def get_profile_section(
+    user_profiles: UserProfilesData,
+    max_profile_token_size: int,
+    prefer_topics: list[str],
+    only_topics: list[str],
+    max_subtopic_size: int,
+    topic_limits: dict[str, int],
+) -> Promise[str]:
+    if max_profile_token_size <= 0:
+        return Promise.resolve("")
+    use_profiles = await truncate_profiles(
+        user_profiles,
+        prefer_topics=prefer_topics,
+        only_topics=only_topics,
+        max_token_size=max_profile_token_size,
+        max_subtopic_size=max_subtopic_size,
+        topic_limits=topic_limits,
+    )
+    if not use_profiles.ok():
+        return use_profiles
+    use_profiles = use_profiles.data().profiles
+    return Promise.resolve(
+        "- "
+        + "\n- ".join(
+            [
+                f"{p.attributes.get('topic')}::{p.attributes.get('sub_topic')}: {p.content}"
+                for p in use_profiles
+            ]
+        )
+    )
+
+
+def event_token_budget(
+    profile_section: str, max_token_size: int, max_event_token_size: int
+) -> int:
+    profile_section_tokens = len(get_encoded_tokens(profile_section))
+    return min(max_token_size - profile_section_tokens, max_event_token_size)
+
+
+@traced()
 async def get_user_context(
     user_id: str,
     project_id: str,
@@ -32,32 +73,20 @@ async def get_user_context(
     p = await get_user_profiles(user_id, project_id)
     if not p.ok():
         return p
-    if max_profile_token_size > 0:
-        user_profiles = p.data()
-        use_profiles = await truncate_profiles(
-            user_profiles,
-            prefer_topics=prefer_topics,
-            only_topics=only_topics,
-            max_token_size=max_profile_token_size,
-            max_subtopic_size=max_subtopic_size,
-            topic_limits=topic_limits,
-        )
-        if not use_profiles.ok():
-            return use_profiles
-        use_profiles = use_profiles.data().profiles
-
-        profile_section = "- " + "\n- ".join(
-            [
-                f"{p.attributes.get('topic')}::{p.attributes.get('sub_topic')}: {p.content}"
-                for p in use_profiles
-            ]
-        )
-    else:
-        profile_section = ""
+    p = await get_profile_section(
+        p.data(),
+        max_profile_token_size,
+        prefer_topics,
+        only_topics,
+        max_subtopic_size,
+        topic_limits,
+    )
+    if not p.ok():
+        return p
+    profile_section = p.data()
 
-    profile_section_tokens = len(get_encoded_tokens(profile_section))
-    max_event_token_size = min(
-        max_token_size - profile_section_tokens, max_event_token_size
+    max_event_token_size = event_token_budget(
+        profile_section, max_token_size, max_event_token_size
     )
     if max_event_token_size <= 0:
         return Promise.resolve(
@@ -76,3 +105,78 @@ async def get_user_context(
     return Promise.resolve(
         ContextData(context=context_prompt_func(profile_section, event_section))
     )
+
+
+@traced()
+async def get_users_context(
+    user_ids: list[str],
+    project_id: str,
+    max_token_size: int,
+    prefer_topics: list[str],
+    only_topics: list[str],
+    max_subtopic_size: int,
+    topic_limits: dict[str, int],
+    profile_event_ratio: float,
+) -> Promise[UsersContextData]:
+    """Same contexts as `get_user_context`, with the config, profiles and events
+    of all users loaded in one query each"""
+    if not 0 < profile_event_ratio <= 1:
+        return Promise.reject(
+            CODE.BAD_REQUEST, "profile_event_ratio must be between 0 and 1"
+        )
+    max_profile_token_size = int(max_token_size * profile_event_ratio)
+    max_event_token_size = max_token_size - max_profile_token_size
+    user_ids = list(dict.fromkeys(user_ids))
+
+    p = await get_project_profile_config(project_id)
+    if not p.ok():
+        return p
+    profile_config = p.data()
+    use_language = profile_config.language or CONFIG.language
+    context_prompt_func = CONTEXT_PROMPT_PACK[use_language]
+
+    p = await get_users_profiles(user_ids, project_id)
+    if not p.ok():
+        return p
+    users_profiles = p.data()
+    profile_sections = {}
+    for user_id in user_ids:
+        p = await get_profile_section(
+            users_profiles[user_id],
+            max_profile_token_size,
+            prefer_topics,
+            only_topics,
+            max_subtopic_size,
+            topic_limits,
+        )
+        if not p.ok():
+            return p
+        profile_sections[user_id] = p.data()
+
+    event_budgets = {
+        user_id: event_token_budget(
+            profile_sections[user_id], max_token_size, max_event_token_size
+        )
+        for user_id in user_ids
+    }
+    need_events = [u for u in user_ids if event_budgets[u] > 0]
+    users_events = {}
+    if need_events:
+        # max 40 events per user, then truncate to each user's budget
+        p = await get_users_events(need_events, project_id, topk=40)
+        if not p.ok():
+            return p
+        users_events = p.data()
+
+    contexts = {}
+    for user_id in user_ids:
+        event_section = ""
+        if user_id in users_events:
+            events = truncate_events(
+                users_events[user_id].events, event_budgets[user_id]
+            )
+            event_section = "\n---\n".join([event_str_repr(ed) for ed in events])
+        contexts[user_id] = context_prompt_func(
+            profile_sections[user_id], event_section
+        )
+    return Promise.resolve(UsersContextData(contexts=contexts))
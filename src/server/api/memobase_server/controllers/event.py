@@ -1,22 +1,50 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
 from pydantic import ValidationError
+from sqlalchemy import tuple_, func, distinct, select
+from sqlalchemy.orm import Session as SessionType, aliased
+from ..env import CONFIG, LOG, ProfileConfig
 from ..models.database import UserEvent
 from ..models.response import UserEventData, UserEventsData, EventData
 from ..models.utils import Promise, CODE
 from ..connectors import Session
-from ..utils import get_encoded_tokens, event_str_repr
+from ..telemetry import traced
+from ..llms import llm_complete, get_stage_model
+from ..prompts import summary_profile
+from .project import get_project_profile_config
+from ..utils import (
+    get_encoded_tokens,
+    event_str_repr,
+    encode_cursor,
+    decode_cursor,
+    user_id_lock,
+)
 
 
+@traced()
 async def get_user_events(
-    user_id: str, project_id: str, topk: int = 10, max_token_size: int = None
+    user_id: str,
+    project_id: str,
+    topk: int = 10,
+    max_token_size: int = None,
+    cursor: str = None,
 ) -> Promise[UserEventsData]:
     with Session() as session:
-        user_events = (
+        query = (
             session.query(UserEvent)
             .filter_by(user_id=user_id, project_id=project_id)
-            .order_by(UserEvent.created_at.desc())
-            .limit(topk)
-            .all()
+            .order_by(UserEvent.created_at.desc(), UserEvent.id.desc())
         )
+        if cursor is not None:
+            try:
+                last_created_at, last_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return Promise.reject(CODE.BAD_REQUEST, f"Invalid cursor: {cursor}")
+            query = query.filter(
+                tuple_(UserEvent.created_at, UserEvent.id)
+                < tuple_(last_created_at, last_id)
+            )
+        user_events = query.limit(topk).all()
         if user_events is None:
             return Promise.reject(
                 CODE.NOT_FOUND,
@@ -32,19 +60,69 @@ async def get_user_events(
             for ue in user_events
         ]
     events = UserEventsData(events=results)
+    has_more = len(results) == topk
     if max_token_size is not None:
-        c_tokens = 0
-        truncated_results = []
-        for r in events.events:
-            c_tokens += len(get_encoded_tokens(event_str_repr(r)))
-            if c_tokens > max_token_size:
-                break
-            truncated_results.append(r)
-        results = truncated_results
-        events.events = results
+        truncated_results = truncate_events(events.events, max_token_size)
+        has_more = has_more or len(truncated_results) < len(events.events)
+        events.events = truncated_results
+    if has_more and len(events.events):
+        events.next_cursor = encode_cursor(
+            events.events[-1].created_at, events.events[-1].id
+        )
     return Promise.resolve(events)
 
 
+def truncate_events(
+    events: list[UserEventData], max_token_size: int
+) -> list[UserEventData]:
+    c_tokens = 0
+    truncated_results = []
+    for r in events:
+        c_tokens += len(get_encoded_tokens(event_str_repr(r)))
+        if c_tokens > max_token_size:
+            break
+        truncated_results.append(r)
+    return truncated_results
+
+
+@traced()
+async def get_users_events(
+    user_ids: list[str], project_id: str, topk: int = 10
+) -> Promise[dict[str, UserEventsData]]:
+    """Latest `topk` events of each user, ranked per user in one query"""
+    rank = (
+        func.row_number()
+        .over(
+            partition_by=UserEvent.user_id,
+            order_by=(UserEvent.created_at.desc(), UserEvent.id.desc()),
+        )
+        .label("rank")
+    )
+    ranked = (
+        select(UserEvent, rank)
+        .where(UserEvent.user_id.in_(user_ids), UserEvent.project_id == project_id)
+        .subquery()
+    )
+    ranked_event = aliased(UserEvent, ranked)
+    query = (
+        select(ranked_event)
+        .where(ranked.c.rank <= topk)
+        .order_by(ranked.c.user_id, ranked.c.rank)
+    )
+    results = {u: [] for u in user_ids}
+    with Session() as session:
+        for ue in session.execute(query).scalars():
+            results[str(ue.user_id)].append(
+                {
+                    "id": ue.id,
+                    "event_data": ue.event_data,
+                    "created_at": ue.created_at,
+                    "updated_at": ue.updated_at,
+                }
+            )
+    return Promise.resolve({u: UserEventsData(events=rs) for u, rs in results.items()})
+
+
 async def append_user_event(
     user_id: str, project_id: str, event_data: dict
 ) -> Promise[None]:
@@ -56,16 +134,23 @@ async def append_user_event(
             f"Invalid event data: {str(e)}",
         )
     with Session() as session:
-        user_event = UserEvent(
-            user_id=user_id,
-            project_id=project_id,
-            event_data=validated_event.model_dump(),
-        )
-        session.add(user_event)
+        insert_user_event(session, user_id, project_id, validated_event)
         session.commit()
     return Promise.resolve(None)
 
 
+def insert_user_event(
+    session: SessionType, user_id: str, project_id: str, event_data: EventData
+) -> UserEvent:
+    user_event = UserEvent(
+        user_id=user_id,
+        project_id=project_id,
+        event_data=event_data.model_dump(),
+    )
+    session.add(user_event)
+    return user_event
+
+
 async def delete_user_event(
     user_id: str, project_id: str, event_id: str
 ) -> Promise[None]:
@@ -83,3 +168,159 @@ async def delete_user_event(
         session.delete(user_event)
         session.commit()
     return Promise.resolve(None)
+
+
+def event_period_start(dt: datetime, period: str) -> datetime:
+    # Same boundaries as date_trunc(period, created_at AT TIME ZONE 'UTC')
+    dt = dt.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        return dt - timedelta(days=dt.weekday())
+    return dt.replace(day=1)
+
+
+def merge_event_deltas(event_datas: list[dict]) -> list[dict]:
+    merged: dict[tuple, dict] = {}
+    for event_data in event_datas:
+        for delta in event_data.get("profile_delta", []):
+            attributes = delta.get("attributes") or {}
+            key = (attributes.get("topic"), attributes.get("sub_topic"))
+            slot = merged.setdefault(key, {"attributes": attributes, "contents": []})
+            if delta["content"] not in slot["contents"]:
+                slot["contents"].append(delta["content"])
+    return list(merged.values())
+
+
+async def rollup_delta(
+    project_id: str,
+    attributes: dict,
+    contents: list[str],
+    profile_config: ProfileConfig = None,
+) -> dict:
+    content = "; ".join(contents)
+    if CONFIG.event_compaction_use_llm and len(contents) > 1:
+        r = await llm_complete(
+            project_id,
+            content,
+            system_prompt=summary_profile.get_prompt(),
+            temperature=0.2,  # precise
+            model=get_stage_model("summary", profile_config),
+            stage="summary",
+            **summary_profile.get_kwargs(),
+        )
+        if r.ok():
+            content = r.data()
+        else:
+            LOG.error(f"Failed to summary event rollup, keep merged: {r.msg()}")
+    return {"content": content, "attributes": attributes}
+
+
+@user_id_lock("compact_user_events")
+async def compact_user_events(
+    user_id: str, project_id: str, before: datetime
+) -> Promise[int]:
+    """Replace the events before `before` with one rollup event per period"""
+    period = CONFIG.event_compaction_period
+    buckets: dict[datetime, list[tuple]] = {}
+    with Session() as session:
+        user_events = (
+            session.query(UserEvent)
+            .filter(
+                UserEvent.user_id == user_id,
+                UserEvent.project_id == project_id,
+                UserEvent.created_at < before,
+            )
+            .order_by(UserEvent.created_at, UserEvent.id)
+            .all()
+        )
+        for ue in user_events:
+            buckets.setdefault(event_period_start(ue.created_at, period), []).append(
+                (ue.id, ue.created_at, ue.event_data)
+            )
+
+    profile_config = None
+    if CONFIG.event_compaction_use_llm:
+        p = await get_project_profile_config(project_id)
+        if not p.ok():
+            return p
+        profile_config = p.data()
+
+    rollups = []
+    for events in buckets.values():
+        if len(events) < 2:
+            continue
+        merged = merge_event_deltas([e[2] for e in events])
+        deltas = await asyncio.gather(
+            *[
+                rollup_delta(project_id, m["attributes"], m["contents"], profile_config)
+                for m in merged
+            ]
+        )
+        rollups.append(([e[0] for e in events], events[-1][1], deltas))
+    if not rollups:
+        return Promise.resolve(0)
+
+    compacted = 0
+    with Session() as session:
+        for event_ids, created_at, deltas in rollups:
+            rollup = UserEvent(
+                user_id=user_id,
+                project_id=project_id,
+                event_data=EventData(profile_delta=deltas).model_dump(),
+            )
+            # Keep the rollup in the period (and partition) it summarizes
+            rollup.created_at = created_at
+            session.add(rollup)
+            compacted += (
+                session.query(UserEvent)
+                .filter(
+                    UserEvent.user_id == user_id,
+                    UserEvent.project_id == project_id,
+                    UserEvent.id.in_(event_ids),
+                )
+                .delete(synchronize_session=False)
+            )
+        session.commit()
+    return Promise.resolve(compacted)
+
+
+async def compact_events() -> Promise[int]:
+    period = CONFIG.event_compaction_period
+    before = event_period_start(
+        datetime.now(timezone.utc) - timedelta(days=CONFIG.event_compaction_after_days),
+        period,
+    )
+    bucket = func.date_trunc(period, func.timezone("UTC", UserEvent.created_at))
+    with Session() as session:
+        # Users with more than one event in some old period
+        candidates = (
+            session.query(UserEvent.user_id, UserEvent.project_id)
+            .filter(UserEvent.created_at < before)
+            .group_by(UserEvent.user_id, UserEvent.project_id)
+            .having(func.count() > func.count(distinct(bucket)))
+            .limit(CONFIG.event_compaction_batch_users)
+            .all()
+        )
+    compacted = 0
+    for user_id, project_id in candidates:
+        try:
+            p = await compact_user_events(user_id, project_id, before)
+        except TimeoutError as e:
+            LOG.warning(f"Skip event compaction: {e}")
+            continue
+        if not p.ok():
+            LOG.error(f"Failed to compact events of user {user_id}: {p.msg()}")
+            continue
+        compacted += p.data()
+    return Promise.resolve(compacted)
+
+
+async def event_compaction_loop():
+    if CONFIG.event_compaction_after_days is None:
+        return
+    while True:
+        await asyncio.sleep(CONFIG.event_compaction_interval)
+        try:
+            p = await compact_events()
+            LOG.info(f"Compacted {p.data()} user events")
+        except Exception as e:
+            LOG.error(f"Event compaction failed: {e}")
@@ -0,0 +1,165 @@
+import uuid
+import asyncio
+from time import perf_counter
+from typing import Optional, AsyncIterator
+from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pydantic import ValidationError
+from ..env import CONFIG, LOG
+from ..models.blob import BlobType
+from ..models.utils import Promise
+from ..models.response import CODE, FlushJobData, FlushJobStatus
+from ..connectors import get_redis_client
+from ..telemetry import telemetry_manager, HistogramMetricName
+
+FLUSH_JOB_POLL_INTERVAL = 0.5
+FLUSH_JOB_HEARTBEAT_INTERVAL = 10
+
+
+def flush_job_key(project_id: str, job_id: str) -> str:
+    return f"flush_jobs::{project_id}::{job_id}"
+
+
+@dataclass
+class FlushJob:
+    """Progress of one flush, kept in redis so any worker can report it"""
+
+    project_id: str
+    data: FlushJobData
+
+    @classmethod
+    async def create(
+        cls, user_id: str, project_id: str, blob_type: BlobType
+    ) -> "FlushJob":
+        job = cls(
+            project_id=project_id,
+            data=FlushJobData(
+                id=str(uuid.uuid4()),
+                user_id=user_id,
+                blob_type=str(blob_type),
+                created_at=datetime.now(timezone.utc),
+            ),
+        )
+        await job.save()
+        return job
+
+    async def save(self):
+        self.data.updated_at = datetime.now(timezone.utc)
+        async with get_redis_client() as redis_client:
+            await redis_client.set(
+                flush_job_key(self.project_id, self.data.id),
+                self.data.model_dump_json(),
+                ex=CONFIG.flush_job_ttl,
+            )
+
+    async def update(self, **fields):
+        for k, v in fields.items():
+            setattr(self.data, k, v)
+        await self.save()
+
+    @asynccontextmanager
+    async def heartbeat(self):
+        """Save the job every few seconds while it runs, so a silent job means a dead worker"""
+
+        async def beat():
+            while True:
+                await asyncio.sleep(FLUSH_JOB_HEARTBEAT_INTERVAL)
+                try:
+                    await self.save()
+                except Exception as e:
+                    LOG.warning(
+                        f"Failed to save heartbeat of flush job {self.data.id}: {e}"
+                    )
+
+        task = asyncio.create_task(beat())
+        try:
+            yield
+        finally:
+            task.cancel()
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        await self.update(status=FlushJobStatus.running, stage=name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.data.stage_seconds[name] = round(perf_counter() - start, 3)
+            await self.update(stage=None)
+
+    async def finish(self, p: Promise):
+        if p.ok():
+            await self.update(
+                status=FlushJobStatus.done, finished_at=datetime.now(timezone.utc)
+            )
+        else:
+            await self.update(
+                status=FlushJobStatus.failed,
+                errmsg=p.msg(),
+                finished_at=datetime.now(timezone.utc),
+            )
+
+
+@asynccontextmanager
+async def track_stage(job: Optional[FlushJob], name: str):
+    """Time a flush stage in a span and the metrics, and in the job if there is one"""
+    with (
+        telemetry_manager.start_span(f"flush.{name}"),
+        telemetry_manager.record_latency(
+            HistogramMetricName.FLUSH_STAGE_LATENCY_MS, {"stage": name}
+        ),
+    ):
+        if job is None:
+            yield
+            return
+        async with job.stage(name):
+            yield
+
+
+async def get_flush_job(
+    user_id: str, project_id: str, job_id: str
+) -> Promise[FlushJobData]:
+    async with get_redis_client() as redis_client:
+        job_data = await redis_client.get(flush_job_key(project_id, job_id))
+    if job_data is None:
+        return Promise.reject(CODE.NOT_FOUND, f"Flush job {job_id} not found")
+    try:
+        job = FlushJobData.model_validate_json(job_data)
+    except ValidationError as e:
+        LOG.error(f"Invalid flush job {job_id}: {e}")
+        return Promise.reject(CODE.INTERNAL_SERVER_ERROR, f"Invalid flush job: {e}")
+    if job.user_id != user_id:
+        return Promise.reject(CODE.NOT_FOUND, f"Flush job {job_id} not found")
+    last_seen = job.updated_at or job.created_at
+    if (
+        job.status in (FlushJobStatus.pending, FlushJobStatus.running)
+        and (datetime.now(timezone.utc) - last_seen).total_seconds()
+        > CONFIG.flush_job_stale_after
+    ):
+        job.status = FlushJobStatus.failed
+        job.errmsg = "Flush job stopped reporting progress, its worker may have died"
+    return Promise.resolve(job)
+
+
+async def watch_flush_job(
+    user_id: str, project_id: str, job_id: str
+) -> AsyncIterator[Promise[FlushJobData]]:
+    """Yield the job every time it changes, until it is done or failed
+
+    Gives up after `flush_job_stream_timeout` seconds, the client can watch again.
+    """
+    last = None
+    deadline = asyncio.get_running_loop().time() + CONFIG.flush_job_stream_timeout
+    while asyncio.get_running_loop().time() < deadline:
+        p = await get_flush_job(user_id, project_id, job_id)
+        if not p.ok():
+            yield p
+            return
+        job = p.data()
+        if job != last:
+            yield p
+            last = job
+        if job.status in (FlushJobStatus.done, FlushJobStatus.failed):
+            return
+        await asyncio.sleep(FLUSH_JOB_POLL_INTERVAL)
@@ -1,10 +1,12 @@
-from typing import Callable, Awaitable
+from typing import Callable, Awaitable, Optional
 from ...models.blob import BlobType, Blob
 from ...models.utils import Promise
+from ..job import FlushJob
 from . import chat
 
 BlobProcessFunc = Callable[
-    [str, list[str], list[Blob]],  # user_id, blob_ids, blobs
+    # user_id, project_id, blob_ids, blobs, job
+    [str, str, list[str], list[Blob], Optional[FlushJob]],
     Awaitable[Promise[None]],
 ]
 BLOBS_PROCESS: dict[BlobType, BlobProcessFunc] = {BlobType.chat: chat.process_blobs}
@@ -1,10 +1,19 @@
-import asyncio
-
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
 from ....env import LOG
 from ....models.blob import Blob
 from ....models.utils import Promise
-from ...profile import add_user_profiles, update_user_profiles, delete_user_profiles
-from ...event import append_user_event
+from ....models.response import CODE, EventData
+from ....connectors import Session
+from ....telemetry import telemetry_manager, CounterMetricName, traced
+from ...profile import (
+    insert_profiles,
+    update_profiles,
+    delete_profiles,
+    invalidate_user_profiles_cache,
+)
+from ...event import insert_user_event
+from ...job import FlushJob, track_stage
 from .extract import extract_topics
 from .merge import merge_or_add_new_memos
 from .summary import re_summary
@@ -12,23 +21,32 @@ from .organize import organize_profiles
 from .types import MergeAddResult
 
 
+@traced()
 async def process_blobs(
-    user_id: str, project_id: str, blob_ids: list[str], blobs: list[Blob]
+    user_id: str,
+    project_id: str,
+    blob_ids: list[str],
+    blobs: list[Blob],
+    job: FlushJob = None,
 ) -> Promise[None]:
     # 1. Extract patch profiles
-    p = await extract_topics(user_id, project_id, blob_ids, blobs)
+    async with track_stage(job, "extract"):
+        p = await extract_topics(user_id, project_id, blob_ids, blobs)
     if not p.ok():
         return p
     extracted_data = p.data()
+    if job is not None:
+        await job.update(facts_extracted=len(extracted_data["fact_contents"]))
 
     # 2. Merge it to thw whole profile
-    p = await merge_or_add_new_memos(
-        project_id,
-        fact_contents=extracted_data["fact_contents"],
-        fact_attributes=extracted_data["fact_attributes"],
-        profiles=extracted_data["profiles"],
-        config=extracted_data["config"],
-    )
+    async with track_stage(job, "merge"):
+        p = await merge_or_add_new_memos(
+            project_id,
+            fact_contents=extracted_data["fact_contents"],
+            fact_attributes=extracted_data["fact_attributes"],
+            profiles=extracted_data["profiles"],
+            config=extracted_data["config"],
+        )
     if not p.ok():
         return p
 
@@ -39,83 +57,115 @@ async def process_blobs(
         }
         for i in range(len(extracted_data["fact_contents"]))
     ]
-    if len(delta_profile_data) > 0:
-        await append_user_event(
-            user_id,
-            project_id,
-            {
-                "profile_delta": delta_profile_data,
-            },
-        )
     profile_options = p.data()
 
     # 3. Check if we need to organize profiles
-    p = await organize_profiles(
-        project_id,
-        profile_options,
-        config=extracted_data["config"],
-    )
+    async with track_stage(job, "organize"):
+        p = await organize_profiles(
+            project_id,
+            profile_options,
+            config=extracted_data["config"],
+        )
     if not p.ok():
         LOG.error(f"Failed to organize profiles: {p.msg()}")
 
     # 4. Re-summary profiles if any slot is too big
-    p = await re_summary(
-        project_id,
-        add_profile=profile_options["add"],
-        update_profile=profile_options["update"],
-    )
+    async with track_stage(job, "summary"):
+        p = await re_summary(
+            project_id,
+            add_profile=profile_options["add"],
+            update_profile=profile_options["update"],
+            config=extracted_data["config"],
+        )
     if not p.ok():
         LOG.error(f"Failed to re-summary profiles: {p.msg()}")
 
     # DB commit
-    ps = await asyncio.gather(
-        exe_user_profile_add(user_id, project_id, profile_options),
-        exe_user_profile_update(user_id, project_id, profile_options),
-        exe_user_profile_delete(user_id, project_id, profile_options),
-    )
-    if not all([p.ok() for p in ps]):
-        return Promise.reject("Failed to add or update profiles")
+    async with track_stage(job, "commit"):
+        p = await commit_profile_changes(
+            user_id, project_id, profile_options, delta_profile_data
+        )
+    if not p.ok():
+        return p
+    if job is not None:
+        written = p.data()
+        await job.update(
+            profiles_added=written["added"],
+            profiles_updated=written["updated"],
+            profiles_deleted=written["deleted"],
+        )
     return Promise.resolve(None)
 
 
-async def exe_user_profile_add(
-    user_id: str, project_id: str, profile_options: MergeAddResult
-) -> Promise[None]:
-    if not len(profile_options["add"]):
-        return Promise.resolve(None)
-    LOG.info(f"Adding {len(profile_options['add'])} profiles for user {user_id}")
-    task_add = await add_user_profiles(
-        user_id,
-        project_id,
-        [ap["content"] for ap in profile_options["add"]],
-        [ap["attributes"] for ap in profile_options["add"]],
-    )
-    return task_add
-
+@traced()
+async def commit_profile_changes(
+    user_id: str,
+    project_id: str,
+    profile_options: MergeAddResult,
+    delta_profile_data: list[dict],
+) -> Promise[dict[str, int]]:
+    """Write all profile changes and the event of one flush in a single transaction
 
-async def exe_user_profile_update(
-    user_id: str, project_id: str, profile_options: MergeAddResult
-) -> Promise[None]:
-    if not len(profile_options["update"]):
-        return Promise.resolve(None)
-    LOG.info(f"Updating {len(profile_options['update'])} profiles for user {user_id}")
-    task_update = await update_user_profiles(
-        user_id,
-        project_id,
-        [up["profile_id"] for up in profile_options["update"]],
-        [up["content"] for up in profile_options["update"]],
-        [up["attributes"] for up in profile_options["update"]],
+    Resolve the numbers of profile rows added, updated and deleted.
+    """
+    add, update, delete = (
+        profile_options["add"],
+        profile_options["update"],
+        profile_options["delete"],
     )
-    return task_update
-
+    if not (len(add) or len(update) or len(delete) or len(delta_profile_data)):
+        return Promise.resolve({"added": 0, "updated": 0, "deleted": 0})
+    LOG.info(
+        f"Adding {len(add)}, updating {len(update)}, deleting {len(delete)} profiles for user {user_id}"
+    )
+    try:
+        with Session() as session:
+            added = insert_profiles(
+                session,
+                user_id,
+                project_id,
+                [ap["content"] for ap in add],
+                [ap["attributes"] for ap in add],
+            )
+            updated = update_profiles(
+                session,
+                user_id,
+                project_id,
+                [up["profile_id"] for up in update],
+                [up["content"] for up in update],
+                [up["attributes"] for up in update],
+            )
+            deleted = delete_profiles(session, user_id, project_id, delete)
+            events = 0
+            if len(delta_profile_data):
+                insert_user_event(
+                    session,
+                    user_id,
+                    project_id,
+                    EventData(profile_delta=delta_profile_data),
+                )
+                events = 1
+            session.commit()
+    except (SQLAlchemyError, ValidationError) as e:
+        LOG.error(f"Failed to commit profile changes for user {user_id}: {e}")
+        return Promise.reject(
+            CODE.INTERNAL_SERVER_ERROR, f"Failed to commit profile changes: {e}"
+        )
+    if len(add) or len(update) or len(delete):
+        await invalidate_user_profiles_cache(user_id, project_id)
 
-async def exe_user_profile_delete(
-    user_id: str, project_id: str, profile_options: MergeAddResult
-) -> Promise[None]:
-    if not len(profile_options["delete"]):
-        return Promise.resolve(None)
-    LOG.info(f"Deleting {len(profile_options['delete'])} profiles for user {user_id}")
-    task_delete = await delete_user_profiles(
-        user_id, project_id, profile_options["delete"]
+    for table, operation, count in [
+        ("user_profiles", "add", len(added)),
+        ("user_profiles", "update", len(updated)),
+        ("user_profiles", "delete", deleted),
+        ("user_events", "add", events),
+    ]:
+        if count:
+            telemetry_manager.increment_counter_metric(
+                CounterMetricName.FLUSH_ROWS_WRITTEN,
+                count,
+                {"project_id": project_id, "table": table, "operation": operation},
+            )
+    return Promise.resolve(
+        {"added": len(added), "updated": len(updated), "deleted": deleted}
     )
-    return task_delete
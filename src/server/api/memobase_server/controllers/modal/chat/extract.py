@@ -2,7 +2,7 @@ from ....env import CONFIG, LOG, ContanstTable
 from ....models.utils import Promise
 from ....models.blob import Blob, BlobType
 from ....models.response import AIUserProfiles, CODE
-from ....llms import llm_complete
+from ....llms import llm_complete, get_stage_model
 from ....prompts.utils import (
     tag_chat_blobs_in_order_xml,
     attribute_unify,
@@ -80,6 +80,8 @@ async def extract_topics(
             PROMPTS[use_language]["profile"].get_prompt(project_profiles_slots)
         ),
         temperature=0.2,  # precise
+        model=get_stage_model("extract", project_profiles),
+        stage="extract",
         **PROMPTS[use_language]["extract"].get_kwargs(),
     )
     if not p.ok():
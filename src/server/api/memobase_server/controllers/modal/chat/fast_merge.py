@@ -0,0 +1,55 @@
+"""
+Rule-based merges of an old and a new memo, tried before the merge LLM call.
+Only the updates that need no judgement are resolved here, the rest go to the LLM.
+"""
+
+import re
+import unicodedata
+from typing import Optional
+from ....env import CONFIG
+from ....utils import get_encoded_tokens
+
+# Words, or single CJK characters since Chinese has no spaces between words
+TOKEN_PATTERN = re.compile(r"[^\W_一-鿿]+|[一-鿿]")
+# A memo extended with one of these may say the opposite of the shorter one
+NEGATIONS = set(
+    "not no never nor neither none nobody nothing without cannot t".split()
+) | set("不没无非未别否")
+DATE_PATTERN = re.compile(r"\d{4}\s*[/\-.年]\s*\d{1,2}")
+APPEND_SEPARATOR = {"en": "; ", "zh": "；"}
+
+
+def normalize_memo(memo: str) -> str:
+    memo = unicodedata.normalize("NFKC", memo).lower()
+    return " ".join(TOKEN_PATTERN.findall(memo))
+
+
+def extends(short: list[str], long: list[str]) -> bool:
+    """`long` starts with all of `short`, in order, and adds no negation"""
+    return long[: len(short)] == short and not NEGATIONS.intersection(
+        long[len(short) :]
+    )
+
+
+def fast_merge_memos(
+    topic: str, old_memo: str, new_memo: str, use_language: str
+) -> Optional[tuple[str, str]]:
+    """Return (rule, final memo) when the merge is trivial, None when the LLM has to decide"""
+    old_norm, new_norm = normalize_memo(old_memo), normalize_memo(new_memo)
+    if not new_norm:
+        return None
+    if old_norm == new_norm:
+        return "identical", old_memo
+    # Compare whole tokens in order, "age 4" is no part of "age 40", and
+    # "married" is no part of "not married"
+    old_tokens, new_tokens = old_norm.split(), new_norm.split()
+    if extends(new_tokens, old_tokens):
+        return "subsumed", old_memo
+    if old_tokens and extends(old_tokens, new_tokens):
+        return "subsumed", new_memo
+
+    if topic in CONFIG.merge_append_topics and DATE_PATTERN.search(new_memo):
+        memo = old_memo + APPEND_SEPARATOR.get(use_language, "; ") + new_memo
+        if len(get_encoded_tokens(memo)) <= CONFIG.merge_append_max_token_size:
+            return "append", memo
+    return None
@@ -1,13 +1,19 @@
+import math
 import asyncio
+from typing import Optional
+from collections import Counter
 from ....env import CONFIG, LOG
 from ....models.utils import Promise
 from ....models.response import ProfileData
 from ....env import ProfileConfig, ContanstTable
-from ....llms import llm_complete
+from ....llms import llm_complete, get_stage_model, escalate_model
+from ....telemetry import telemetry_manager, CounterMetricName
 from ....prompts.utils import (
     parse_string_into_merge_action,
+    parse_string_into_merge_actions,
 )
 from .types import UpdateResponse, PROMPTS, AddProfile, UpdateProfile, MergeAddResult
+from .fast_merge import fast_merge_memos
 
 
 async def merge_or_add_new_memos(
@@ -64,33 +70,48 @@ async def merge_or_add_new_memos(
                 "new_profile": new_p,
             }
         )
-    merge_tasks = []
-    for dp in facts_to_update:
-        old_p: ProfileData = dp["old_profile"]
-        task = llm_complete(
-            project_id,
-            PROMPTS[use_language]["merge"].get_input(
-                old_p.attributes[ContanstTable.topic],
-                old_p.attributes[ContanstTable.sub_topic],
-                old_p.content,
-                dp["new_profile"]["content"],
-            ),
-            system_prompt=PROMPTS[use_language]["merge"].get_prompt(),
-            temperature=0.2,  # precise
-            **PROMPTS[use_language]["merge"].get_kwargs(),
+    update_responses: list[Optional[UpdateResponse]] = [None] * len(facts_to_update)
+    llm_indexes = []
+    fast_rules = Counter()
+    for i, fact in enumerate(facts_to_update):
+        fast_merge = (
+            fast_merge_memos(
+                fact["old_profile"].attributes[ContanstTable.topic],
+                fact["old_profile"].content,
+                fact["new_profile"]["content"],
+                use_language,
+            )
+            if CONFIG.merge_fast_path
+            else None
         )
-        merge_tasks.append(task)
-
-    merge_results: list[Promise] = await asyncio.gather(*merge_tasks)
-    for p, old_new_profile in zip(merge_results, facts_to_update):
-        if not p.ok():
-            LOG.warning(f"Failed to merge profiles: {p.msg()}")
+        if fast_merge is None:
+            llm_indexes.append(i)
             continue
-        old_p: ProfileData = old_new_profile["old_profile"]
-        update_response: UpdateResponse = parse_string_into_merge_action(p.data())
+        rule, memo = fast_merge
+        fast_rules[rule] += 1
+        update_responses[i] = {"action": "UPDATE", "memo": memo}
+
+    batch_size = max(1, CONFIG.max_merge_batch_size)
+    model = get_stage_model("merge", config)
+    merge_results = await asyncio.gather(
+        *[
+            merge_memos_batch(
+                project_id,
+                use_language,
+                [facts_to_update[j] for j in llm_indexes[i : i + batch_size]],
+                model,
+            )
+            for i in range(0, len(llm_indexes), batch_size)
+        ]
+    )
+    for i, r in zip(llm_indexes, [r for batch in merge_results for r in batch]):
+        update_responses[i] = r
+    if fast_rules:
+        record_fast_merges(project_id, fast_rules, len(facts_to_update), batch_size)
+    for update_response, old_new_profile in zip(update_responses, facts_to_update):
         if update_response is None:
-            LOG.warning(f"Failed to parse merge action: {p.data()}")
             continue
+        old_p: ProfileData = old_new_profile["old_profile"]
         if update_response["action"] == "UPDATE":
             if ContanstTable.update_hits not in old_p.attributes:
                 old_p.attributes[ContanstTable.update_hits] = 1
@@ -111,3 +132,98 @@ async def merge_or_add_new_memos(
             old_p.attributes[ContanstTable.update_hits]
         )
     return Promise.resolve(profile_option_results)
+
+
+def record_fast_merges(
+    project_id: str, fast_rules: Counter, total: int, batch_size: int
+):
+    avoided = math.ceil(total / batch_size) - math.ceil(
+        (total - fast_rules.total()) / batch_size
+    )
+    LOG.info(
+        f"Merged {fast_rules.total()}/{total} memos without LLM ({dict(fast_rules)}), {avoided} LLM calls avoided"
+    )
+    for rule, count in fast_rules.items():
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.MERGE_FAST_PATH,
+            count,
+            {"project_id": project_id, "rule": rule},
+        )
+    if avoided:
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.MERGE_LLM_CALLS_AVOIDED,
+            avoided,
+            {"project_id": project_id},
+        )
+
+
+async def merge_memos(
+    project_id: str, use_language: str, fact: dict, model: str = None
+) -> Optional[UpdateResponse]:
+    old_p: ProfileData = fact["old_profile"]
+    p = await llm_complete(
+        project_id,
+        PROMPTS[use_language]["merge"].get_input(
+            old_p.attributes[ContanstTable.topic],
+            old_p.attributes[ContanstTable.sub_topic],
+            old_p.content,
+            fact["new_profile"]["content"],
+        ),
+        system_prompt=PROMPTS[use_language]["merge"].get_prompt(),
+        temperature=0.2,  # precise
+        model=model,
+        stage="merge",
+        **PROMPTS[use_language]["merge"].get_kwargs(),
+    )
+    if not p.ok():
+        LOG.warning(f"Failed to merge profiles: {p.msg()}")
+        return None
+    update_response: UpdateResponse = parse_string_into_merge_action(p.data())
+    if update_response is None:
+        LOG.warning(f"Failed to parse merge action: {p.data()}")
+        if best_model := escalate_model(project_id, "merge", model):
+            return await merge_memos(project_id, use_language, fact, best_model)
+    return update_response
+
+
+async def merge_memos_batch(
+    project_id: str, use_language: str, facts: list[dict], model: str = None
+) -> list[Optional[UpdateResponse]]:
+    """Merge the facts in one LLM call, the ones missing from its answer are merged one by one"""
+    if len(facts) == 1:
+        return [await merge_memos(project_id, use_language, facts[0], model)]
+    p = await llm_complete(
+        project_id,
+        PROMPTS[use_language]["merge_batch"].get_input(
+            [
+                (
+                    f["old_profile"].attributes[ContanstTable.topic],
+                    f["old_profile"].attributes[ContanstTable.sub_topic],
+                    f["old_profile"].content,
+                    f["new_profile"]["content"],
+                )
+                for f in facts
+            ]
+        ),
+        system_prompt=PROMPTS[use_language]["merge_batch"].get_prompt(),
+        temperature=0.2,  # precise
+        model=model,
+        stage="merge",
+        **PROMPTS[use_language]["merge_batch"].get_kwargs(),
+    )
+    if not p.ok():
+        LOG.warning(f"Failed to merge profiles: {p.msg()}")
+        return [None] * len(facts)
+    actions = parse_string_into_merge_actions(p.data(), len(facts))
+    if not actions and (best_model := escalate_model(project_id, "merge", model)):
+        return await merge_memos_batch(project_id, use_language, facts, best_model)
+    missing = [i for i in range(len(facts)) if i not in actions]
+    if missing:
+        LOG.warning(
+            f"Failed to parse {len(missing)}/{len(facts)} batched merge actions, merge them one by one"
+        )
+    retried = await asyncio.gather(
+        *[merge_memos(project_id, use_language, facts[i], model) for i in missing]
+    )
+    actions.update(zip(missing, retried))
+    return [actions[i] for i in range(len(facts))]
@@ -6,7 +6,7 @@ from ....prompts.utils import parse_string_into_subtopics
 from ....models.utils import Promise
 from ....models.response import ProfileData
 from ....env import CONFIG, LOG, ProfileConfig, ContanstTable
-from ....llms import llm_complete
+from ....llms import llm_complete, get_stage_model, escalate_model
 
 
 async def organize_profiles(
@@ -29,7 +29,12 @@ async def organize_profiles(
         return Promise.resolve(None)
     ps = await asyncio.gather(
         *[
-            organize_profiles_by_topic(project_id, group, use_language)
+            organize_profiles_by_topic(
+                project_id,
+                group,
+                use_language,
+                get_stage_model("organize", config),
+            )
             for group in need_to_organize_topics.values()
         ]
     )
@@ -54,6 +59,7 @@ async def organize_profiles_by_topic(
     project_id: str,
     profiles: list[ProfileData],
     use_language: str,  # profiles in the same topics
+    model: str = None,
 ) -> Promise[list[AddProfile]]:
     assert (
         len(profiles) > CONFIG.max_profile_subtopics
@@ -86,12 +92,18 @@ async def organize_profiles_by_topic(
             CONFIG.max_profile_subtopics // 2 + 1, suggest_subtopics
         ),
         temperature=0.2,  # precise
+        model=model,
+        stage="organize",
         **PROMPTS[use_language]["organize"].get_kwargs(),
     )
     if not p.ok():
         return p
     results = p.data()
     subtopics = parse_string_into_subtopics(results)
+    if not subtopics and (best_model := escalate_model(project_id, "organize", model)):
+        return await organize_profiles_by_topic(
+            project_id, profiles, use_language, best_model
+        )
     reorganized_profiles: list[AddProfile] = [
         {
             "content": sp["memo"],
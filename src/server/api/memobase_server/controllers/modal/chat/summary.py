@@ -1,8 +1,8 @@
 import asyncio
 from ....models.utils import Promise
-from ....env import CONFIG, LOG
+from ....env import CONFIG, LOG, ProfileConfig
 from ....utils import get_blob_str, get_encoded_tokens, truncate_string
-from ....llms import llm_complete
+from ....llms import llm_complete, get_stage_model
 from ....prompts import (
     summary_profile,
 )
@@ -13,17 +13,20 @@ async def re_summary(
     project_id: str,
     add_profile: list[AddProfile],
     update_profile: list[UpdateProfile],
+    config: ProfileConfig = None,
 ) -> Promise[None]:
-    add_tasks = [summary_memo(project_id, ap) for ap in add_profile]
+    add_tasks = [summary_memo(project_id, ap, config) for ap in add_profile]
     await asyncio.gather(*add_tasks)
-    update_tasks = [summary_memo(project_id, up) for up in update_profile]
+    update_tasks = [summary_memo(project_id, up, config) for up in update_profile]
     ps = await asyncio.gather(*update_tasks)
     if not all([p.ok() for p in ps]):
         return Promise.reject("Failed to re-summary profiles")
     return Promise.resolve(None)
 
 
-async def summary_memo(project_id: str, content_pack: dict) -> Promise[None]:
+async def summary_memo(
+    project_id: str, content_pack: dict, config: ProfileConfig = None
+) -> Promise[None]:
     content = content_pack["content"]
     if len(get_encoded_tokens(content)) <= CONFIG.max_pre_profile_token_size:
         return Promise.resolve(None)
@@ -32,6 +35,8 @@ async def summary_memo(project_id: str, content_pack: dict) -> Promise[None]:
         content_pack["content"],
         system_prompt=summary_profile.get_prompt(),
         temperature=0.2,  # precise
+        model=get_stage_model("summary", config),
+        stage="summary",
         **summary_profile.get_kwargs(),
     )
     if not r.ok():
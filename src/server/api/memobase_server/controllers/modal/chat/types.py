@@ -6,6 +6,8 @@ from ....prompts import (
     merge_profile,
     zh_extract_profile,
     zh_merge_profile,
+    merge_profile_batch,
+    zh_merge_profile_batch,
     organize_profile,
 )
 from ....models.response import ProfileData
@@ -35,12 +37,14 @@ PROMPTS = {
         "profile": user_profile_topics,
         "extract": extract_profile,
         "merge": merge_profile,
+        "merge_batch": merge_profile_batch,
         "organize": organize_profile,
     },
     "zh": {
         "profile": zh_user_profile_topics,
         "extract": zh_extract_profile,
         "merge": zh_merge_profile,
+        "merge_batch": zh_merge_profile_batch,
         "organize": organize_profile,
     },
 }
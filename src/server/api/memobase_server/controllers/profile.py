@@ -1,10 +1,16 @@
+from uuid import uuid4
+from typing import Optional
 from pydantic import ValidationError
+from sqlalchemy import tuple_, values, column, update, cast, func
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import Session as SessionType
 from ..models.utils import Promise
 from ..models.database import GeneralBlob, UserProfile
 from ..models.response import CODE, IdData, IdsData, UserProfilesData
 from ..connectors import Session, get_redis_client
-from ..utils import get_encoded_tokens
+from ..utils import get_encoded_tokens, encode_cursor, decode_cursor
 from ..env import LOG, CONFIG
+from ..telemetry import traced
 
 
 async def truncate_profiles(
@@ -72,6 +78,7 @@ async def truncate_profiles(
     return Promise.resolve(profiles)
 
 
+@traced()
 async def get_user_profiles(user_id: str, project_id: str) -> Promise[UserProfilesData]:
     async with get_redis_client() as redis_client:
         user_profiles = await redis_client.get(
@@ -113,61 +120,244 @@ async def get_user_profiles(user_id: str, project_id: str) -> Promise[UserProfil
     return Promise.resolve(return_profiles)
 
 
-async def add_user_profiles(
+@traced()
+async def get_users_profiles(
+    user_ids: list[str], project_id: str
+) -> Promise[dict[str, UserProfilesData]]:
+    """Profiles of many users: cached ones from redis, the rest in one query"""
+    user_ids = list(dict.fromkeys(user_ids))
+    profiles = {}
+    async with get_redis_client() as redis_client:
+        cached = await redis_client.mget(
+            [f"user_profiles::{project_id}::{u}" for u in user_ids]
+        )
+    for user_id, user_profiles in zip(user_ids, cached):
+        if not user_profiles:
+            continue
+        try:
+            profiles[user_id] = UserProfilesData.model_validate_json(user_profiles)
+        except ValidationError as e:
+            LOG.error(f"Invalid user profiles: {e}")
+    missed = [u for u in user_ids if u not in profiles]
+    if not missed:
+        return Promise.resolve(profiles)
+
+    results = {u: [] for u in missed}
+    with Session() as session:
+        user_profiles = (
+            session.query(UserProfile)
+            .filter(
+                UserProfile.user_id.in_(missed), UserProfile.project_id == project_id
+            )
+            .order_by(UserProfile.updated_at.desc())
+            .all()
+        )
+        for up in user_profiles:
+            results[str(up.user_id)].append(
+                {
+                    "id": up.id,
+                    "content": up.content,
+                    "attributes": up.attributes,
+                    "created_at": up.created_at,
+                    "updated_at": up.updated_at,
+                }
+            )
+    async with get_redis_client() as redis_client:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id, rs in results.items():
+                profiles[user_id] = UserProfilesData(profiles=rs)
+                pipe.set(
+                    f"user_profiles::{project_id}::{user_id}",
+                    profiles[user_id].model_dump_json(),
+                    ex=CONFIG.cache_user_profiles_ttl,
+                )
+            await pipe.execute()
+    return Promise.resolve(profiles)
+
+
+async def get_user_profiles_page(
+    user_id: str, project_id: str, page_size: int, cursor: str = None
+) -> Promise[UserProfilesData]:
+    """Keyset page over profiles ordered by (created_at, id), bypassing the profile cache"""
+    with Session() as session:
+        query = (
+            session.query(UserProfile)
+            .filter_by(user_id=user_id, project_id=project_id)
+            .order_by(UserProfile.created_at, UserProfile.id)
+        )
+        if cursor is not None:
+            try:
+                last_created_at, last_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return Promise.reject(CODE.BAD_REQUEST, f"Invalid cursor: {cursor}")
+            query = query.filter(
+                tuple_(UserProfile.created_at, UserProfile.id)
+                > tuple_(last_created_at, last_id)
+            )
+        user_profiles = query.limit(page_size).all()
+        results = [
+            {
+                "id": up.id,
+                "content": up.content,
+                "attributes": up.attributes,
+                "created_at": up.created_at,
+                "updated_at": up.updated_at,
+            }
+            for up in user_profiles
+        ]
+        next_cursor = None
+        if len(user_profiles) == page_size:
+            next_cursor = encode_cursor(
+                user_profiles[-1].created_at, user_profiles[-1].id
+            )
+    return Promise.resolve(UserProfilesData(profiles=results, next_cursor=next_cursor))
+
+
+async def get_user_profiles_version(
+    user_id: str, project_id: str
+) -> Promise[Optional[str]]:
+    """A random version of the user's profiles, renewed after every write
+
+    Cheaper than loading the profiles to answer a conditional request. None if
+    the version was renewed while reading it.
+    """
+    key = f"user_profiles_version::{project_id}::{user_id}"
+    async with get_redis_client() as redis_client:
+        version = uuid4().hex
+        if await redis_client.set(
+            key, version, nx=True, ex=CONFIG.cache_user_profiles_ttl
+        ):
+            return Promise.resolve(version)
+        return Promise.resolve(await redis_client.get(key))
+
+
+async def invalidate_user_profiles_cache(user_id: str, project_id: str):
+    async with get_redis_client() as redis_client:
+        await redis_client.delete(
+            f"user_profiles::{project_id}::{user_id}",
+            f"user_profiles_version::{project_id}::{user_id}",
+        )
+
+
+def insert_profiles(
+    session: SessionType,
     user_id: str,
     project_id: str,
     profiles: list[str],
     attributes: list[dict],
-) -> Promise[IdsData]:
+) -> list:
     assert len(profiles) == len(
         attributes
     ), "Length of profiles, attributes must be equal"
-    with Session() as session:
-        db_profiles = [
-            UserProfile(
-                user_id=user_id, project_id=project_id, content=content, attributes=attr
-            )
-            for content, attr in zip(profiles, attributes)
-        ]
-        session.add_all(db_profiles)
-        session.commit()
-        profile_ids = [profile.id for profile in db_profiles]
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
-    return Promise.resolve(IdsData(ids=profile_ids))
+    db_profiles = [
+        UserProfile(
+            user_id=user_id, project_id=project_id, content=content, attributes=attr
+        )
+        for content, attr in zip(profiles, attributes)
+    ]
+    session.add_all(db_profiles)
+    session.flush()
+    return [profile.id for profile in db_profiles]
 
 
-async def update_user_profiles(
+def update_profiles(
+    session: SessionType,
     user_id: str,
     project_id: str,
     profile_ids: list[str],
     contents: list[str],
     attributes: list[dict | None],
-):
+) -> list:
+    """One UPDATE ... FROM (VALUES ...) for all rows, returns the ids that existed"""
     assert len(profile_ids) == len(
         contents
     ), "Length of profile_ids, contents must be equal"
     assert len(profile_ids) == len(
         attributes
     ), "Length of profile_ids, attributes must be equal"
-    with Session() as session:
-        db_profiles = []
-        for profile_id, content, attribute in zip(profile_ids, contents, attributes):
-            db_profile = (
-                session.query(UserProfile)
-                .filter_by(id=profile_id, user_id=user_id, project_id=project_id)
-                .one_or_none()
-            )
-            if db_profile is None:
+    if not len(profile_ids):
+        return []
+    # psycopg2 sends untyped parameters, VALUES columns are cast back explicitly
+    updates = values(
+        column("id"),
+        column("content"),
+        column("attributes", JSONB(none_as_null=True)),
+        name="profile_updates",
+    ).data(
+        [
+            (str(profile_id), content, attribute)
+            for profile_id, content, attribute in zip(profile_ids, contents, attributes)
+        ]
+    )
+    stmt = (
+        update(UserProfile)
+        .where(
+            UserProfile.id == cast(updates.c.id, UUID(as_uuid=True)),
+            UserProfile.user_id == user_id,
+            UserProfile.project_id == project_id,
+        )
+        .values(
+            content=updates.c.content,
+            attributes=func.coalesce(
+                cast(updates.c.attributes, JSONB), UserProfile.attributes
+            ),
+        )
+        .returning(UserProfile.id)
+        .execution_options(synchronize_session=False)
+    )
+    updated_ids = list(session.execute(stmt).scalars())
+    if len(updated_ids) != len(profile_ids):
+        found = {str(i) for i in updated_ids}
+        for profile_id in profile_ids:
+            if str(profile_id) not in found:
                 LOG.error(f"Profile {profile_id} not found for user {user_id}")
-                continue
-            db_profile.content = content
-            if attribute is not None:
-                db_profile.attributes = attribute
-            db_profiles.append(profile_id)
+    return updated_ids
+
+
+def delete_profiles(
+    session: SessionType, user_id: str, project_id: str, profile_ids: list[str]
+) -> int:
+    if not len(profile_ids):
+        return 0
+    return (
+        session.query(UserProfile)
+        .filter(
+            UserProfile.id.in_(profile_ids),
+            UserProfile.user_id == user_id,
+            UserProfile.project_id == project_id,
+        )
+        .delete(synchronize_session=False)
+    )
+
+
+async def add_user_profiles(
+    user_id: str,
+    project_id: str,
+    profiles: list[str],
+    attributes: list[dict],
+) -> Promise[IdsData]:
+    with Session() as session:
+        profile_ids = insert_profiles(
+            session, user_id, project_id, profiles, attributes
+        )
         session.commit()
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+    await invalidate_user_profiles_cache(user_id, project_id)
+    return Promise.resolve(IdsData(ids=profile_ids))
+
+
+async def update_user_profiles(
+    user_id: str,
+    project_id: str,
+    profile_ids: list[str],
+    contents: list[str],
+    attributes: list[dict | None],
+):
+    with Session() as session:
+        db_profiles = update_profiles(
+            session, user_id, project_id, profile_ids, contents, attributes
+        )
+        session.commit()
+    await invalidate_user_profiles_cache(user_id, project_id)
     return Promise.resolve(IdsData(ids=db_profiles))
 
 
@@ -186,8 +376,7 @@ async def delete_user_profile(
             )
         session.delete(db_profile)
         session.commit()
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+    await invalidate_user_profiles_cache(user_id, project_id)
     return Promise.resolve(None)
 
 
@@ -195,12 +384,7 @@ async def delete_user_profiles(
     user_id: str, project_id: str, profile_ids: list[str]
 ) -> Promise[None]:
     with Session() as session:
-        session.query(UserProfile).filter(
-            UserProfile.id.in_(profile_ids),
-            UserProfile.user_id == user_id,
-            UserProfile.project_id == project_id,
-        ).delete(synchronize_session=False)
+        delete_profiles(session, user_id, project_id, profile_ids)
         session.commit()
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+    await invalidate_user_profiles_cache(user_id, project_id)
     return Promise.resolve(None)
@@ -1,8 +1,11 @@
+from sqlalchemy import tuple_
 from ..models.utils import Promise
 from ..models.database import User, GeneralBlob, UserProfile
 from ..models.response import CODE, UserData, IdData, IdsData, UserProfilesData
 from ..connectors import Session
 from ..models.blob import BlobType
+from ..utils import encode_cursor, decode_cursor
+from .profile import invalidate_user_profiles_cache
 
 
 async def create_user(data: UserData, project_id: str) -> Promise[IdData]:
@@ -58,7 +61,8 @@ async def delete_user(user_id: str, project_id: str) -> Promise[None]:
             return Promise.reject(CODE.NOT_FOUND, f"User {user_id} not found")
         session.delete(db_user)
         session.commit()
-        return Promise.resolve(None)
+    await invalidate_user_profiles_cache(user_id, project_id)
+    return Promise.resolve(None)
 
 
 async def get_user_all_blobs(
@@ -67,16 +71,31 @@ async def get_user_all_blobs(
     blob_type: BlobType,
     page: int = 0,
     page_size: int = 10,
+    cursor: str = None,
 ) -> Promise[IdsData]:
     with Session() as session:
-        user_blobs = (
-            session.query(GeneralBlob.id)
+        query = (
+            session.query(GeneralBlob.id, GeneralBlob.created_at)
             .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .order_by(GeneralBlob.created_at)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
+            .order_by(GeneralBlob.created_at, GeneralBlob.id)
         )
+        if cursor is not None:
+            try:
+                last_created_at, last_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return Promise.reject(CODE.BAD_REQUEST, f"Invalid cursor: {cursor}")
+            query = query.filter(
+                tuple_(GeneralBlob.created_at, GeneralBlob.id)
+                > tuple_(last_created_at, last_id)
+            )
+        else:
+            query = query.offset(page * page_size)
+        user_blobs = query.limit(page_size).all()
         if user_blobs is None:
             return Promise.reject(CODE.NOT_FOUND, f"User {user_id} not found")
-        return Promise.resolve(IdsData(ids=[blob.id for blob in user_blobs]))
+        next_cursor = None
+        if len(user_blobs) == page_size:
+            next_cursor = encode_cursor(user_blobs[-1].created_at, user_blobs[-1].id)
+        return Promise.resolve(
+            IdsData(ids=[blob.id for blob in user_blobs], next_cursor=next_cursor)
+        )
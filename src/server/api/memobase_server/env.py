@@ -7,9 +7,9 @@ import datetime
 from rich.logging import RichHandler
 import yaml
 import logging
-import tiktoken
 import dataclasses
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional, Literal, Union
 from dotenv import load_dotenv
 from zoneinfo import ZoneInfo
@@ -38,6 +38,9 @@ class ContanstTable:
     update_hits = "update_hits"
 
 
+LLM_STAGES = ("extract", "merge", "organize", "summary")
+
+
 class TelemetryKeyName:
     insert_blob_request = "insert_blob_request"
     insert_blob_success_request = "insert_blob_success_request"
@@ -61,15 +64,71 @@ class Config:
     max_chat_blob_buffer_token_size: int = 1024
     max_profile_subtopics: int = 15
     max_pre_profile_token_size: int = 512
+    max_merge_batch_size: int = 10  # colliding facts merged in one LLM call
+    # Identical memos, and memos extending the other one, are merged without the LLM
+    merge_fast_path: bool = True
+    # Dated memos of these topics are appended to the old memo while it stays short
+    merge_append_topics: list[str] = field(default_factory=lambda: ["life_event"])
+    merge_append_max_token_size: int = 128
     llm_tab_separator: str = "::"
     cache_user_profiles_ttl: int = 60 * 20  # 20 minutes
+    flush_job_ttl: int = 60 * 60  # 1 hour
+    # A running job silent for this long is reported failed, its worker likely died
+    flush_job_stale_after: int = 60
+    flush_job_stream_timeout: int = 60 * 10  # longest a job progress stream stays open
+    # Postgres connections shared by all the worker processes of a server
+    database_max_connections: int = 80
+
+    # Admission control, concurrent requests per worker. Over the limit, a request
+    # waits up to admission_queue_timeout seconds, then gets a 503 with Retry-After
+    admission_read_concurrency: int = 256
+    admission_insert_concurrency: int = 64
+    admission_flush_concurrency: int = 8
+    admission_queue_timeout: float = 1.0
+    admission_retry_after: int = 5
+    # Share of the flush slots of each project tier when flushes queue up
+    flush_project_weights: dict[str, float] = field(
+        default_factory=lambda: {
+            ProjectStatus.active: 1,
+            ProjectStatus.pro: 2,
+            ProjectStatus.ultra: 4,
+        }
+    )
+
+    # Monthly partitions of user_events and general_blobs
+    partition_premake_months: int = 3
+    user_event_retention_months: Optional[int] = None  # None means keep forever
+    general_blob_retention_months: Optional[int] = None
+    partition_retention_action: Literal["detach", "drop"] = "detach"
+
+    # Roll old user events into one event per topic/sub_topic and period
+    event_compaction_after_days: Optional[int] = None  # None disables compaction
+    event_compaction_period: Literal["week", "month"] = "month"
+    event_compaction_use_llm: bool = False
+    event_compaction_interval: int = 60 * 60  # 1 hour
+    event_compaction_batch_users: int = 100
 
     # LLM
     language: Literal["en", "zh"] = "en"
     llm_style: Literal["openai", "doubao_cache"] = "openai"
     llm_base_url: str = None
     llm_api_key: str = None
+    # More OpenAI-compatible endpoints for the completions, dicts of name, base_url
+    # and api_key. Calls go to the fastest healthy one and fail over to the others
+    llm_providers: list[dict] = field(default_factory=list)
+    llm_timeout: float = 120
+    llm_circuit_breaker_failures: int = 5  # failures in a row to stop calling a provider
+    llm_circuit_breaker_cooldown: int = 30  # seconds before calling it again
+    llm_hedge_requests: bool = False  # race a 2nd request past the p95 latency
+    # Send OpenAI's prompt_cache_key with the calls, for the providers that accept it
+    llm_prompt_cache_key: bool = False
     best_llm_model: str = "gpt-4o-mini"
+    # Model of each flush stage (extract, merge, organize, summary), best_llm_model
+    # when unset. A merge/organize answer that fails to parse is redone with best_llm_model
+    stage_llm_models: dict[str, str] = field(default_factory=dict)
+    # Models a project may pick in its own stage_llm_models, on top of best_llm_model
+    # and the models above. Other picks fall back to the server's model of the stage
+    project_llm_models: list[str] = field(default_factory=list)
     embedding_model: str = "text-embedding-3-small"
     embedding_dim: int = 1536
     embedding_max_token_size: int = 8192
@@ -79,6 +138,14 @@ class Config:
 
     # Telemetry
     telemetry_deployment_environment: str = "local"
+    telemetry_metrics_exporter: Literal["prometheus", "otlp"] = "prometheus"
+    telemetry_prometheus_port: int = 9464  # worker N listens on port + N
+    telemetry_otlp_metrics_endpoint: Optional[str] = None
+    telemetry_metrics_export_interval: int = 15  # seconds, of the otlp exporter
+    tracing_exporter: Optional[Literal["console", "file", "otlp"]] = None
+    tracing_file_path: str = "memobase_traces.jsonl"
+    tracing_otlp_endpoint: Optional[str] = None
+    tracing_sample_ratio: float = 1.0
 
     @classmethod
     def load_config(cls) -> "Config":
@@ -111,10 +178,18 @@ class ProfileConfig:
     language: Literal["en", "zh"] = None
     additional_user_profiles: list[dict] = field(default_factory=list)
     overwrite_user_profiles: Optional[list[dict]] = None
+    stage_llm_models: dict[str, str] = field(default_factory=dict)
 
     def __post_init__(self):
         if self.language not in ["en", "zh"]:
             self.language = None
+        if not isinstance(self.stage_llm_models, dict):
+            self.stage_llm_models = {}
+        self.stage_llm_models = {
+            stage: model
+            for stage, model in self.stage_llm_models.items()
+            if stage in LLM_STAGES and isinstance(model, str)
+        }
 
     @classmethod
     def load_config_string(cls, config_string: str) -> "Config":
@@ -135,9 +210,18 @@ LOG.setLevel(logging.INFO)
 console_handler = RichHandler()
 LOG.addHandler(console_handler)
 
-# 2. Add encoder for tokenize strings
-ENCODER = tiktoken.encoding_for_model("gpt-4o")
+
+# 2. Add encoder for tokenize strings, loaded on first use
+@lru_cache(maxsize=None)
+def get_encoder():
+    import tiktoken
+
+    return tiktoken.encoding_for_model("gpt-4o")
 
 
 # 3. Load config
 CONFIG = Config.load_config()
+
+# 4. Worker processes, gunicorn.conf.py sets both when running multiple workers
+WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+WORKER_ID = int(os.getenv("MEMOBASE_WORKER_ID", 0))
@@ -1,7 +1,8 @@
 import time
+from typing import Optional
 from ..prompts.utils import convert_response_to_json
 from ..utils import get_encoded_tokens
-from ..env import CONFIG, LOG, TelemetryKeyName
+from ..env import CONFIG, LOG, TelemetryKeyName, ProfileConfig
 from ..models.utils import Promise
 from ..models.response import CODE
 from .openai import openai_complete
@@ -10,7 +11,9 @@ from ..telemetry.capture_key import capture_int_key
 from ..telemetry import (
     telemetry_manager, 
     CounterMetricName, 
-    HistogramMetricName
+    HistogramMetricName,
+    GaugeMetricName,
+    traced,
 )
 
 
@@ -18,21 +21,59 @@ FACTORIES = {"openai": openai_complete, "doubao_cache": doubao_cache_complete}
 assert CONFIG.llm_style in FACTORIES, f"Unsupported LLM style: {CONFIG.llm_style}"
 
 
+def allowed_project_models() -> set[str]:
+    """The models a project may pick, they run on the server's API key"""
+    return {
+        CONFIG.best_llm_model,
+        *CONFIG.stage_llm_models.values(),
+        *CONFIG.project_llm_models,
+    }
+
+
+def get_stage_model(stage: str, config: Optional[ProfileConfig] = None) -> str:
+    """The model of a flush stage, the project's choice first, then the server's"""
+    if config is not None and stage in config.stage_llm_models:
+        model = config.stage_llm_models[stage]
+        if model in allowed_project_models():
+            return model
+        LOG.warning(f"Model {model} is not allowed for projects, ignore it")
+    return CONFIG.stage_llm_models.get(stage, CONFIG.best_llm_model)
+
+
+def escalate_model(project_id: str, stage: str, model: str) -> Optional[str]:
+    """Return the best model to redo an answer `model` got wrong, None if it was the best already"""
+    if model in (None, CONFIG.best_llm_model):
+        return None
+    LOG.warning(
+        f"Failed to parse the {stage} answer of {model}, retry with {CONFIG.best_llm_model}"
+    )
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.LLM_ESCALATIONS,
+        1,
+        {"project_id": project_id, "stage": stage, "model": model},
+    )
+    return CONFIG.best_llm_model
+
+
 # TODO: add TPM/Rate limiter
+@traced("llm_complete")
 async def llm_complete(
     project_id,
     prompt,
     system_prompt=None,
     history_messages=[],
     json_mode=False,
+    model: str = None,
+    stage: str = "other",
     **kwargs,
 ) -> Promise[str | dict]:
+    model = model or CONFIG.best_llm_model
     if json_mode:
         kwargs["response_format"] = {"type": "json_object"}
     try:
         start_time = time.time()
-        results = await FACTORIES[CONFIG.llm_style](
-            CONFIG.best_llm_model,
+        results, cached_tokens = await FACTORIES[CONFIG.llm_style](
+            model,
             prompt,
             system_prompt=system_prompt,
             history_messages=history_messages,
@@ -57,24 +98,39 @@ async def llm_complete(
         TelemetryKeyName.llm_output_tokens, out_tokens, project_id=project_id
     )
 
+    attributes = {"project_id": project_id, "stage": stage, "model": model}
     telemetry_manager.increment_counter_metric(
-        CounterMetricName.LLM_TOKENS_INPUT,
-        in_tokens,
-        {"project_id": project_id},
+        CounterMetricName.LLM_TOKENS_INPUT, in_tokens, attributes
     )
     telemetry_manager.increment_counter_metric(
-        CounterMetricName.LLM_TOKENS_OUTPUT,
-        out_tokens,
-        {"project_id": project_id},
+        CounterMetricName.LLM_TOKENS_OUTPUT, out_tokens, attributes
     )
     telemetry_manager.increment_counter_metric(
-        CounterMetricName.LLM_INVOCATIONS,
-        1,
-        {"project_id": project_id},
+        CounterMetricName.LLM_TOKENS_CACHED, cached_tokens, attributes
+    )
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.LLM_INVOCATIONS, 1, attributes
     )
     telemetry_manager.record_histogram_metric(
-        HistogramMetricName.LLM_LATENCY_MS,
-        latency,
+        HistogramMetricName.LLM_LATENCY_MS, latency, attributes
+    )
+    telemetry_manager.set_span_attributes(
+        {
+            "llm.model": model,
+            "llm.stage": stage,
+            "llm.input_tokens": in_tokens,
+            "llm.cached_tokens": cached_tokens,
+            "llm.output_tokens": out_tokens,
+        }
+    )
+    telemetry_manager.set_gauge_metric(
+        GaugeMetricName.INPUT_TOKEN_COUNT,
+        in_tokens,
+        {"project_id": project_id},
+    )
+    telemetry_manager.set_gauge_metric(
+        GaugeMetricName.OUTPUT_TOKEN_COUNT,
+        out_tokens,
         {"project_id": project_id},
     )
 
@@ -1,20 +1,43 @@
-from .utils import exclude_special_kwargs, get_openai_async_client_instance
-from ..env import LOG
+from .utils import (
+    exclude_special_kwargs,
+    get_openai_provider_pool,
+    get_openai_retry_decorator,
+)
+from .providers import LLMProvider
+from .prompt_cache import build_messages, prefix_hash, get_cached_tokens
+from ..env import CONFIG, LOG
+
+
+def is_provider_failure(e: Exception) -> bool:
+    """Bad requests are the caller's fault, another provider would refuse them too"""
+    from openai import APIStatusError
+
+    if not isinstance(e, APIStatusError):
+        return True
+    return e.status_code in (408, 409, 429) or e.status_code >= 500
 
 
 async def openai_complete(
     model, prompt, system_prompt=None, history_messages=[], **kwargs
-) -> str:
-    _, kwargs = exclude_special_kwargs(kwargs)
-    openai_async_client = get_openai_async_client_instance()
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.extend(history_messages)
-    messages.append({"role": "user", "content": prompt})
+) -> tuple[str, int]:
+    special_kwargs, kwargs = exclude_special_kwargs(kwargs)
+    messages = build_messages(prompt, system_prompt, history_messages)
+    if CONFIG.llm_prompt_cache_key and system_prompt:
+        # Routes the calls of the same system prompt to the same cache
+        kwargs.setdefault("extra_body", {})["prompt_cache_key"] = prefix_hash(
+            model, system_prompt
+        )
+
+    async def create(provider: LLMProvider) -> tuple[str, int]:
+        response = await provider.client.chat.completions.create(
+            model=model, messages=messages, **kwargs
+        )
+        LOG.info(f"OpenAI usage ({provider.name}): {response.usage}")
+        return response.choices[0].message.content, get_cached_tokens(response.usage)
 
-    response = await openai_async_client.chat.completions.create(
-        model=model, messages=messages, timeout=120, **kwargs
+    complete = get_openai_retry_decorator()(get_openai_provider_pool().complete)
+    return await complete(
+        create,
+        key=f"{model}::{special_kwargs['prompt_id']}",
+        is_failure=is_provider_failure,
     )
-    LOG.info(f"OpenAI usage: {response.usage}")
-    return response.choices[0].message.content
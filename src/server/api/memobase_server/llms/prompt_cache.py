@@ -0,0 +1,76 @@
+"""
+Prompt layout for the provider caches. The static part of a call goes first: the
+system prompt, with the project's topic slots at its end, then the history, then
+the per-call input. OpenAI-compatible providers cache the longest repeated prefix
+by themselves, providers with explicit cache handles get one per system prompt.
+"""
+
+import hashlib
+from typing import Any, Awaitable, Callable, Optional
+from ..connectors import get_redis_client
+from ..env import LOG
+
+CACHE_HANDLE_EXPIRE_TIME = 60 * 60 * 24
+BEFORE_EXPIRE_TIME = 10
+
+
+def prefix_hash(model: str, system_prompt: str) -> str:
+    return hashlib.md5(f"{model}::{system_prompt}".encode()).hexdigest()
+
+
+def build_messages(
+    prompt: str, system_prompt: Optional[str] = None, history_messages: list = []
+) -> list[dict]:
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.extend(history_messages)
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+async def get_cache_handle(
+    provider: str,
+    model: str,
+    system_prompt: str,
+    create: Callable[[], Awaitable[Optional[str]]],
+) -> Optional[str]:
+    """The handle of the cached `system_prompt`, `create` makes one on a miss
+
+    Handles are shared by the workers through Redis, and expire a bit before the
+    provider drops them. None when `create` fails, the call then sends the prompt.
+    """
+    redis_key = (
+        f"memobase::prompt_cache::{provider}::{prefix_hash(model, system_prompt)}"
+    )
+    async with get_redis_client() as redis_client:
+        handle = await redis_client.get(redis_key)
+        if handle is not None:
+            await redis_client.expire(
+                redis_key, CACHE_HANDLE_EXPIRE_TIME - BEFORE_EXPIRE_TIME
+            )
+            return handle.decode() if isinstance(handle, bytes) else handle
+    try:
+        handle = await create()
+    except Exception as e:
+        LOG.error(f"Error creating {provider} prompt cache: {e}")
+        return None
+    if handle is None:
+        return None
+    async with get_redis_client() as redis_client:
+        await redis_client.set(
+            redis_key, handle, ex=CACHE_HANDLE_EXPIRE_TIME - BEFORE_EXPIRE_TIME
+        )
+    return handle
+
+
+def get_cached_tokens(usage: Any) -> int:
+    """Prompt tokens served from the provider cache, 0 when the usage doesn't tell"""
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        # DeepSeek style
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return cached or 0
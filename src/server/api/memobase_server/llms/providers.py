@@ -0,0 +1,181 @@
+"""
+A pool of OpenAI-compatible endpoints for the completions. Calls go to the
+healthiest endpoint, fail over to the next one, and can be hedged: when an
+answer is slower than the usual p95, a 2nd request is sent and the first
+answer wins.
+"""
+
+import time
+import asyncio
+from collections import deque
+from typing import Any, Callable, Awaitable, Optional
+from ..env import CONFIG, LOG
+from ..telemetry import telemetry_manager, CounterMetricName, GaugeMetricName
+
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+EWMA_ALPHA = 0.2
+
+
+class ProviderUnavailable(Exception):
+    pass
+
+
+class LLMProvider:
+    """One endpoint with a circuit breaker: opened after `llm_circuit_breaker_failures`
+    failures in a row, calls are let through again after `llm_circuit_breaker_cooldown` seconds
+    """
+
+    def __init__(self, name: str, client: Any):
+        self.name = name
+        self.client = client
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.latency: Optional[float] = None  # EWMA of the successful calls, seconds
+
+    def available(self) -> bool:
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= CONFIG.llm_circuit_breaker_cooldown
+
+    def score(self) -> float:
+        return self.latency or 0.0
+
+    def record_success(self, latency: float):
+        self.latency = (
+            latency
+            if self.latency is None
+            else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+        )
+        self.failures = 0
+        if self.opened_at is not None:
+            LOG.info(f"LLM provider {self.name} is back, close its circuit")
+            self.opened_at = None
+            self._report()
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.LLM_PROVIDER_FAILURES, 1, {"provider": self.name}
+        )
+        if self.failures >= CONFIG.llm_circuit_breaker_failures:
+            if self.opened_at is None:
+                LOG.warning(
+                    f"LLM provider {self.name} failed {self.failures} times in a row, open its circuit: {error}"
+                )
+            # A failed call after the cooldown keeps it open for another one
+            self.opened_at = time.monotonic()
+            self._report()
+
+    def _report(self):
+        telemetry_manager.set_gauge_metric(
+            GaugeMetricName.LLM_PROVIDER_CIRCUIT_OPEN,
+            int(self.opened_at is not None),
+            {"provider": self.name},
+        )
+
+
+class ProviderPool:
+    def __init__(self, providers: list[LLMProvider]):
+        assert len(providers), "At least one LLM provider is needed"
+        self.providers = providers
+        self._latencies: dict[str, deque[float]] = {}
+
+    def pick(self, exclude: set[str] = frozenset()) -> Optional[LLMProvider]:
+        """The fastest available provider, the first one wins ties"""
+        candidates = [
+            p for p in self.providers if p.name not in exclude and p.available()
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=LLMProvider.score)
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """p95 latency of the recent calls of `key`, None if hedging is off or there are too few"""
+        if not CONFIG.llm_hedge_requests:
+            return None
+        latencies = self._latencies.get(key)
+        if latencies is None or len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return sorted(latencies)[int(len(latencies) * 0.95)]
+
+    async def complete(
+        self,
+        call: Callable[[LLMProvider], Awaitable[Any]],
+        key: str,
+        is_failure: Callable[[Exception], bool] = lambda e: True,
+    ) -> Any:
+        """Run `call` on the providers until one answers
+
+        `key` groups the calls of similar latency for hedging, e.g. model and prompt.
+        An error that `is_failure` blames on the request rather than the provider
+        is raised right away.
+        """
+        pending: dict[asyncio.Task, LLMProvider] = {}
+        tried: set[str] = set()
+        last_error: Exception = ProviderUnavailable("All LLM providers are unavailable")
+
+        def launch(provider: Optional[LLMProvider]) -> Optional[LLMProvider]:
+            if provider is not None:
+                tried.add(provider.name)
+                task = asyncio.create_task(self._timed(provider, call, key, is_failure))
+                pending[task] = provider
+            return provider
+
+        launch(self.pick())
+        delay = self.hedge_delay(key)
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Slower than usual, race a 2nd request, on another provider if any
+                    delay = None
+                    hedge = launch(self.pick(tried) or self.pick())
+                    if hedge is not None:
+                        telemetry_manager.increment_counter_metric(
+                            CounterMetricName.LLM_HEDGED_REQUESTS,
+                            1,
+                            {"provider": hedge.name},
+                        )
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        LOG.warning(
+                            f"LLM provider {provider.name} failed: {last_error}"
+                        )
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    return succeeded[0].result()
+                if not is_failure(last_error):
+                    raise last_error
+                if not pending:
+                    launch(self.pick(tried))
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed(
+        self,
+        provider: LLMProvider,
+        call: Callable[[LLMProvider], Awaitable[Any]],
+        key: str,
+        is_failure: Callable[[Exception], bool],
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await call(provider)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if is_failure(e):
+                provider.record_failure(e)
+            raise
+        latency = time.perf_counter() - start
+        provider.record_success(latency)
+        self._latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(latency)
+        return result
@@ -1,6 +1,4 @@
-from openai import APIConnectionError, RateLimitError, AsyncOpenAI
-from volcenginesdkarkruntime import AsyncArk, Ark
-
+from typing import TYPE_CHECKING
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -8,13 +6,23 @@ from tenacity import (
     retry_if_exception_type,
 )
 from ..env import CONFIG
+from .providers import ProviderPool, LLMProvider
+
+# The LLM SDKs are slow to import, load them when the first client is built
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from volcenginesdkarkruntime import AsyncArk, Ark
 
 _global_openai_async_client = None
+_global_openai_provider_pool = None
 _global_doubao_async_client = None
 _global_doubao_client = None
+OPENAI_SDK_MAX_RETRIES = 2
 
 
 def get_openai_retry_decorator():
+    from openai import APIConnectionError, RateLimitError
+
     return retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -22,9 +30,11 @@ def get_openai_retry_decorator():
     )
 
 
-def get_openai_async_client_instance() -> AsyncOpenAI:
+def get_openai_async_client_instance() -> "AsyncOpenAI":
     global _global_openai_async_client
     if _global_openai_async_client is None:
+        from openai import AsyncOpenAI
+
         _global_openai_async_client = AsyncOpenAI(
             base_url=CONFIG.llm_base_url,
             api_key=CONFIG.llm_api_key,
@@ -32,17 +42,53 @@ def get_openai_async_client_instance() -> AsyncOpenAI:
     return _global_openai_async_client
 
 
-def get_doubao_async_client_instance() -> AsyncArk:
+def get_openai_provider_pool() -> ProviderPool:
+    global _global_openai_provider_pool
+    if _global_openai_provider_pool is None:
+        from openai import AsyncOpenAI
+
+        endpoints = [
+            {
+                "name": "default",
+                "base_url": CONFIG.llm_base_url,
+                "api_key": CONFIG.llm_api_key,
+            }
+        ] + CONFIG.llm_providers
+        # Failing over beats the SDK retrying the same endpoint, a lone endpoint
+        # keeps the SDK retries of transient errors (5xx, timeouts)
+        max_retries = 0 if len(endpoints) > 1 else OPENAI_SDK_MAX_RETRIES
+        _global_openai_provider_pool = ProviderPool(
+            [
+                LLMProvider(
+                    e.get("name") or e["base_url"],
+                    AsyncOpenAI(
+                        base_url=e.get("base_url"),
+                        api_key=e.get("api_key"),
+                        timeout=CONFIG.llm_timeout,
+                        max_retries=max_retries,
+                    ),
+                )
+                for e in endpoints
+            ]
+        )
+    return _global_openai_provider_pool
+
+
+def get_doubao_async_client_instance() -> "AsyncArk":
     global _global_doubao_async_client
 
     if _global_doubao_async_client is None:
+        from volcenginesdkarkruntime import AsyncArk
+
         _global_doubao_async_client = AsyncArk(api_key=CONFIG.llm_api_key)
     return _global_doubao_async_client
 
 
-def get_doubao_client_instance() -> Ark:
+def get_doubao_client_instance() -> "Ark":
     global _global_doubao_client
     if _global_doubao_client is None:
+        from volcenginesdkarkruntime import Ark
+
         _global_doubao_client = Ark(api_key=CONFIG.llm_api_key)
     return _global_doubao_client
 
@@ -93,7 +93,6 @@ class Project(Base):
         return root_project
 
 
-# TODO: add index for user id and ...
 @REG.mapped_as_dataclass
 class User(Base):
     __tablename__ = "users"
@@ -146,11 +145,14 @@ class GeneralBlob(Base):
     blob_type: Mapped[str] = mapped_column(VARCHAR(255), nullable=False)
     blob_data: Mapped[dict] = mapped_column(JSONB, nullable=False)
 
+    # No FK from buffer_zones: unique keys of a partitioned table must include created_at
     related_buffers: Mapped[list["BufferZone"]] = relationship(
         "BufferZone",
         back_populates="blob",
         cascade="all, delete-orphan",
         init=False,
+        primaryjoin="and_(GeneralBlob.id == foreign(BufferZone.blob_id), "
+        "GeneralBlob.project_id == foreign(BufferZone.project_id))",
         overlaps="user,related_buffers",
     )
 
@@ -169,19 +171,28 @@ class GeneralBlob(Base):
         foreign_keys=[user_id, project_id],
     )
     __table_args__ = (
-        PrimaryKeyConstraint("id", "project_id"),
+        PrimaryKeyConstraint("id", "project_id", "created_at"),
         Index("idx_general_blobs_user_id_project_id", "user_id", "project_id"),
         Index("idx_general_blobs_user_id_id", "user_id", "project_id", "id"),
         Index(
             "idx_general_blobs_user_id_blob_type", "user_id", "project_id", "blob_type"
         ),
-        Index("idx_general_blobs_id_project_id", "id", "project_id", unique=True),
+        Index(
+            "idx_general_blobs_user_id_blob_type_created_at_id",
+            "user_id",
+            "project_id",
+            "blob_type",
+            "created_at",
+            "id",
+        ),
+        Index("idx_general_blobs_id_project_id", "id", "project_id"),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
             ["users.id", "users.project_id"],
             ondelete="CASCADE",
             onupdate="CASCADE",
         ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
 
     # validate
@@ -227,13 +238,20 @@ class BufferZone(Base):
         "GeneralBlob",
         back_populates="related_buffers",
         init=False,
-        foreign_keys=[blob_id, project_id],
+        primaryjoin="and_(GeneralBlob.id == foreign(BufferZone.blob_id), "
+        "GeneralBlob.project_id == foreign(BufferZone.project_id))",
         overlaps="user,related_buffers",
     )
     __table_args__ = (
         PrimaryKeyConstraint("id", "project_id"),
+        # Covers the ordered scan on flush and the token-size/idle checks
         Index(
-            "idx_buffer_zones_user_id_blob_type", "user_id", "project_id", "blob_type"
+            "idx_buffer_zones_user_id_blob_type_created_at",
+            "user_id",
+            "project_id",
+            "blob_type",
+            "created_at",
+            postgresql_include=["token_size", "blob_id"],
         ),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
@@ -241,12 +259,6 @@ class BufferZone(Base):
             ondelete="CASCADE",
             onupdate="CASCADE",
         ),
-        ForeignKeyConstraint(
-            ["blob_id", "project_id"],
-            ["general_blobs.id", "general_blobs.project_id"],
-            ondelete="CASCADE",
-            onupdate="CASCADE",
-        ),
     )
 
     # validate
@@ -288,6 +300,19 @@ class UserProfile(Base):
         PrimaryKeyConstraint("id", "project_id"),
         Index("idx_user_profiles_user_id_project_id", "user_id", "project_id"),
         Index("idx_user_profiles_user_id_id_project_id", "user_id", "project_id", "id"),
+        Index(
+            "idx_user_profiles_user_id_created_at_id",
+            "user_id",
+            "project_id",
+            "created_at",
+            "id",
+        ),
+        Index(
+            "idx_user_profiles_user_id_updated_at",
+            "user_id",
+            "project_id",
+            "updated_at",
+        ),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
             ["users.id", "users.project_id"],
@@ -324,15 +349,23 @@ class UserEvent(Base):
     )
 
     __table_args__ = (
-        PrimaryKeyConstraint("id", "project_id"),
+        PrimaryKeyConstraint("id", "project_id", "created_at"),
         Index("idx_user_events_user_id_project_id", "user_id", "project_id"),
         Index("idx_user_events_user_id_id_project_id", "user_id", "project_id", "id"),
+        Index(
+            "idx_user_events_user_id_created_at_id",
+            "user_id",
+            "project_id",
+            "created_at",
+            "id",
+        ),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
             ["users.id", "users.project_id"],
             ondelete="CASCADE",
             onupdate="CASCADE",
         ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
 
 
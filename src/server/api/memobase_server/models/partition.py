@@ -0,0 +1,152 @@
+"""
+Monthly range partitions on created_at for the append-only tables.
+"""
+
+import re
+from datetime import datetime, timezone
+from typing import Literal
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from ..env import LOG, CONFIG
+
+PARTITIONED_TABLES = ["user_events", "general_blobs"]
+# Rows of other tables pointing into a partition, (table, column) by partitioned table.
+# No foreign key guards them, they are deleted with the partition
+PARTITION_REFERENCES = {"general_blobs": [("buffer_zones", "blob_id")]}
+
+
+def month_start(dt: datetime, offset: int = 0) -> datetime:
+    months = dt.year * 12 + dt.month - 1 + offset
+    return datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_p{start:%Y%m}"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    return (
+        conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table"
+            ),
+            {"table": table},
+        ).first()
+        is not None
+    )
+
+
+def list_partitions(conn: Connection, table: str) -> list[str]:
+    rows = conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits i "
+            "JOIN pg_class parent ON parent.oid = i.inhparent "
+            "JOIN pg_class child ON child.oid = i.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table},
+    ).all()
+    return [r.relname for r in rows]
+
+
+def create_month_partitions(
+    conn: Connection, table: str, start: datetime, end: datetime
+) -> list[str]:
+    """Create the monthly partitions covering [start, end) plus a default partition"""
+    existing = set(list_partitions(conn, table))
+    created = []
+    current = month_start(start)
+    while current < end:
+        upper = month_start(current, 1)
+        name = partition_name(table, current)
+        if name not in existing:
+            try:
+                with conn.begin_nested():
+                    conn.execute(
+                        text(
+                            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                            f"FOR VALUES FROM ('{current.isoformat()}') TO ('{upper.isoformat()}')"
+                        )
+                    )
+                created.append(name)
+            except Exception as e:
+                # e.g. the default partition already holds rows of this month
+                LOG.warning(f"Failed to create partition {name}: {e}")
+        current = upper
+    if f"{table}_default" not in existing:
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"
+            )
+        )
+    return created
+
+
+def drop_expired_partitions(
+    conn: Connection,
+    table: str,
+    keep_months: int,
+    action: Literal["detach", "drop"],
+    now: datetime,
+) -> list[str]:
+    """Detach or drop monthly partitions that end before `keep_months` months ago"""
+    cutoff = month_start(now, -keep_months)
+    expired = []
+    for name in list_partitions(conn, table):
+        m = re.fullmatch(rf"{table}_p(\d{{6}})", name)
+        if m is None:
+            continue
+        start = datetime.strptime(m.group(1), "%Y%m").replace(tzinfo=timezone.utc)
+        if month_start(start, 1) > cutoff:
+            continue
+        for ref_table, ref_column in PARTITION_REFERENCES.get(table, []):
+            deleted = conn.execute(
+                text(
+                    f"DELETE FROM {ref_table} r USING {name} p "
+                    f"WHERE r.{ref_column} = p.id AND r.project_id = p.project_id"
+                )
+            ).rowcount
+            if deleted:
+                LOG.info(f"Deleted {deleted} {ref_table} rows of partition {name}")
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if action == "drop":
+            conn.execute(text(f"DROP TABLE {name}"))
+        expired.append(name)
+    return expired
+
+
+def maintain_partitions(engine: Engine, now: datetime = None):
+    now = now or datetime.now(timezone.utc)
+    retention_months = {
+        "user_events": CONFIG.user_event_retention_months,
+        "general_blobs": CONFIG.general_blob_retention_months,
+    }
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as conn:
+            if not is_partitioned(conn, table):
+                LOG.warning(
+                    f"Table {table} is not partitioned, run `python -m memobase_server.cli init-db` to migrate it"
+                )
+                continue
+            created = create_month_partitions(
+                conn,
+                table,
+                now,
+                month_start(now, CONFIG.partition_premake_months + 1),
+            )
+            if created:
+                LOG.info(f"Created partitions {created}")
+            if retention_months[table] is None:
+                continue
+            expired = drop_expired_partitions(
+                conn,
+                table,
+                retention_months[table],
+                CONFIG.partition_retention_action,
+                now,
+            )
+            if expired:
+                LOG.info(
+                    f"Partitions {expired} are expired, {CONFIG.partition_retention_action} them"
+                )
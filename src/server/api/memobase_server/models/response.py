@@ -1,12 +1,16 @@
+import orjson
+import hashlib
 from datetime import datetime
-from enum import IntEnum
-from typing import Optional
+from enum import IntEnum, Enum
+from typing import Any, Optional
 from pydantic import BaseModel, UUID4, UUID5, Field
+from fastapi.responses import JSONResponse, Response
 from .blob import BlobData
 from .claim import ClaimData
 from .action import ActionData
 
 UUID = UUID4 | UUID5
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
 
 
 class CODE(IntEnum):
@@ -47,6 +51,9 @@ class IdData(BaseModel):
 
 class IdsData(BaseModel):
     ids: list[UUID] = Field(..., description="List of UUID identifiers")
+    next_cursor: Optional[str] = Field(
+        None, description="Cursor of the next page, empty when there is no more data"
+    )
 
 
 class ProfileData(BaseModel):
@@ -91,6 +98,35 @@ class ContextData(BaseModel):
     context: str = Field(..., description="Context string")
 
 
+class UsersContextData(BaseModel):
+    contexts: dict[str, str] = Field(..., description="Context string of each user id")
+
+
+class UsersContextRequest(BaseModel):
+    user_ids: list[UUID] = Field(
+        ..., min_length=1, max_length=100, description="The IDs of the users"
+    )
+    max_token_size: int = Field(
+        1000, gt=0, description="Max token size of each Context"
+    )
+    prefer_topics: Optional[list[str]] = Field(
+        None, description="Rank prefer topics at first to try to keep them in filtering"
+    )
+    only_topics: Optional[list[str]] = Field(
+        None, description="Only return profiles with these topics, default is all"
+    )
+    max_subtopic_size: Optional[int] = Field(
+        None, description="Max subtopic size of the same topic in each Context"
+    )
+    topic_limits: Optional[dict[str, int]] = Field(
+        None,
+        description="Specific subtopic limits for topics, override `max_subtopic_size`",
+    )
+    profile_event_ratio: float = Field(
+        0.8, gt=0, le=1, description="Profile event ratio of each Context"
+    )
+
+
 class UserData(BaseModel):
     data: Optional[dict] = Field(None, description="User additional data in JSON")
     id: Optional[UUID] = Field(None, description="User ID in UUIDv4/5")
@@ -104,10 +140,49 @@ class UserData(BaseModel):
 
 class UserProfilesData(BaseModel):
     profiles: list[ProfileData] = Field(..., description="List of user profiles")
+    next_cursor: Optional[str] = Field(
+        None, description="Cursor of the next page, empty when there is no more data"
+    )
 
 
 class UserEventsData(BaseModel):
     events: list[UserEventData] = Field(..., description="List of user events")
+    next_cursor: Optional[str] = Field(
+        None, description="Cursor of the next page, empty when there is no more data"
+    )
+
+
+class FlushJobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class FlushJobData(BaseModel):
+    id: str = Field(..., description="The flush job's unique identifier")
+    user_id: str = Field(..., description="The ID of the user")
+    blob_type: str = Field(..., description="The type of the flushed buffer")
+    status: FlushJobStatus = Field(
+        FlushJobStatus.pending, description="Status of the flush job"
+    )
+    stage: Optional[str] = Field(None, description="The stage running right now")
+    stage_seconds: dict[str, float] = Field(
+        default_factory=dict, description="Seconds spent in each finished stage"
+    )
+    blobs: int = Field(0, description="Number of flushed blobs")
+    facts_extracted: int = Field(0, description="Number of facts extracted")
+    profiles_added: int = Field(0, description="Number of profiles added")
+    profiles_updated: int = Field(0, description="Number of profiles updated")
+    profiles_deleted: int = Field(0, description="Number of profiles deleted")
+    errmsg: Optional[str] = Field(None, description="Error message of a failed job")
+    created_at: datetime = Field(..., description="Timestamp when the job was created")
+    updated_at: Optional[datetime] = Field(
+        None, description="Timestamp of the last progress report of the job"
+    )
+    finished_at: Optional[datetime] = Field(
+        None, description="Timestamp when the job finished"
+    )
 
 
 class StrIntData(BaseModel):
@@ -176,3 +251,53 @@ class UserContextDataResponse(BaseResponse):
     data: Optional[ContextData] = Field(
         None, description="Response containing user context"
     )
+
+
+class UsersContextDataResponse(BaseResponse):
+    data: Optional[UsersContextData] = Field(
+        None, description="Response containing the context of each user"
+    )
+
+
+class FlushJobDataResponse(BaseResponse):
+    data: Optional[FlushJobData] = Field(
+        None, description="Response containing the flush job"
+    )
+
+
+class ORJSONResponse(JSONResponse):
+    """Render response models with orjson, skipping FastAPI's jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.model_dump()
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+    def with_etag(
+        self, if_none_match: Optional[str] = None, etag: Optional[str] = None
+    ) -> Response:
+        """Tag the body with `etag` or a content hash, answer 304 if the client already has it"""
+        etag = etag or make_etag(self.body)
+        if etag_matches(etag, if_none_match):
+            return not_modified(etag)
+        self.headers.update(etag_headers(etag))
+        return self
+
+
+def make_etag(data: bytes) -> str:
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def etag_headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    client_etags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return etag in client_etags or "*" in client_etags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
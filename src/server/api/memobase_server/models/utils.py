@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from typing import TypeVar, Optional, Type, Generic
 from pydantic import ValidationError
-from .response import CODE, BaseResponse
+from .response import CODE, BaseResponse, ORJSONResponse
 from ..env import LOG
 
 
@@ -58,3 +58,7 @@ class Promise(Generic[D]):
                 errno=CODE.INTERNAL_SERVER_ERROR,
                 errmsg=str(e),
             )
+
+    def to_json_response(self, ResponseModel: Type[T]) -> ORJSONResponse:
+        """Return the response directly so FastAPI won't re-validate and re-encode it"""
+        return ORJSONResponse(self.to_response(ResponseModel))
@@ -3,6 +3,8 @@ from . import (
     zh_extract_profile,
     merge_profile,
     zh_merge_profile,
+    merge_profile_batch,
+    zh_merge_profile_batch,
     organize_profile,
     summary_profile,
 )
@@ -14,4 +16,6 @@ PROMPT_ID_TO_PROMPT = {
     "summary_profile": summary_profile,
     "zh_extract_profile": zh_extract_profile,
     "zh_merge_profile": zh_merge_profile,
+    "merge_profile_batch": merge_profile_batch,
+    "zh_merge_profile_batch": zh_merge_profile_batch,
 }
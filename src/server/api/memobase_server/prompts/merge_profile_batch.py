@@ -0,0 +1,74 @@
+from .utils import pack_merge_actions_into_string
+from .merge_profile import EXAMPLES
+from ..env import CONFIG
+
+ADD_KWARGS = {
+    "prompt_id": "merge_profile_batch",
+}
+
+MERGE_FACTS_BATCH_PROMPT = """You are a smart memo manager which controls the memory/figure of a user.
+You will be given numbered pairs of memos, each pair has one old and one new memo on the same topic/aspect of the user.
+For every pair, you should update the old memo with the new memo.
+And return your results in output format, one line for each pair:
+- INDEX{tab}UPDATE{tab}MEMO
+start with '- ' and following is the INDEX of the pair, '{tab}', 'UPDATE', '{tab}' and then the final MEMO of the pair.
+
+There are some guidelines about how to update the memo:
+## replace the old one
+The old memo is considered outdated and should be replaced with the new memo, or the new memo is conflicting with the old memo.
+## merge the memos
+Note that MERGE should be selected as long as there is information in the old memo that is not included in the new memo.
+The old and new memo tell different parts of the same story and should be merged together.
+## keep the old one
+If the new memo has no information added or containing nothing useful, you should keep the old memo.
+
+**Example**:
+{examples}
+
+Understand the memos wisely, you are allowed to infer the information from the new memo and old memo to decide the final memo.
+Follow the instruction mentioned below:
+- Do not return anything from the custom few shot prompts provided above.
+- Stick to the correct format, answer every pair exactly once.
+- Never mix up the information of different pairs.
+- Make sure each final memo is no more than 5 sentences.
+- Always concise and output the guts of the memo.
+"""
+
+
+def get_pair_input(index, topic, subtopic, old_memo, new_memo):
+    return f"""# Pair {index}
+## User Topic
+{topic}, {subtopic}
+## Old Memo
+{old_memo}
+## New Memo
+{new_memo}
+"""
+
+
+def get_input(memos: list[tuple[str, str, str, str]]) -> str:
+    """`memos` are (topic, subtopic, old_memo, new_memo) tuples, numbered from 1"""
+    return "\n".join(get_pair_input(i, *m) for i, m in enumerate(memos, start=1))
+
+
+def get_prompt() -> str:
+    example_input = "".join(
+        f"# Pair {i}\n{e['input']}" for i, e in enumerate(EXAMPLES, start=1)
+    )
+    examples = f"""INPUT:
+{example_input}
+OUTPUT:
+{pack_merge_actions_into_string([e['response'] for e in EXAMPLES])}
+"""
+    return MERGE_FACTS_BATCH_PROMPT.format(
+        examples=examples,
+        tab=CONFIG.llm_tab_separator,
+    )
+
+
+def get_kwargs() -> dict:
+    return ADD_KWARGS
+
+
+if __name__ == "__main__":
+    print(get_prompt())
@@ -37,11 +37,6 @@ You need to re-organize the memos into no more than {max_subtopics} sub_topics:
 - You can create new sub_topics if you find it necessary.
 - The final result should have no more than {max_subtopics} sub_topics.
 
-## Topics you should be aware of
-Below are some sub_topics you can refer to:
-{user_profile_topics}
-Try to merge the memos into the above sub_topics first, you can create new sub_topics if you find it necessary.
-
 ## Formatting
 ### Input
 You will receive a list of memos with sub_topics. The format of the memos is:
@@ -75,6 +70,11 @@ Remember the following:
 
 Notice, You should detect the language of the memos and re-organize the memos in the same language.
 请注意，你需要和输入的memo保持相同的语言输出新的memos.
+
+## Topics you should be aware of
+Below are some sub_topics you can refer to:
+{user_profile_topics}
+Try to merge the memos into the above sub_topics first, you can create new sub_topics if you find it necessary.
 """
 
 
@@ -154,6 +154,40 @@ def parse_string_into_merge_action(results: str) -> dict | None:
     }
 
 
+def pack_merge_actions_into_string(actions: list[dict]) -> str:
+    return "\n".join(
+        f"- {i}{CONFIG.llm_tab_separator}{a['action']}{CONFIG.llm_tab_separator}{a['memo']}"
+        for i, a in enumerate(actions, start=1)
+    )
+
+
+def parse_string_into_merge_actions(results: str, size: int) -> dict[int, dict]:
+    """Parse the `- INDEX::UPDATE::MEMO` lines of a batched merge, keyed by 0-based index
+
+    Pairs without a valid line are missing from the result.
+    """
+    actions = {}
+    for line in results.split("\n"):
+        line = line.strip()
+        if not line.startswith("- "):
+            continue
+        parts = line[2:].split(CONFIG.llm_tab_separator, 2)
+        if not len(parts) == 3:
+            continue
+        index, action, memo = parts
+        try:
+            index = int(index.strip().strip("[]")) - 1
+        except ValueError:
+            continue
+        action, memo = action.upper().strip(), memo.strip()
+        if not 0 <= index < size or index in actions:
+            continue
+        if action != "UPDATE" or not memo:
+            continue
+        actions[index] = {"action": action, "memo": memo}
+    return actions
+
+
 def pack_profiles_into_string(profiles: AIUserProfiles) -> str:
     lines = [
         f"- {attribute_unify(p.topic)}{CONFIG.llm_tab_separator}{attribute_unify(p.sub_topic)}{CONFIG.llm_tab_separator}{p.memo.strip()}"
@@ -0,0 +1,74 @@
+from .utils import pack_merge_actions_into_string
+from .zh_merge_profile import EXAMPLES
+from ..env import CONFIG
+
+ADD_KWARGS = {
+    "prompt_id": "zh_merge_profile_batch",
+}
+
+MERGE_FACTS_BATCH_PROMPT = """你是一个智能备忘录管理器，负责控制用户的记忆/形象。
+你将收到若干组编号的备忘录，每组包含关于用户同一主题/方面的两条备忘录，一条是旧的，一条是新的。
+对每一组，你应更新旧的备忘录，以包含新的备忘录中的信息。
+并以输出格式返回你的结果，每组一行：
+- INDEX{tab}UPDATE{tab}MEMO
+以'- '开头，接下来是该组的编号INDEX，然后是'{tab}'，'UPDATE'，'{tab}'，最后是该组最终的MEMO备忘录(5句话以内)。
+
+以下是如何生成最终的备忘录的指导原则：
+## 替换旧备忘录
+如果新备忘录与旧备忘录完全冲突，你应该用新的备忘录替换旧的备忘录。
+## 合并备忘录
+如果旧备忘录中包含新备忘录中没有的信息，你应该将旧备忘录和新备忘录合并。
+你需要总结新旧备忘录的内容，以便在最终备忘录中包含充分的信息。
+## 保持旧备忘录
+如果新备忘录中没有新的信息或者不包含任何有效信息，你应该保持旧的备忘录不变。
+
+**示例**：
+{examples}
+
+理解备忘录，你可以从新备忘录和旧备忘录中推断信息以决定正确的操作。
+遵循以下说明：
+- 不要返回上面提供的自定义少量提示中的任何内容。
+- 严格遵守正确的格式，每一组都要回答且只回答一次。
+- 不要混淆不同组的信息。
+- 每条最终的备忘录不能超过5句话, 不能超过100个字
+- 保持备忘录的简洁性
+"""
+
+
+def get_pair_input(index, topic, subtopic, old_memo, new_memo):
+    return f"""# 第{index}组
+## 用户主题
+{topic}, {subtopic}
+## 旧备忘录
+{old_memo}
+## 新备忘录
+{new_memo}
+"""
+
+
+def get_input(memos: list[tuple[str, str, str, str]]) -> str:
+    """`memos` are (topic, subtopic, old_memo, new_memo) tuples, numbered from 1"""
+    return "\n".join(get_pair_input(i, *m) for i, m in enumerate(memos, start=1))
+
+
+def get_prompt() -> str:
+    example_input = "".join(
+        f"# 第{i}组\n{e['input']}" for i, e in enumerate(EXAMPLES, start=1)
+    )
+    examples = f"""INPUT:
+{example_input}
+OUTPUT:
+{pack_merge_actions_into_string([e['response'] for e in EXAMPLES])}
+"""
+    return MERGE_FACTS_BATCH_PROMPT.format(
+        examples=examples,
+        tab=CONFIG.llm_tab_separator,
+    )
+
+
+def get_kwargs() -> dict:
+    return ADD_KWARGS
+
+
+if __name__ == "__main__":
+    print(get_prompt())
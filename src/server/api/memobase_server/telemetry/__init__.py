@@ -1,3 +1,17 @@
-from .open_telemetry import telemetry_manager, CounterMetricName, HistogramMetricName
+from .open_telemetry import (
+    telemetry_manager,
+    traced,
+    set_span_error,
+    CounterMetricName,
+    HistogramMetricName,
+    GaugeMetricName,
+)
 
-__all__ = ["telemetry_manager", "CounterMetricName", "HistogramMetricName"]
+__all__ = [
+    "telemetry_manager",
+    "traced",
+    "set_span_error",
+    "CounterMetricName",
+    "HistogramMetricName",
+    "GaugeMetricName",
+]
@@ -1,17 +1,39 @@
+import os
+import time
+import errno
+import socket
+import inspect
 from enum import Enum
-from typing import Dict
+from typing import Any, Dict, Optional
+from functools import wraps
+from contextlib import contextmanager
 
 from prometheus_client import start_http_server
-from opentelemetry import metrics
+from opentelemetry import metrics, trace
+from opentelemetry.trace import Span, Status, StatusCode
 from opentelemetry.exporter.prometheus import PrometheusMetricReader
 from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import MetricReader, PeriodicExportingMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.sdk.metrics._internal.instrument import (
     Counter,
     Histogram,
     Gauge,
 )
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource, DEPLOYMENT_ENVIRONMENT
-from ..env import LOG, CONFIG
+from opentelemetry.sdk.resources import (
+    SERVICE_NAME,
+    SERVICE_INSTANCE_ID,
+    Resource,
+    DEPLOYMENT_ENVIRONMENT,
+)
+from ..env import LOG, CONFIG, WORKER_ID
+from ..models.utils import Promise
 
 class CounterMetricName(Enum):
     """Enum for all available metrics."""
@@ -21,6 +43,14 @@ class CounterMetricName(Enum):
     LLM_INVOCATIONS = "llm_invocations_total"
     LLM_TOKENS_INPUT = "llm_input_tokens_total"
     LLM_TOKENS_OUTPUT = "llm_output_tokens_total"
+    LLM_TOKENS_CACHED = "llm_cached_tokens_total"
+    FLUSH_ROWS_WRITTEN = "flush_rows_written_total"
+    ADMISSION_REJECTED = "admission_rejected_total"
+    MERGE_FAST_PATH = "merge_fast_path_total"
+    MERGE_LLM_CALLS_AVOIDED = "merge_llm_calls_avoided_total"
+    LLM_ESCALATIONS = "llm_escalations_total"
+    LLM_PROVIDER_FAILURES = "llm_provider_failures_total"
+    LLM_HEDGED_REQUESTS = "llm_hedged_requests_total"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
@@ -30,6 +60,14 @@ class CounterMetricName(Enum):
             CounterMetricName.LLM_INVOCATIONS: "Total number of LLM invocations",
             CounterMetricName.LLM_TOKENS_INPUT: "Total number of input tokens",
             CounterMetricName.LLM_TOKENS_OUTPUT: "Total number of output tokens",
+            CounterMetricName.LLM_TOKENS_CACHED: "Total number of input tokens served from the provider's prompt cache",
+            CounterMetricName.FLUSH_ROWS_WRITTEN: "Total number of rows written by buffer flushes",
+            CounterMetricName.ADMISSION_REJECTED: "Total number of requests and flushes turned away by a full admission pool",
+            CounterMetricName.MERGE_FAST_PATH: "Total number of memos merged by rules, without the LLM",
+            CounterMetricName.MERGE_LLM_CALLS_AVOIDED: "Total number of merge LLM calls saved by the rule-based merges",
+            CounterMetricName.LLM_ESCALATIONS: "Total number of stage answers redone with the best model after failing to parse",
+            CounterMetricName.LLM_PROVIDER_FAILURES: "Total number of failed calls to an LLM provider",
+            CounterMetricName.LLM_HEDGED_REQUESTS: "Total number of 2nd requests sent to race a slow LLM call",
         }
         return descriptions[self]
 
@@ -43,12 +81,24 @@ class HistogramMetricName(Enum):
 
     LLM_LATENCY_MS = "llm_latency"
     REQUEST_LATENCY_MS = "request_latency"
+    BUFFER_STAGE_LATENCY_MS = "buffer_stage_latency"
+    FLUSH_STAGE_LATENCY_MS = "flush_stage_latency"
+    LOCK_WAIT_MS = "lock_wait"
+    DB_QUERY_LATENCY_MS = "db_query_latency"
+    ADMISSION_WAIT_MS = "admission_wait"
+    REDIS_COMMAND_LATENCY_MS = "redis_command_latency"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
         descriptions = {
             HistogramMetricName.LLM_LATENCY_MS: "Latency of the LLM in milliseconds",
             HistogramMetricName.REQUEST_LATENCY_MS: "Latency of the request in milliseconds",
+            HistogramMetricName.BUFFER_STAGE_LATENCY_MS: "Latency of buffer checks and flushes in milliseconds",
+            HistogramMetricName.FLUSH_STAGE_LATENCY_MS: "Latency of each flush pipeline stage in milliseconds",
+            HistogramMetricName.LOCK_WAIT_MS: "Time spent waiting for a user lock in milliseconds",
+            HistogramMetricName.DB_QUERY_LATENCY_MS: "Latency of database statements in milliseconds",
+            HistogramMetricName.ADMISSION_WAIT_MS: "Time a project waited for a flush slot in milliseconds",
+            HistogramMetricName.REDIS_COMMAND_LATENCY_MS: "Latency of Redis commands and pipelines in milliseconds",
         }
         return descriptions[self]
 
@@ -62,12 +112,22 @@ class GaugeMetricName(Enum):
 
     INPUT_TOKEN_COUNT = "input_token_count_per_call"
     OUTPUT_TOKEN_COUNT = "output_token_count_per_call"
+    ADMISSION_ACTIVE = "admission_active"
+    ADMISSION_WAITING = "admission_waiting"
+    ADMISSION_SATURATION = "admission_saturation"
+    ADMISSION_PROJECT_QUEUED = "admission_project_queued"
+    LLM_PROVIDER_CIRCUIT_OPEN = "llm_provider_circuit_open"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
         descriptions = {
             GaugeMetricName.INPUT_TOKEN_COUNT: "Number of input tokens per call",
             GaugeMetricName.OUTPUT_TOKEN_COUNT: "Number of output tokens per call",
+            GaugeMetricName.ADMISSION_ACTIVE: "Number of requests holding a slot of an admission pool",
+            GaugeMetricName.ADMISSION_WAITING: "Number of requests waiting for a slot of an admission pool",
+            GaugeMetricName.ADMISSION_SATURATION: "Share of the slots of an admission pool in use",
+            GaugeMetricName.ADMISSION_PROJECT_QUEUED: "Number of flushes of a project waiting for a slot",
+            GaugeMetricName.LLM_PROVIDER_CIRCUIT_OPEN: "1 when the circuit of an LLM provider is open and it gets no calls",
         }
         return descriptions[self]
 
@@ -90,37 +150,157 @@ class TelemetryManager:
             Counter | Histogram | Gauge,
         ] = None
         self._meter = None
-
-    def setup_telemetry(self) -> None:
-        """Initialize OpenTelemetry with Prometheus exporter."""
-        resource = Resource(attributes={
-            SERVICE_NAME: self._service_name,
-            DEPLOYMENT_ENVIRONMENT: self._deployment_environment,
-            })
-        reader = PrometheusMetricReader()
-        provider = MeterProvider(resource=resource, metric_readers=[reader])
+        # No-op until setup_tracing() installs a tracer provider
+        self._tracer = trace.get_tracer(service_name)
+
+    def _resource(self) -> Resource:
+        return Resource(
+            attributes={
+                SERVICE_NAME: self._service_name,
+                # Keeps the series of the worker processes apart
+                SERVICE_INSTANCE_ID: f"{socket.gethostname()}-{os.getpid()}",
+                DEPLOYMENT_ENVIRONMENT: self._deployment_environment,
+            }
+        )
+
+    def setup_telemetry(
+        self,
+        exporter: str = "prometheus",
+        otlp_endpoint: str = None,
+        export_interval: float = 15,
+    ) -> None:
+        """Initialize OpenTelemetry metrics, scraped by Prometheus or pushed with OTLP."""
+        readers: list[MetricReader] = []
+        if exporter == "prometheus":
+            readers.append(PrometheusMetricReader())
+            self._start_prometheus_server()
+        elif exporter == "otlp":
+            try:
+                from opentelemetry.exporter.otlp.proto.http.metric_exporter import (
+                    OTLPMetricExporter,
+                )
+            except ImportError:
+                LOG.error(
+                    "Install opentelemetry-exporter-otlp-proto-http to export metrics with OTLP, metrics are not exported"
+                )
+            else:
+                readers.append(
+                    PeriodicExportingMetricReader(
+                        OTLPMetricExporter(endpoint=otlp_endpoint),
+                        export_interval_millis=export_interval * 1000,
+                    )
+                )
+        else:
+            raise ValueError(f"Unknown metrics exporter: {exporter}")
+        provider = MeterProvider(resource=self._resource(), metric_readers=readers)
         metrics.set_meter_provider(provider)
 
+        # Initialize meter
+        self._meter = metrics.get_meter(self._service_name)
+
+    def _start_prometheus_server(self) -> None:
         # Start Prometheus HTTP server, skip if port is already in use
         try:
             start_http_server(self._prometheus_port)
         except OSError as e:
-            if e.errno == 48:  # Address already in use
+            if e.errno == errno.EADDRINUSE:
                 LOG.warning(
-                    f"Prometheus HTTP server already running on port {self._prometheus_port}"
+                    f"Port {self._prometheus_port} is in use, metrics of this worker are not served. "
+                    "Run multiple workers with gunicorn.conf.py or the otlp metrics exporter"
                 )
             else:
                 raise e
-
-        # Initialize meter
-        self._meter = metrics.get_meter(self._service_name)
+        else:
+            LOG.info(f"Serve Prometheus metrics on port {self._prometheus_port}")
     
+    def setup_tracing(
+        self,
+        exporter: Optional[str],
+        sample_ratio: float = 1.0,
+        file_path: str = None,
+        otlp_endpoint: str = None,
+    ) -> None:
+        """Initialize OpenTelemetry tracing, spans stay no-op if `exporter` is None."""
+        if exporter is None:
+            return
+        if exporter == "console":
+            span_exporter: SpanExporter = ConsoleSpanExporter()
+        elif exporter == "file":
+            span_exporter = ConsoleSpanExporter(
+                out=open(file_path, "a"),
+                formatter=lambda span: span.to_json(indent=None) + "\n",
+            )
+        elif exporter == "otlp":
+            try:
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                    OTLPSpanExporter,
+                )
+            except ImportError:
+                LOG.error(
+                    "Install opentelemetry-exporter-otlp-proto-http to export traces with OTLP, tracing is disabled"
+                )
+                return
+            span_exporter = OTLPSpanExporter(endpoint=otlp_endpoint)
+        else:
+            raise ValueError(f"Unknown tracing exporter: {exporter}")
+
+        # Sample at the root span, child spans follow their parent's decision
+        provider = TracerProvider(
+            resource=self._resource(),
+            sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+        )
+        provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        trace.set_tracer_provider(provider)
+        self._tracer = trace.get_tracer(self._service_name)
+        LOG.info(
+            f"Tracing enabled with {exporter} exporter, sample ratio {sample_ratio}"
+        )
+
+    @contextmanager
+    def start_span(
+        self, name: str, attributes: Dict[str, Any] = None, end_on_exit: bool = True
+    ):
+        """Run the block in a span, child of the current span if there is one."""
+        with self._tracer.start_as_current_span(
+            name, attributes=attributes, end_on_exit=end_on_exit
+        ) as span:
+            yield span
+
+    def start_db_span(self, statement: str) -> Span:
+        """Start a span for a SQL statement, the caller ends it."""
+        return self._tracer.start_span(
+            statement,
+            kind=trace.SpanKind.CLIENT,
+            attributes={"db.system": "postgresql", "db.operation": statement},
+        )
+
+    def set_span_attributes(self, attributes: Dict[str, Any]) -> None:
+        """Add attributes to the current span."""
+        trace.get_current_span().set_attributes(attributes)
+
     def _construct_attributes(self, **kwargs) -> Dict[str, str]:
         return {
             DEPLOYMENT_ENVIRONMENT: self._deployment_environment,
             **kwargs,
         }
 
+    def start(self) -> None:
+        """Start the exporters and create the metrics, called once by the app lifespan."""
+        if self._meter is not None:
+            return
+        self.setup_telemetry(
+            CONFIG.telemetry_metrics_exporter,
+            otlp_endpoint=CONFIG.telemetry_otlp_metrics_endpoint,
+            export_interval=CONFIG.telemetry_metrics_export_interval,
+        )
+        self.setup_metrics()
+        self.setup_tracing(
+            CONFIG.tracing_exporter,
+            sample_ratio=CONFIG.tracing_sample_ratio,
+            file_path=CONFIG.tracing_file_path,
+            otlp_endpoint=CONFIG.tracing_otlp_endpoint,
+        )
+
     def setup_metrics(self) -> None:
         """Initialize all metrics."""
         if not self._meter:
@@ -145,7 +325,7 @@ class TelemetryManager:
                 description=metric.get_description(),
             )
 
-        # Create gauges for token counts
+        # Create gauges
         for metric in GaugeMetricName:
             self._metrics[metric] = self._meter.create_gauge(
                 metric.get_metric_name(),
@@ -160,7 +340,8 @@ class TelemetryManager:
         attributes: Dict[str, str] = None,
     ) -> None:
         """Increment a counter metric."""
-        self._validate_metric(metric)
+        if not self._validate_metric(metric):
+            return
         complete_attributes = self._construct_attributes(**(attributes or {}))
         self._metrics[metric].add(value, complete_attributes)
 
@@ -171,10 +352,26 @@ class TelemetryManager:
         attributes: Dict[str, str] = None,
     ) -> None:
         """Record a histogram metric value."""
-        self._validate_metric(metric)
+        if not self._validate_metric(metric):
+            return
         complete_attributes = self._construct_attributes(**(attributes or {}))
         self._metrics[metric].record(value, complete_attributes)
 
+    @contextmanager
+    def record_latency(
+        self,
+        metric: HistogramMetricName,
+        attributes: Dict[str, str] = None,
+    ):
+        """Record the milliseconds spent in the block to a histogram metric."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_histogram_metric(
+                metric, (time.perf_counter() - start) * 1000, attributes
+            )
+
     def set_gauge_metric(
         self,
         metric: GaugeMetricName,
@@ -182,17 +379,52 @@ class TelemetryManager:
         attributes: Dict[str, str] = None,
     ) -> None:
         """Set a gauge metric."""
-        self._validate_metric(metric)
+        if not self._validate_metric(metric):
+            return
         complete_attributes = self._construct_attributes(**(attributes or {}))
         self._metrics[metric].set(value, complete_attributes)
 
-    def _validate_metric(self, metric) -> None:
-        """Validate if the metric is initialized."""
+    def _validate_metric(self, metric) -> bool:
+        """Validate if the metric is initialized, metrics are dropped before start()."""
+        if self._metrics is None:
+            return False
         if metric not in self._metrics:
             raise KeyError(f"Metric {metric} not initialized")
+        return True
+
+
+def set_span_error(span: Span, result: Any) -> None:
+    """Mark the span as failed if the result is a rejected Promise."""
+    if isinstance(result, Promise) and not result.ok():
+        span.set_status(Status(StatusCode.ERROR, result.msg()))
+
+
+def traced(name: str = None):
+    """Run an async controller in a span, tagged with its `project_id` argument"""
 
+    def decorator(func):
+        span_name = name or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+        signature = inspect.signature(func)
 
-# Create a global instance
-telemetry_manager = TelemetryManager(deployment_environment=CONFIG.telemetry_deployment_environment)
-telemetry_manager.setup_telemetry()
-telemetry_manager.setup_metrics()
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            attributes = {}
+            if "project_id" in signature.parameters:
+                bound = signature.bind_partial(*args, **kwargs).arguments
+                if bound.get("project_id") is not None:
+                    attributes["memobase.project_id"] = str(bound["project_id"])
+            with telemetry_manager.start_span(span_name, attributes) as span:
+                result = await func(*args, **kwargs)
+                set_span_error(span, result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+# Create a global instance, started by the app lifespan
+telemetry_manager = TelemetryManager(
+    prometheus_port=CONFIG.telemetry_prometheus_port + WORKER_ID,
+    deployment_environment=CONFIG.telemetry_deployment_environment,
+)
@@ -1,12 +1,16 @@
 import yaml
+import base64
+import orjson
+from uuid import UUID
 from typing import cast
 from datetime import timezone, datetime
 from functools import wraps
-from .env import ENCODER, LOG, CONFIG
+from .env import get_encoder, LOG, CONFIG
 from .models.blob import Blob, BlobType, ChatBlob, DocBlob, OpenAICompatibleMessage
 from .models.database import GeneralBlob
 from .models.response import UserEventData
 from .connectors import get_redis_client, PROJECT_ID
+from .telemetry import telemetry_manager, HistogramMetricName
 
 
 def event_str_repr(event: UserEventData) -> str:
@@ -23,11 +27,11 @@ def event_str_repr(event: UserEventData) -> str:
 
 
 def get_encoded_tokens(content: str) -> list[int]:
-    return ENCODER.encode(content)
+    return get_encoder().encode(content)
 
 
 def get_decoded_tokens(tokens: list[int]) -> str:
-    return ENCODER.decode(tokens)
+    return get_encoder().decode(tokens)
 
 
 def truncate_string(content: str, max_tokens: int):
@@ -98,7 +102,16 @@ def user_id_lock(scope, lock_timeout=128, blocking_timeout=32):
                     lock_key, timeout=lock_timeout, blocking_timeout=blocking_timeout
                 )
                 try:
-                    if not await lock.acquire(blocking=True):
+                    with (
+                        telemetry_manager.start_span(
+                            "lock_wait", {"memobase.lock_scope": scope}
+                        ),
+                        telemetry_manager.record_latency(
+                            HistogramMetricName.LOCK_WAIT_MS, {"scope": scope}
+                        ),
+                    ):
+                        acquired = await lock.acquire(blocking=True)
+                    if not acquired:
                         raise TimeoutError(
                             f"Could not acquire lock for user {user_id} in scope {scope}"
                         )
@@ -129,3 +142,22 @@ def is_valid_profile_config(profile_config: str) -> bool:
     except yaml.YAMLError as e:
         LOG.error(f"Invalid profile config: {e}")
         return False
+
+
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    """Opaque keyset cursor pointing at the (created_at, id) of the last returned row"""
+    raw = orjson.dumps([created_at.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    padding = "=" * (-len(cursor) % 4)
+    value = orjson.loads(base64.urlsafe_b64decode(cursor + padding))
+    if not (
+        isinstance(value, list)
+        and len(value) == 2
+        and all(isinstance(v, str) for v in value)
+    ):
+        raise ValueError("Cursor is not a (created_at, id) pair")
+    created_at, id = value
+    return datetime.fromisoformat(created_at), UUID(id)
@@ -0,0 +1,62 @@
+"""hot query indexes
+
+Revision ID: 46d4df6955a4
+Revises: df8d34227ec8
+Create Date: 2026-10-19 04:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "46d4df6955a4"
+down_revision: Union[str, None] = "df8d34227ec8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# UserEvent pages (created_at desc) already scan idx_user_events_user_id_created_at_id
+# backwards, see f0aa6b6f1721
+
+
+def upgrade() -> None:
+    op.create_index(
+        "idx_buffer_zones_user_id_blob_type_created_at",
+        "buffer_zones",
+        ["user_id", "project_id", "blob_type", "created_at"],
+        postgresql_include=["token_size", "blob_id"],
+        if_not_exists=True,
+    )
+    # Prefix of the index above
+    op.drop_index(
+        "idx_buffer_zones_user_id_blob_type",
+        table_name="buffer_zones",
+        if_exists=True,
+    )
+    op.create_index(
+        "idx_user_profiles_user_id_updated_at",
+        "user_profiles",
+        ["user_id", "project_id", "updated_at"],
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "idx_user_profiles_user_id_updated_at",
+        table_name="user_profiles",
+        if_exists=True,
+    )
+    op.create_index(
+        "idx_buffer_zones_user_id_blob_type",
+        "buffer_zones",
+        ["user_id", "project_id", "blob_type"],
+        if_not_exists=True,
+    )
+    op.drop_index(
+        "idx_buffer_zones_user_id_blob_type_created_at",
+        table_name="buffer_zones",
+        if_exists=True,
+    )
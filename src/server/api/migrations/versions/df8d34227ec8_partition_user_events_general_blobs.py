@@ -0,0 +1,216 @@
+"""partition user_events and general_blobs by month
+
+Revision ID: df8d34227ec8
+Revises: f0aa6b6f1721
+Create Date: 2026-10-19 03:00:00.000000
+
+"""
+
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+
+# revision identifiers, used by Alembic.
+revision: str = "df8d34227ec8"
+down_revision: Union[str, None] = "f0aa6b6f1721"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PREMAKE_MONTHS = 3
+
+COLUMNS = {
+    "user_events": ["id", "project_id", "user_id", "event_data"],
+    "general_blobs": [
+        "id",
+        "project_id",
+        "user_id",
+        "blob_type",
+        "blob_data",
+        "additional_fields",
+    ],
+}
+
+INDEXES = {
+    "user_events": [
+        ("idx_user_events_user_id_project_id", ["user_id", "project_id"]),
+        ("idx_user_events_user_id_id_project_id", ["user_id", "project_id", "id"]),
+        (
+            "idx_user_events_user_id_created_at_id",
+            ["user_id", "project_id", "created_at", "id"],
+        ),
+    ],
+    "general_blobs": [
+        ("idx_general_blobs_user_id_project_id", ["user_id", "project_id"]),
+        ("idx_general_blobs_user_id_id", ["user_id", "project_id", "id"]),
+        (
+            "idx_general_blobs_user_id_blob_type",
+            ["user_id", "project_id", "blob_type"],
+        ),
+        (
+            "idx_general_blobs_user_id_blob_type_created_at_id",
+            ["user_id", "project_id", "blob_type", "created_at", "id"],
+        ),
+        ("idx_general_blobs_id_project_id", ["id", "project_id"]),
+    ],
+}
+
+
+def month_start(dt: datetime, offset: int = 0) -> datetime:
+    months = dt.year * 12 + dt.month - 1 + offset
+    return datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def table_columns(table: str) -> list[sa.Column]:
+    columns = [
+        sa.Column("id", UUID(as_uuid=True), nullable=False),
+        sa.Column("project_id", sa.VARCHAR(64), nullable=False),
+        sa.Column("user_id", UUID(as_uuid=True), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+    ]
+    if table == "user_events":
+        columns.append(sa.Column("event_data", JSONB, nullable=False))
+    else:
+        columns.extend(
+            [
+                sa.Column("blob_type", sa.VARCHAR(255), nullable=False),
+                sa.Column("blob_data", JSONB, nullable=False),
+                sa.Column("additional_fields", JSONB, nullable=True),
+            ]
+        )
+    return columns
+
+
+def move_rows(source: str, target: str, table: str):
+    columns = ", ".join(COLUMNS[table] + ["created_at", "updated_at"])
+    op.execute(f"INSERT INTO {target} ({columns}) SELECT {columns} FROM {source}")
+
+
+def rename_to_legacy(table: str):
+    op.rename_table(table, f"{table}_legacy")
+    op.execute(
+        f"ALTER TABLE {table}_legacy RENAME CONSTRAINT {table}_pkey TO {table}_legacy_pkey"
+    )
+    for name, _ in INDEXES[table]:
+        op.drop_index(name, table_name=f"{table}_legacy", if_exists=True)
+
+
+def create_indexes(table: str):
+    for name, columns in INDEXES[table]:
+        op.create_index(name, table, columns)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return (
+        conn.execute(
+            sa.text(
+                "SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table"
+            ),
+            {"table": table},
+        ).first()
+        is not None
+    )
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    now = datetime.now(timezone.utc)
+    # Unique keys of a partitioned table must contain the partition key
+    op.execute(
+        "ALTER TABLE buffer_zones DROP CONSTRAINT IF EXISTS buffer_zones_blob_id_project_id_fkey"
+    )
+    for table in ["user_events", "general_blobs"]:
+        # Tables created by `init-db` are partitioned from the start
+        if is_partitioned(conn, table):
+            continue
+        rename_to_legacy(table)
+        op.create_table(
+            table,
+            *table_columns(table),
+            sa.PrimaryKeyConstraint("id", "project_id", "created_at"),
+            sa.ForeignKeyConstraint(
+                ["user_id", "project_id"],
+                ["users.id", "users.project_id"],
+                ondelete="CASCADE",
+                onupdate="CASCADE",
+            ),
+            postgresql_partition_by="RANGE (created_at)",
+        )
+        create_indexes(table)
+
+        oldest = conn.execute(
+            sa.text(f"SELECT min(created_at) FROM {table}_legacy")
+        ).scalar()
+        current = month_start(oldest or now)
+        end = month_start(now, PREMAKE_MONTHS + 1)
+        while current < end:
+            upper = month_start(current, 1)
+            op.execute(
+                f"CREATE TABLE {table}_p{current:%Y%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{current.isoformat()}') TO ('{upper.isoformat()}')"
+            )
+            current = upper
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+        move_rows(f"{table}_legacy", table, table)
+        op.drop_table(f"{table}_legacy")
+
+
+def downgrade() -> None:
+    for table in ["user_events", "general_blobs"]:
+        op.rename_table(table, f"{table}_partitioned")
+        op.execute(
+            f"ALTER TABLE {table}_partitioned RENAME CONSTRAINT {table}_pkey TO {table}_partitioned_pkey"
+        )
+        for name, _ in INDEXES[table]:
+            op.drop_index(name, table_name=f"{table}_partitioned", if_exists=True)
+        op.create_table(
+            table,
+            *table_columns(table),
+            sa.PrimaryKeyConstraint("id", "project_id"),
+            sa.ForeignKeyConstraint(
+                ["user_id", "project_id"],
+                ["users.id", "users.project_id"],
+                ondelete="CASCADE",
+                onupdate="CASCADE",
+            ),
+        )
+        create_indexes(table)
+        move_rows(f"{table}_partitioned", table, table)
+        # Dropping the parent drops every partition with it
+        op.drop_table(f"{table}_partitioned")
+
+    op.drop_index("idx_general_blobs_id_project_id", table_name="general_blobs")
+    op.create_index(
+        "idx_general_blobs_id_project_id",
+        "general_blobs",
+        ["id", "project_id"],
+        unique=True,
+    )
+    op.execute(
+        "DELETE FROM buffer_zones b WHERE NOT EXISTS "
+        "(SELECT 1 FROM general_blobs g WHERE g.id = b.blob_id AND g.project_id = b.project_id)"
+    )
+    op.create_foreign_key(
+        "buffer_zones_blob_id_project_id_fkey",
+        "buffer_zones",
+        "general_blobs",
+        ["blob_id", "project_id"],
+        ["id", "project_id"],
+        ondelete="CASCADE",
+        onupdate="CASCADE",
+    )
@@ -0,0 +1,48 @@
+"""keyset pagination indexes
+
+Revision ID: f0aa6b6f1721
+Revises:
+Create Date: 2026-10-19 02:40:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f0aa6b6f1721"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tables created by `create_all` on a fresh database already have these indexes
+INDEXES = [
+    (
+        "idx_general_blobs_user_id_blob_type_created_at_id",
+        "general_blobs",
+        ["user_id", "project_id", "blob_type", "created_at", "id"],
+    ),
+    (
+        "idx_user_profiles_user_id_created_at_id",
+        "user_profiles",
+        ["user_id", "project_id", "created_at", "id"],
+    ),
+    (
+        "idx_user_events_user_id_created_at_id",
+        "user_events",
+        ["user_id", "project_id", "created_at", "id"],
+    ),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade() -> None:
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
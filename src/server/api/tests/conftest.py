@@ -2,8 +2,10 @@ import pytest
 import asyncio
 from api import app
 from fastapi.testclient import TestClient
+from memobase_server.connectors import create_tables
 
 PREFIX = "/api/v1"
+TABLES_CREATED = False
 
 # @pytest.fixture(scope="session")
 # def event_loop():
@@ -17,10 +19,14 @@ PREFIX = "/api/v1"
 
 @pytest.fixture(scope="function")
 async def db_env():
+    global TABLES_CREATED
     client = TestClient(app)
     response = client.get(f"{PREFIX}/healthcheck")
     d = response.json()
     if response.status_code == 200 and d["errno"] == 0:
+        if not TABLES_CREATED:
+            create_tables()
+            TABLES_CREATED = True
         yield
     else:
         pytest.skip("Database not available")
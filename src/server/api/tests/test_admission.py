@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from memobase_server.admission import ConcurrencyPool, FairConcurrencyPool
+
+
+@pytest.mark.asyncio
+async def test_concurrency_pool():
+    pool = ConcurrencyPool("test", 2)
+    release = asyncio.Event()
+
+    async def hold():
+        async with pool.slot(timeout=0) as admitted:
+            assert admitted
+            await release.wait()
+
+    holders = [asyncio.create_task(hold()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert pool.active == 2
+
+    # Full pool: fail fast, or after the queue timeout
+    async with pool.slot(timeout=0) as admitted:
+        assert not admitted
+    async with pool.slot(timeout=0.05) as admitted:
+        assert not admitted
+    assert pool.waiting == 0
+
+    # A waiter gets the first slot that frees up
+    async def wait_for_slot():
+        async with pool.slot(timeout=None) as admitted:
+            return admitted
+
+    waiter = asyncio.create_task(wait_for_slot())
+    await asyncio.sleep(0)
+    assert pool.waiting == 1
+    release.set()
+    await asyncio.gather(*holders)
+    assert await waiter
+    assert pool.active == 0 and pool.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_fair_concurrency_pool():
+    pool = FairConcurrencyPool("test", 1)
+    served = []
+
+    async def flush(project_id: str, weight: float):
+        async with pool.slot(timeout=None, project_id=project_id, weight=weight):
+            served.append(project_id)
+            await asyncio.sleep(0)
+
+    # The noisy project queues first, the others still get their share
+    async with pool.slot(timeout=None, project_id="noisy"):
+        tasks = [asyncio.create_task(flush("noisy", 1)) for _ in range(8)]
+        tasks += [asyncio.create_task(flush("quiet", 1)) for _ in range(2)]
+        tasks += [asyncio.create_task(flush("ultra", 4)) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert pool.waiting == 14
+    await asyncio.gather(*tasks)
+
+    assert served[:6].count("ultra") == 4
+    assert served.index("quiet") < 3
+    assert served[-5:] == ["noisy"] * 5
+    assert pool.active == 0 and pool.waiting == 0
@@ -1,11 +1,19 @@
 import os
+import time
 import pytest
 from unittest.mock import patch, Mock, AsyncMock
-from api import app
+from api import app, AuthMiddleware
+from fastapi import FastAPI, BackgroundTasks
 from fastapi.testclient import TestClient
 from memobase_server import controllers
 from memobase_server.models.database import DEFAULT_PROJECT_ID
 from memobase_server.models.blob import BlobType
+from memobase_server.telemetry import telemetry_manager, HistogramMetricName
+from memobase_server.admission import FLUSH_POOL
+from memobase_server.env import CONFIG
+from memobase_server.models import response as res
+from memobase_server.models.utils import Promise
+from datetime import datetime, timezone
 
 PREFIX = "/api/v1"
 TOKEN = os.getenv("ACCESS_TOKEN")
@@ -31,6 +39,54 @@ def test_health_check(client, db_env):
     assert d["errno"] == 0
 
 
+def test_request_latency_excludes_background_tasks():
+    bg_app = FastAPI()
+
+    @bg_app.post("/api/v1/slow_background")
+    async def slow_background(background_tasks: BackgroundTasks):
+        background_tasks.add_task(time.sleep, 1)
+        return {"errno": 0}
+
+    bg_app.add_middleware(AuthMiddleware)
+    with patch.object(telemetry_manager, "record_histogram_metric") as mock_record:
+        response = TestClient(bg_app).post(
+            "/api/v1/slow_background", headers={"Authorization": "Bearer root"}
+        )
+    assert response.status_code == 200
+    mock_record.assert_called_once()
+    metric, latency, attributes = mock_record.call_args.args
+    assert metric == HistogramMetricName.REQUEST_LATENCY_MS
+    assert attributes["path"] == "/api/v1/slow_background"
+    assert latency < 500
+
+
+def test_flush_job_skips_flush_admission(client):
+    job = Mock(
+        data=res.FlushJobData(
+            id="job-1",
+            user_id="u1",
+            blob_type="chat",
+            created_at=datetime.now(timezone.utc),
+        )
+    )
+    with patch.object(FLUSH_POOL, "active", FLUSH_POOL.limit), patch.object(
+        CONFIG, "admission_queue_timeout", 0
+    ), patch.object(
+        controllers.buffer,
+        "start_flush_job",
+        AsyncMock(return_value=Promise.resolve(job)),
+    ), patch.object(
+        controllers.buffer, "run_flush_job", AsyncMock()
+    ):
+        # The job queues for a flush slot in the background, it is not turned away
+        response = client.post(f"{PREFIX}/users/buffer/u1/chat?wait=false")
+        assert response.status_code == 200
+        assert response.json()["data"]["id"] == "job-1"
+
+        response = client.post(f"{PREFIX}/users/buffer/u1/chat")
+        assert response.status_code == 503
+
+
 @pytest.fixture
 def mock_llm_complete():
     with patch(
@@ -230,6 +286,16 @@ async def test_api_user_profile(client, db_env):
     assert [dp["content"] for dp in d["data"]["profiles"]] == _profiles
     assert [dp["attributes"] for dp in d["data"]["profiles"]] == _attributes
     id1, id2 = d["data"]["profiles"][0]["id"], d["data"]["profiles"][1]["id"]
+    etag = response.headers["ETag"]
+
+    # The profile version answers the 304, the profiles are not loaded
+    with patch.object(controllers.profile, "get_user_profiles") as mock_get:
+        response = client.get(
+            f"{PREFIX}/users/profile/{u_id}", headers={"If-None-Match": etag}
+        )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    mock_get.assert_not_called()
 
     response = client.get(
         f"{PREFIX}/users/profile/{u_id}?prefer_topics=interest&topk=1"
@@ -253,14 +319,33 @@ async def test_api_user_profile(client, db_env):
     d = response.json()
     assert response.status_code == 200
     assert d["errno"] == 0
+    context = d["data"]["context"]
+
+    response = client.post(
+        f"{PREFIX}/users/context/batch",
+        json={"user_ids": [u_id], "only_topics": ["interest"]},
+    )
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+    assert d["data"]["contexts"] == {u_id: context}
+
+    response = client.post(
+        f"{PREFIX}/users/context/batch",
+        json={"user_ids": [u_id], "profile_event_ratio": 1.5},
+    )
+    assert response.status_code == 422
 
     response = client.delete(f"{PREFIX}/users/profile/{u_id}/{id1}")
     d = response.json()
     assert response.status_code == 200
 
-    response = client.get(f"{PREFIX}/users/profile/{u_id}")
+    response = client.get(
+        f"{PREFIX}/users/profile/{u_id}", headers={"If-None-Match": etag}
+    )
     d = response.json()
     assert response.status_code == 200
+    assert response.headers["ETag"] != etag
     assert d["errno"] == 0
     assert len(d["data"]["profiles"]) == 1
     assert d["data"]["profiles"][0]["id"] == id2
@@ -330,6 +415,56 @@ async def test_api_user_flush_buffer(client, db_env, mock_llm_complete):
     assert d["errno"] == 0
 
 
+def test_api_user_flush_job(client, db_env, mock_llm_complete):
+    response = client.post(f"{PREFIX}/users", json={"data": {"test": 1}})
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+    u_id = d["data"]["id"]
+
+    response = client.post(
+        f"{PREFIX}/blobs/insert/{u_id}",
+        json={
+            "blob_type": "chat",
+            "blob_data": {
+                "messages": [
+                    {"role": "user", "content": "hello, I'm Gus"},
+                    {"role": "assistant", "content": "hi"},
+                ]
+            },
+        },
+    )
+    assert response.json()["errno"] == 0
+
+    response = client.post(f"{PREFIX}/users/buffer/{u_id}/chat?wait=false")
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+    job_id = d["data"]["id"]
+
+    # TestClient runs the background flush before returning
+    response = client.get(f"{PREFIX}/users/buffer/{u_id}/jobs/{job_id}")
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+    assert d["data"]["status"] == "done"
+    assert d["data"]["blobs"] == 1
+    assert d["data"]["facts_extracted"] == 1
+    assert d["data"]["profiles_added"] == 1
+    assert {"extract", "merge", "commit"} <= set(d["data"]["stage_seconds"])
+
+    response = client.get(f"{PREFIX}/users/buffer/{u_id}/jobs/{job_id}/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert '"status":"done"' in response.text
+
+    response = client.get(f"{PREFIX}/users/buffer/{u_id}/jobs/not-a-job")
+    assert response.json()["errno"] == 404
+
+    response = client.delete(f"{PREFIX}/users/{u_id}")
+    assert response.json()["errno"] == 0
+
+
 def test_chat_blob_param_api(client, db_env):
     response = client.post(f"{PREFIX}/users", json={})
     d = response.json()
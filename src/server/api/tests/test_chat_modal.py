@@ -5,7 +5,12 @@ from memobase_server.models import response as res
 from memobase_server.models.database import DEFAULT_PROJECT_ID
 from memobase_server.models.blob import BlobType
 from memobase_server.models.utils import Promise
-
+from memobase_server.controllers.modal.chat import commit_profile_changes
+from memobase_server.controllers.modal.chat.fast_merge import fast_merge_memos
+from memobase_server.controllers.modal.chat.merge import merge_memos
+from memobase_server.env import CONFIG, ProfileConfig
+from memobase_server.llms import get_stage_model
+from memobase_server.prompts.utils import parse_string_into_merge_actions
 
 GD_FACTS = """
 - basic_info::name::Gus
@@ -33,8 +38,9 @@ OVER_MAX_PROFILE_ATTRS = [
     {"topic": "interest", "sub_topic": "foods" + str(i)} for i in range(20)
 ]
 
+# Both colliding facts go in one batch, the answer misses the 2nd one so it's merged alone
 MERGE_FACTS = [
-    "- UPDATE::user likes Chinese and Japanese food",
+    "- 1::UPDATE::user likes Chinese and Japanese food",
     "- UPDATE::High School",
 ]
 
@@ -260,6 +266,101 @@ async def test_chat_merge_modal(
     assert mock_merge_llm_complete.await_count == 2
 
 
+def test_parse_batched_merge_actions():
+    actions = parse_string_into_merge_actions(
+        """- 2::UPDATE::High School
+- 1::update::user likes Chinese food :: and Japanese food
+- 1::UPDATE::duplicated
+- 3::UPDATE::Feels bored
+- 6::UPDATE::out of range
+- 4::DELETE::not an update
+- 5::UPDATE::
+not a line""",
+        size=5,
+    )
+    assert actions == {
+        0: {"action": "UPDATE", "memo": "user likes Chinese food :: and Japanese food"},
+        1: {"action": "UPDATE", "memo": "High School"},
+        2: {"action": "UPDATE", "memo": "Feels bored"},
+    }
+    assert parse_string_into_merge_actions("- 3::UPDATE::out of range", size=2) == {}
+
+
+def test_fast_merge_memos():
+    old = "User likes Japanese food, especially sushi."
+    cases = [
+        ("interest", old, "user likes japanese food", ("subsumed", old)),
+        ("interest", old, "User likes Japanese food!", ("subsumed", old)),
+        ("interest", "User likes Japanese food", old, ("subsumed", old)),
+        ("interest", "喜欢日本料理", "喜欢日本料理。", ("identical", "喜欢日本料理")),
+        ("interest", old, "user likes Chinese food", None),
+        # Word order, negations, numbers and whole words matter
+        ("interest", "Sushi", old, None),
+        ("interest", old, "user likes sushi japanese food", None),
+        ("basic_info", "User is not married", "User is married", None),
+        ("basic_info", "User is not married", "married", None),
+        ("basic_info", "User is married", "User is married, not anymore", None),
+        ("work", "User works at Google, not Meta", "User works at Meta", None),
+        (
+            "life_event",
+            "moved from Paris to London",
+            "moved from London to Paris",
+            None,
+        ),
+        ("interest", "用户不喜欢猫", "用户喜欢猫", None),
+        ("interest", "用户喜欢猫", "用户不喜欢猫", None),
+        ("basic_info", "user is 39 years old", "user is 3", None),
+        ("basic_info", "user is 39 years old", "user is 40 years old", None),
+        (
+            "life_event",
+            "Married at 2025/01/01",
+            "Moved to Seattle at 2025/03/02",
+            ("append", "Married at 2025/01/01; Moved to Seattle at 2025/03/02"),
+        ),
+        ("interest", "Sushi", "Ramen at 2025/03/02", None),
+    ]
+    for topic, old_memo, new_memo, expected in cases:
+        assert fast_merge_memos(topic, old_memo, new_memo, "en") == expected
+
+
+@pytest.mark.asyncio
+async def test_merge_escalates_to_best_model():
+    with patch.object(CONFIG, "stage_llm_models", {"merge": "cheap", "summary": "x"}):
+        config = ProfileConfig(stage_llm_models={"summary": "y", "unknown": "z"})
+        assert config.stage_llm_models == {"summary": "y"}
+        assert get_stage_model("merge", config) == "cheap"
+        # Projects only pick models the server allows
+        assert get_stage_model("summary", config) == "x"
+        with patch.object(CONFIG, "project_llm_models", ["y"]):
+            assert get_stage_model("summary", config) == "y"
+        config = ProfileConfig(stage_llm_models={"extract": "cheap"})
+        assert get_stage_model("extract", config) == "cheap"
+        assert get_stage_model("organize", config) == CONFIG.best_llm_model
+
+    fact = {
+        "old_profile": Mock(
+            content="user likes japanese food",
+            attributes={"topic": "interest", "sub_topic": "foods"},
+        ),
+        "new_profile": {"content": "Chinese food"},
+    }
+    with patch(
+        "memobase_server.controllers.modal.chat.merge.llm_complete",
+        AsyncMock(
+            side_effect=[
+                Promise.resolve("I can't answer in this format"),
+                Promise.resolve("- UPDATE::user likes Chinese and Japanese food"),
+            ]
+        ),
+    ) as mock_llm:
+        r = await merge_memos(DEFAULT_PROJECT_ID, "en", fact, "cheap")
+    assert r == {"action": "UPDATE", "memo": "user likes Chinese and Japanese food"}
+    assert [c.kwargs["model"] for c in mock_llm.await_args_list] == [
+        "cheap",
+        CONFIG.best_llm_model,
+    ]
+
+
 @pytest.mark.asyncio
 async def test_chat_organize_modal(
     db_env, mock_extract_llm_complete, mock_organize_llm_complete
@@ -306,3 +407,40 @@ async def test_chat_organize_modal(
     assert p.ok()
     assert mock_extract_llm_complete.await_count == 1
     assert mock_organize_llm_complete.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_commit_is_atomic(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    profile_options = {
+        "add": [{"content": PROFILES[0], "attributes": PROFILE_ATTRS[0]}],
+        "update": [],
+        "delete": [],
+        "before_profiles": [],
+    }
+    # The event payload is invalid, so the added profile must not be written either
+    p = await commit_profile_changes(
+        u_id, DEFAULT_PROJECT_ID, profile_options, [{"content": None}]
+    )
+    assert not p.ok()
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok() and len(p.data().profiles) == 0
+
+    p = await commit_profile_changes(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        profile_options,
+        [{"content": PROFILES[0], "attributes": PROFILE_ATTRS[0]}],
+    )
+    assert p.ok()
+    assert p.data() == {"added": 1, "updated": 0, "deleted": 0}
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok() and len(p.data().profiles) == 1
+    p = await controllers.event.get_user_events(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok() and len(p.data().events) == 1
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
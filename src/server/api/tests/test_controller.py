@@ -1,8 +1,15 @@
+from datetime import datetime, timedelta, timezone
+import uuid
+import base64
+import orjson
 import pytest
+from unittest.mock import patch
 from memobase_server import controllers
 from memobase_server.models import response as res
 from memobase_server.models.blob import BlobType
 from memobase_server.models.database import DEFAULT_PROJECT_ID
+from memobase_server.env import CONFIG
+from memobase_server.utils import encode_cursor, decode_cursor
 
 
 @pytest.mark.asyncio
@@ -133,3 +140,165 @@ async def test_user_blob_curd(db_env):
         u_id, DEFAULT_PROJECT_ID, BlobType.chat
     )
     assert len(p.data().ids) == 0
+
+
+@pytest.mark.asyncio
+async def test_user_blob_keyset_pagination(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    b_ids = []
+    for i in range(5):
+        p = await controllers.blob.insert_blob(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            res.BlobData(blob_type=BlobType.doc, blob_data={"content": f"doc {i}"}),
+        )
+        assert p.ok()
+        b_ids.append(p.data().id)
+
+    scanned = []
+    cursor = None
+    while True:
+        p = await controllers.user.get_user_all_blobs(
+            u_id, DEFAULT_PROJECT_ID, BlobType.doc, page_size=2, cursor=cursor
+        )
+        assert p.ok()
+        scanned.extend(p.data().ids)
+        cursor = p.data().next_cursor
+        if cursor is None:
+            break
+    assert scanned == b_ids
+
+    p = await controllers.user.get_user_all_blobs(
+        u_id, DEFAULT_PROJECT_ID, BlobType.doc, cursor="not-a-cursor"
+    )
+    assert not p.ok()
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+def test_decode_cursor():
+    now = datetime.now(timezone.utc)
+    id = uuid.uuid4()
+    assert decode_cursor(encode_cursor(now, id)) == (now, id)
+    for value in [["2024-01-01T00:00:00", 123], ["2024-01-01T00:00:00"], {"a": 1}]:
+        cursor = base64.urlsafe_b64encode(orjson.dumps(value)).decode()
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+@pytest.mark.asyncio
+async def test_stale_flush_job(db_env):
+    job = await controllers.job.FlushJob.create(
+        "user-1", DEFAULT_PROJECT_ID, BlobType.chat
+    )
+    async with job.stage("extract"):
+        pass
+    p = await controllers.job.get_flush_job("user-1", DEFAULT_PROJECT_ID, job.data.id)
+    assert p.ok() and p.data().status == res.FlushJobStatus.running
+
+    # The worker died, nobody reports the job anymore
+    with patch.object(CONFIG, "flush_job_stale_after", -1):
+        p = await controllers.job.get_flush_job(
+            "user-1", DEFAULT_PROJECT_ID, job.data.id
+        )
+        assert p.ok() and p.data().status == res.FlushJobStatus.failed
+
+    with patch.object(CONFIG, "flush_job_stream_timeout", 0):
+        updates = [
+            p
+            async for p in controllers.job.watch_flush_job(
+                "user-1", DEFAULT_PROJECT_ID, job.data.id
+            )
+        ]
+    assert updates == []
+
+
+@pytest.mark.asyncio
+async def test_user_event_compaction(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    deltas = [
+        ("work", "title", "Engineer"),
+        ("work", "title", "Senior engineer"),
+        ("interest", "sports", "Tennis"),
+        ("work", "title", "Engineer"),
+    ]
+    for topic, sub_topic, content in deltas:
+        p = await controllers.event.append_user_event(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            {
+                "profile_delta": [
+                    {
+                        "content": content,
+                        "attributes": {"topic": topic, "sub_topic": sub_topic},
+                    }
+                ]
+            },
+        )
+        assert p.ok()
+
+    p = await controllers.event.compact_user_events(
+        u_id, DEFAULT_PROJECT_ID, datetime.now(timezone.utc) + timedelta(seconds=1)
+    )
+    assert p.ok()
+    assert p.data() == 4
+
+    p = await controllers.event.get_user_events(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    events = p.data().events
+    assert len(events) == 1
+    merged = {
+        d.attributes["sub_topic"]: d.content for d in events[0].event_data.profile_delta
+    }
+    assert merged == {"title": "Engineer; Senior engineer", "sports": "Tennis"}
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_user_profiles_bulk_update(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["Engineer", "Tennis"],
+        [
+            {"topic": "work", "sub_topic": "title"},
+            {"topic": "interest", "sub_topic": "sports"},
+        ],
+    )
+    assert p.ok()
+    work_id, sports_id = p.data().ids
+
+    missing_id = uuid.uuid4()
+    p = await controllers.profile.update_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        [work_id, sports_id, missing_id],
+        ["Senior engineer", "Tennis, golf", "Nothing"],
+        [None, {"topic": "interest", "sub_topic": "ball games"}, None],
+    )
+    assert p.ok()
+    assert set(p.data().ids) == {work_id, sports_id}
+
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    profiles = {pf.id: pf for pf in p.data().profiles}
+    assert profiles[work_id].content == "Senior engineer"
+    assert profiles[work_id].attributes == {"topic": "work", "sub_topic": "title"}
+    assert profiles[sports_id].content == "Tennis, golf"
+    assert profiles[sports_id].attributes["sub_topic"] == "ball games"
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
@@ -1,10 +1,18 @@
 import pytest
+from datetime import datetime, timezone
 from sqlalchemy.inspection import inspect
-from memobase_server.models.database import User, GeneralBlob, UserProfile
+from memobase_server.models.database import User, GeneralBlob, UserProfile, BufferZone
+from memobase_server.models.partition import (
+    month_start,
+    create_month_partitions,
+    drop_expired_partitions,
+)
 from memobase_server.models.blob import BlobType
 from memobase_server.connectors import (
     Session,
     DB_ENGINE,
+    statement_name,
+    pool_sizes,
 )
 
 
@@ -14,6 +22,30 @@ def test_correct_tables(db_env):
     assert "general_blobs" in db_inspector.get_table_names()
 
 
+def test_statement_name():
+    assert (
+        statement_name(
+            "SELECT anon_1.id FROM (SELECT user_events.id FROM user_events) AS anon_1"
+        )
+        == "SELECT user_events"
+    )
+    assert statement_name("INSERT INTO user_profiles (id) VALUES (%s)") == (
+        "INSERT user_profiles"
+    )
+    assert statement_name("SELECT 1") == "SELECT other"
+    assert statement_name("SET LOCAL enable_seqscan = off") == "OTHER other"
+
+
+def test_pool_sizes():
+    assert pool_sizes(80, 1) == (50, 30)
+    assert pool_sizes(80, 4) == (12, 8)
+    for workers in (3, 7, 16):
+        pool_size, max_overflow = pool_sizes(80, workers)
+        assert (pool_size + max_overflow) * workers <= 80
+    # Every worker keeps a connection, even past the budget
+    assert pool_sizes(80, 64) == (1, 1)
+
+
 def test_user_model(db_env):
     with Session() as session:
         user = User(additional_fields={"name": "Gus"})
@@ -49,3 +81,37 @@ def test_general_blob_model(db_env):
         user = session.query(User).filter_by(id=test_user_id).first()
         session.delete(user)
         session.commit()
+
+
+def test_drop_expired_blob_partition(db_env):
+    old = datetime(2001, 1, 15, tzinfo=timezone.utc)
+    with DB_ENGINE.begin() as conn:
+        create_month_partitions(conn, "general_blobs", old, month_start(old, 1))
+    with Session() as session:
+        user = User(additional_fields={"name": "partition_user"})
+        session.add(user)
+        session.commit()
+        blob = GeneralBlob(blob_type=BlobType.chat, blob_data={}, user_id=user.id)
+        blob.created_at = old
+        session.add(blob)
+        session.flush()
+        session.add(
+            BufferZone(
+                blob_type=BlobType.chat, token_size=1, user_id=user.id, blob_id=blob.id
+            )
+        )
+        session.commit()
+        user_id, blob_id = user.id, blob.id
+
+    with DB_ENGINE.begin() as conn:
+        expired = drop_expired_partitions(
+            conn, "general_blobs", 1, "drop", datetime(2001, 6, 1, tzinfo=timezone.utc)
+        )
+    assert "general_blobs_p200101" in expired
+
+    # The buffered rows of the dropped blobs go with them
+    with Session() as session:
+        assert session.query(BufferZone).filter_by(blob_id=blob_id).count() == 0
+        user = session.query(User).filter_by(id=user_id).first()
+        session.delete(user)
+        session.commit()
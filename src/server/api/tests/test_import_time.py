@@ -0,0 +1,44 @@
+import os
+import json
+import sys
+import subprocess
+
+# Generous for slow CI runners, imports take ~1s on a laptop
+IMPORT_BUDGET_SECONDS = 3.0
+
+IMPORT_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import memobase_server.controllers
+import api
+seconds = time.perf_counter() - start
+from memobase_server.telemetry import telemetry_manager
+print(json.dumps({
+    "seconds": seconds,
+    "telemetry_started": telemetry_manager._meter is not None,
+    "heavy_modules": [m for m in ("tiktoken", "openai") if m in sys.modules],
+}))
+"""
+
+
+def test_import_is_fast_and_side_effect_free():
+    # Nothing listens on port 1, so importing must not touch the database or redis
+    env = {
+        **os.environ,
+        "DATABASE_URL": "postgresql+psycopg2://memobase@127.0.0.1:1/memobase",
+        "REDIS_URL": "redis://127.0.0.1:1",
+    }
+    r = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert r.returncode == 0, r.stderr
+    # The startup banner is printed before, the result is the last line
+    result = json.loads(r.stdout.strip().split("\n")[-1])
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS
+    assert not result["telemetry_started"]
+    assert result["heavy_modules"] == []
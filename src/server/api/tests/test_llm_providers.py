@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from memobase_server.env import CONFIG
+from memobase_server.llms import utils as llm_utils
+from memobase_server.llms.providers import (
+    LLMProvider,
+    ProviderPool,
+    ProviderUnavailable,
+    MIN_HEDGE_SAMPLES,
+)
+
+
+def fake_call(behaviours: dict[str, list]):
+    """Each provider takes its next behaviour: an exception to raise, or a delay to answer after"""
+    calls = []
+
+    async def call(provider: LLMProvider) -> str:
+        calls.append(provider.name)
+        behaviour = behaviours[provider.name].pop(0)
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        await asyncio.sleep(behaviour)
+        return provider.name
+
+    return call, calls
+
+
+@pytest.mark.asyncio
+async def test_provider_failover_and_circuit_breaker():
+    pool = ProviderPool([LLMProvider("a", None), LLMProvider("b", None)])
+    call, calls = fake_call(
+        {"a": [ConnectionError("down")] * 2, "b": [0, 0, 0, ValueError("bad")]}
+    )
+    with patch.object(CONFIG, "llm_circuit_breaker_failures", 2):
+        assert await pool.complete(call, "k") == "b"
+        assert await pool.complete(call, "k") == "b"
+        # a failed twice in a row, its circuit is open
+        assert not pool.providers[0].available()
+        assert await pool.complete(call, "k") == "b"
+        assert calls == ["a", "b", "a", "b", "b"]
+
+        # A bad request is raised as is, no failover and no circuit change
+        with pytest.raises(ValueError):
+            await pool.complete(
+                call, "k", is_failure=lambda e: not isinstance(e, ValueError)
+            )
+        assert pool.providers[1].failures == 0
+
+        with patch.object(CONFIG, "llm_circuit_breaker_cooldown", 0):
+            assert pool.providers[0].available()
+
+    pool.providers[1].opened_at = pool.providers[0].opened_at
+    with pytest.raises(ProviderUnavailable):
+        await pool.complete(call, "k")
+
+
+@pytest.mark.asyncio
+async def test_hedged_requests():
+    pool = ProviderPool([LLMProvider("a", None), LLMProvider("b", None)])
+    pool.providers[1].latency = 1.0  # b is slower, a takes the calls
+    call, calls = fake_call({"a": [0] * MIN_HEDGE_SAMPLES + [1], "b": [0]})
+    for _ in range(MIN_HEDGE_SAMPLES):
+        await pool.complete(call, "k")
+    with patch.object(CONFIG, "llm_hedge_requests", True):
+        assert pool.hedge_delay("k") is not None
+        assert pool.hedge_delay("other") is None
+        # a hangs past the p95, the hedge on b answers first
+        assert await pool.complete(call, "k") == "b"
+    assert calls[-2:] == ["a", "b"]
+
+
+@patch.object(CONFIG, "llm_api_key", "k")
+def test_lone_provider_keeps_sdk_retries():
+    with patch.object(llm_utils, "_global_openai_provider_pool", None):
+        pool = llm_utils.get_openai_provider_pool()
+        assert [p.client.max_retries for p in pool.providers] == [
+            llm_utils.OPENAI_SDK_MAX_RETRIES
+        ]
+    extra = {"name": "backup", "base_url": "http://backup/v1", "api_key": "k"}
+    with patch.object(llm_utils, "_global_openai_provider_pool", None), patch.object(
+        CONFIG, "llm_providers", [extra]
+    ):
+        pool = llm_utils.get_openai_provider_pool()
+        # Failing over to the other provider replaces the retries
+        assert [p.client.max_retries for p in pool.providers] == [0, 0]
@@ -0,0 +1,27 @@
+import os
+from types import SimpleNamespace
+from memobase_server.llms.prompt_cache import build_messages, get_cached_tokens
+from memobase_server.prompts import organize_profile
+
+
+def test_get_cached_tokens():
+    openai_usage = SimpleNamespace(
+        prompt_tokens=2048,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=1920),
+    )
+    assert get_cached_tokens(openai_usage) == 1920
+    assert get_cached_tokens(SimpleNamespace(prompt_cache_hit_tokens=64)) == 64
+    assert get_cached_tokens(SimpleNamespace(prompt_tokens_details=None)) == 0
+    assert get_cached_tokens(None) == 0
+
+
+def test_static_prefix_first():
+    messages = build_messages(
+        "chats", "system", [{"role": "assistant", "content": "history"}]
+    )
+    assert [m["content"] for m in messages] == ["system", "history", "chats"]
+
+    # The suggested sub_topics of a topic come after the shared part of the prompt
+    a = organize_profile.get_prompt(8, "- adventure")
+    b = organize_profile.get_prompt(8, "- weather")
+    assert len(os.path.commonprefix([a, b])) > len(a) * 0.9
@@ -0,0 +1,63 @@
+import uuid
+import pytest
+from sqlalchemy import select, func
+from memobase_server.connectors import DB_ENGINE
+from memobase_server.models.blob import BlobType
+from memobase_server.models.database import (
+    BufferZone,
+    UserProfile,
+    UserEvent,
+    DEFAULT_PROJECT_ID,
+)
+
+USER_ID = str(uuid.uuid4())
+BUFFER_FILTER = dict(
+    user_id=USER_ID, blob_type=str(BlobType.chat), project_id=DEFAULT_PROJECT_ID
+)
+USER_FILTER = dict(user_id=USER_ID, project_id=DEFAULT_PROJECT_ID)
+
+HOT_QUERIES = {
+    "buffer_flush_scan": select(BufferZone)
+    .filter_by(**BUFFER_FILTER)
+    .order_by(BufferZone.created_at),
+    "buffer_token_size": select(func.sum(BufferZone.token_size)).filter_by(
+        **BUFFER_FILTER
+    ),
+    "buffer_last_created_at": select(func.max(BufferZone.created_at)).filter_by(
+        **BUFFER_FILTER
+    ),
+    "profiles_by_updated_at": select(UserProfile)
+    .filter_by(**USER_FILTER)
+    .order_by(UserProfile.updated_at.desc()),
+    "events_by_created_at": select(UserEvent)
+    .filter_by(**USER_FILTER)
+    .order_by(UserEvent.created_at.desc(), UserEvent.id.desc())
+    .limit(10),
+}
+
+
+def plan_node_types(plan: dict):
+    yield plan["Node Type"]
+    for child in plan.get("Plans", []):
+        yield from plan_node_types(child)
+
+
+def explain(stmt) -> list[str]:
+    compiled = stmt.compile(dialect=DB_ENGINE.dialect)
+    with DB_ENGINE.connect() as conn:
+        # Tables are tiny in tests, make the planner pick an index whenever it can
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        conn.exec_driver_sql("SET LOCAL enable_sort = off")
+        plan = conn.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+        ).scalar()
+        conn.rollback()
+    return list(plan_node_types(plan[0]["Plan"]))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", list(HOT_QUERIES))
+async def test_hot_query_uses_index(db_env, name):
+    node_types = explain(HOT_QUERIES[name])
+    assert "Seq Scan" not in node_types, f"{name}: {node_types}"
+    assert "Sort" not in node_types, f"{name}: {node_types}"
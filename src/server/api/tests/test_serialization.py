@@ -0,0 +1,31 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from fastapi.encoders import jsonable_encoder
+from memobase_server.models import response as res
+from memobase_server.models.utils import Promise
+
+
+def build_profiles(size: int) -> res.UserProfilesData:
+    now = datetime.now(timezone.utc)
+    return res.UserProfilesData(
+        profiles=[
+            {
+                "id": uuid.uuid4(),
+                "content": f"user likes to play basketball with friends {i}" * 4,
+                "attributes": {"topic": "interest", "sub_topic": f"sports_{i}"},
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(size)
+        ]
+    )
+
+
+def test_orjson_response_matches_default_encoder():
+    profiles = build_profiles(10)
+    p = Promise.resolve(profiles)
+    model = p.to_response(res.UserProfileResponse)
+    default_body = json.dumps(jsonable_encoder(model))
+    orjson_body = p.to_json_response(res.UserProfileResponse).body
+    assert json.loads(orjson_body) == json.loads(default_body)
@@ -0,0 +1,42 @@
+import orjson
+import pytest
+from unittest.mock import patch
+from opentelemetry import trace
+from memobase_server.models.utils import Promise
+from memobase_server.models.response import CODE
+from memobase_server.telemetry import open_telemetry, traced
+
+
+@traced()
+async def load_thing(project_id: str) -> Promise[None]:
+    return Promise.reject(CODE.NOT_FOUND, "thing not found")
+
+
+@traced("flush")
+async def flush_thing(user_id: str, project_id: str) -> Promise[None]:
+    return await load_thing(project_id)
+
+
+@pytest.mark.asyncio
+async def test_traced_spans(tmp_path):
+    file_path = tmp_path / "spans.jsonl"
+    manager = open_telemetry.TelemetryManager()
+    manager.setup_tracing("file", file_path=str(file_path))
+    with patch.object(open_telemetry, "telemetry_manager", manager):
+        p = await flush_thing("user-1", project_id="project-1")
+    assert not p.ok()
+    trace.get_tracer_provider().force_flush()
+
+    spans = {}
+    for line in file_path.read_text().splitlines():
+        span = orjson.loads(line)
+        spans[span["name"]] = span
+    assert set(spans) == {"flush", "test_tracing.load_thing"}
+    for span in spans.values():
+        assert span["attributes"]["memobase.project_id"] == "project-1"
+        assert span["status"]["status_code"] == "ERROR"
+    assert "thing not found" in spans["flush"]["status"]["description"]
+
+    parent, child = spans["flush"], spans["test_tracing.load_thing"]
+    assert child["context"]["trace_id"] == parent["context"]["trace_id"]
+    assert child["parent_id"] == parent["context"]["span_id"]